@@ -1,14 +1,38 @@
 import os
-import csv
 import secrets
-from io import StringIO
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response
-from flask_mysqldb import MySQL
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, g
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-from functools import wraps
+from functools import partial, wraps
+import click
 import datetime
+import math
 import re
+import threading
+import time
+
+import assets
+import warmup
+from cache import Cache, CachedPage
+from db import MySQLPool
+from exports import parse_date_range, stream_csv
+from fanout import FanOut, FanOutTimeout
+import blog_search
+import chat
+import migrations
+import rollups
+import user_search
+import passwords
+from passwords import HasherBusy, PasswordHasher
+from pagination import MAX_OFFSET_PAGE, Keyset, decode_cursor, encode_cursor, paginate
+import rows
+from rows import fetchall, fetchone
+from profiler import QueryProfiler
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+from view_counter import ViewCounter
+from contact_queue import ContactQueue, one_line
+import mailer
+from ratelimit import Limit, RateLimiter
 
 # Load environment variables
 load_dotenv()
@@ -17,13 +41,147 @@ load_dotenv()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# nginx / Render sit in front: take the client address from X-Forwarded-For.
+# Set TRUSTED_PROXIES=0 when the app is reachable directly.
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 1))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+# Compiled templates are kept on disk and shared by every worker
+app.jinja_options = {**app.jinja_options, 'bytecode_cache': warmup.bytecode_cache(
+    os.getenv('TEMPLATE_CACHE_DIR', os.path.join(app.root_path, '.template-cache')))}
+
+# Pages each gunicorn worker renders once before taking traffic
+app.config['WARMUP_PATHS'] = ['/', '/pricing', '/features', '/about', '/faq', '/contact', '/blog']
+app.config['WARMUP_BUDGET'] = float(os.getenv('WARMUP_BUDGET', 10))
+
 # MySQL Configuration
 app.config['MYSQL_HOST'] = os.getenv('DB_HOST', 'localhost')
 app.config['MYSQL_USER'] = os.getenv('DB_USER', 'root')
 app.config['MYSQL_PASSWORD'] = os.getenv('DB_PASSWORD', '')
 app.config['MYSQL_DB'] = os.getenv('DB_NAME', 'balansai')
-
-mysql = MySQL(app)
+app.config['MYSQL_PORT'] = int(os.getenv('DB_PORT', 3306))
+
+# Connection pool (per gunicorn worker). A worker needs one connection per
+# request it serves at once (WORKER_CONCURRENCY, exported by gunicorn.conf.py),
+# one per fan-out thread, and one each for the view counter and contact queue
+# threads; requests hand theirs back before fanning out.
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 1))
+DB_FANOUT_WORKERS = int(os.getenv('DB_FANOUT_WORKERS', 4))
+DB_POOL_NEEDED = WORKER_CONCURRENCY + DB_FANOUT_WORKERS + 2
+app.config['MYSQL_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', DB_POOL_NEEDED))
+if app.config['MYSQL_POOL_SIZE'] < DB_POOL_NEEDED:
+    raise RuntimeError(
+        f"DB_POOL_SIZE={app.config['MYSQL_POOL_SIZE']} is too small: {WORKER_CONCURRENCY} concurrent "
+        f"requests + {DB_FANOUT_WORKERS} fan-out threads + 2 background threads need {DB_POOL_NEEDED} "
+        f"connections per worker. Raise it, or leave it unset to use that number."
+    )
+app.config['MYSQL_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 10))
+app.config['MYSQL_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 3600))
+
+mysql = MySQLPool(app)
+
+# Per-request SQL timing: Server-Timing header, slow/N+1 query log, /admin/db-profile
+profiler = QueryProfiler(directory=os.getenv('CACHE_DIR'),
+                         slow_query=float(os.getenv('SQL_SLOW_QUERY_MS', 100)) / 1000,
+                         repeat_threshold=int(os.getenv('SQL_REPEAT_THRESHOLD', 5)))
+if os.getenv('SQL_PROFILE', '1') == '1':
+    profiler.init_app(app)
+
+# Prometheus metrics merged over all workers, served on /metrics
+metrics = Metrics(directory=os.getenv('CACHE_DIR'),
+                  flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', 5)))
+if os.getenv('METRICS', '1') == '1':
+    metrics.init_app(app)
+
+# Fingerprinted static URLs from the `flask build-assets` manifest
+assets.init_app(app)
+
+# Independent reads of one page run in parallel, each on its own connection
+fanout = FanOut(app, mysql,
+                max_workers=DB_FANOUT_WORKERS,
+                timeout=float(os.getenv('DB_FANOUT_TIMEOUT', 5)))
+
+# Blog views are buffered per worker and flushed in batches
+view_counter = ViewCounter(mysql, flush_interval=float(os.getenv('VIEW_FLUSH_INTERVAL', 5)))
+
+# Read-model cache, invalidated by the admin write routes
+cache = Cache(os.getenv('CACHE_DIR'))
+CACHE_TTL = int(os.getenv('CACHE_TTL', 300))
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 3600))
+COUNT_CACHE_TTL = int(os.getenv('COUNT_CACHE_TTL', 60))
+
+# Rendered pages and their compressed copies, kept apart from the read models
+# so they can't push those out. Keys are endpoint + path, so there is one
+# entry per page whatever the query string or Host header.
+pages = Cache(os.getenv('CACHE_DIR'), max_entries=256)
+
+# Origin for absolute URLs (canonical/og tags, sitemaps); never taken from the
+# Host header, which would end up in cached pages
+SITE_URL = os.getenv('SITE_URL', 'https://balansai.uz').rstrip('/')
+
+# Contact form: accepted into a local spool, written to MySQL in batches by a
+# background thread, then the team is emailed at CONTACT_EMAIL
+contact_queue = ContactQueue(
+    mysql, os.getenv('CONTACT_QUEUE_DIR', os.path.join(app.root_path, '.contact-queue')),
+    transport=mailer.load_transport(os.getenv('MAIL_TRANSPORT', 'file')),
+    notify_to=os.getenv('CONTACT_EMAIL') or None,
+    notify_from=os.getenv('MAIL_FROM') or None,
+    flush_interval=float(os.getenv('CONTACT_FLUSH_INTERVAL', 2)),
+    duplicate_window=int(os.getenv('CONTACT_DUPLICATE_WINDOW', 86400)),
+    on_written=lambda count: cache.invalidate('contacts'),
+)
+app.extensions['contact_queue'] = contact_queue
+CONTACT_MAX_NAME = 255
+CONTACT_MAX_MESSAGE = 5000
+
+# Login, registration and contact form POSTs, per client IP and per account,
+# with buckets shared by all workers through CACHE_DIR
+limiter = RateLimiter(os.getenv('CACHE_DIR'), enabled=os.getenv('RATE_LIMIT', '1') == '1',
+                      secret=app.config['SECRET_KEY'])
+
+# Per-user profiles, checked on every authenticated request. Generations are
+# re-read on each lookup (one stat) so an admin's block applies immediately.
+profiles = Cache(os.getenv('CACHE_DIR'), max_entries=10000, check_interval=0)
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 3600))
+PROFILE_TAG_PRUNE_INTERVAL = 3600
+
+# Values of users.plan_type
+USER_PLANS = ('free', 'basic', 'premium')
+
+# Listing sort orders used for keyset pagination
+BLOG_KEYSET = Keyset([('published_at', 'DESC'), ('id', 'DESC')])
+USERS_KEYSET = Keyset([('created_at', 'DESC'), ('id', 'DESC')])
+PAYMENTS_KEYSET = Keyset([('p.created_at', 'DESC'), ('p.id', 'DESC')])
+CONTACTS_KEYSET = Keyset([('is_read', 'ASC'), ('created_at', 'DESC'), ('id', 'DESC')])
+ADMIN_BLOG_KEYSET = Keyset([('created_at', 'DESC'), ('id', 'DESC')])
+MESSAGES_KEYSET = Keyset([('m.created_at', 'DESC'), ('m.id', 'DESC')])
+
+# Password hashing runs in a small process pool per worker
+hasher = PasswordHasher(method=os.getenv('PASSWORD_HASH_METHOD', passwords.DEFAULT_METHOD),
+                        processes=int(os.getenv('PASSWORD_HASH_PROCESSES', 2)),
+                        queue_size=int(os.getenv('PASSWORD_HASH_QUEUE', 16)))
+
+# AI assistant: model adapter and the per-worker cap on open reply streams.
+# A stream holds one of the worker's WORKER_CONCURRENCY threads (or greenlets)
+# for the whole reply, so the cap leaves at least one for every other route;
+# a sync worker, which has only the one, doesn't stream at all.
+chat_backend = chat.load_backend(os.getenv('CHAT_BACKEND', 'stub'))
+CHAT_MAX_STREAMS = int(os.getenv('CHAT_MAX_STREAMS', WORKER_CONCURRENCY - 1))
+if CHAT_MAX_STREAMS >= WORKER_CONCURRENCY:
+    raise RuntimeError(
+        f"CHAT_MAX_STREAMS={CHAT_MAX_STREAMS} would let chat replies take all {WORKER_CONCURRENCY} "
+        f"request slots of a worker. Lower it below that, or leave it unset to use "
+        f"{WORKER_CONCURRENCY - 1}."
+    )
+if CHAT_MAX_STREAMS <= 0:
+    app.logger.warning("Chat replies are disabled: a worker serving %d request(s) at once can't "
+                       "spare one for a stream (use the gthread or gevent worker class)",
+                       WORKER_CONCURRENCY)
+chat_streams = threading.BoundedSemaphore(max(CHAT_MAX_STREAMS, 0))
+CHAT_HISTORY_MESSAGES = 20
+CHAT_WINDOW = 30
+CHAT_MAX_MESSAGE_LENGTH = 4000
 
 # ============ DECORATORS ============
 
@@ -37,6 +195,27 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def rate_limited(template, ip, account=None, field='email'):
+    """Token buckets for a form's POSTs: ``ip`` per client address and
+    ``account`` per submitted ``field`` value; 429 with Retry-After when empty"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method == 'POST':
+                rules = [(f'{f.__name__}:ip:{request.remote_addr}', ip)]
+                name = request.form.get(field, '').strip().lower()
+                if account is not None and name:
+                    rules.append((f'{f.__name__}:account:{name}', account))
+                wait = limiter.hit(rules)
+                if wait:
+                    metrics.inc('rate_limited_total', {'endpoint': request.endpoint})
+                    retry_after = math.ceil(wait)
+                    flash(f'Urinishlar juda ko\'p. {retry_after} soniyadan keyin qayta urinib ko\'ring', 'error')
+                    return render_template(template), 429, {'Retry-After': str(retry_after)}
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
 def login_required(f):
     """User authentication decorator"""
     @wraps(f)
@@ -44,9 +223,74 @@ def login_required(f):
         if 'user_id' not in session:
             flash('Iltimos, avval tizimga kiring', 'error')
             return redirect(url_for('user_login'))
+
+        user = get_user_profile(session['user_id'])
+        if user is None or not user.is_active:
+            # Deleted or blocked by an admin since logging in
+            session.clear()
+            if user is None:
+                flash('Iltimos, avval tizimga kiring', 'error')
+            else:
+                flash('Hisobingiz bloklangan. Iltimos, administrator bilan bog\'laning', 'error')
+            return redirect(url_for('user_login'))
+
+        g.user = user
+        # Keep the navbar in step with renames made by an admin
+        if session.get('user_name') != user.full_name:
+            session['user_name'] = user.full_name
         return f(*args, **kwargs)
     return decorated_function
 
+def cached_page(f):
+    """Full-response cache with ETag/304 for anonymous visits to pages that don't touch the DB"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Pending flash messages are rendered into the page, and the navbar
+        # shows the logged-in user's name: render those directly
+        if session.get('_flashes') or 'user_id' in session:
+            return f(*args, **kwargs)
+
+        # The query string doesn't change these pages, so it isn't part of the key
+        page = pages.get_or_load(f'page:{request.endpoint}:{request.path}',
+                                 lambda: CachedPage(f(*args, **kwargs)),
+                                 ttl=PAGE_CACHE_TTL, tags=('pages',))
+        return page.make_response(request, 'public, no-cache')
+    return decorated_function
+
+# ============ TEMPLATE GLOBALS ============
+
+@app.context_processor
+def inject_site_settings():
+    return {'site': get_site_settings()}
+
+@app.template_global()
+def external_url(endpoint, **values):
+    """Absolute URL on SITE_URL"""
+    return SITE_URL + url_for(endpoint, **values)
+
+@app.template_global()
+def canonical_url():
+    """This page on SITE_URL, without the query string"""
+    return SITE_URL + request.path
+
+@app.template_filter('price')
+def format_price(value):
+    """99000 -> 99,000"""
+    try:
+        return f"{int(value):,}"
+    except (TypeError, ValueError):
+        return value
+
+@app.template_filter('tel')
+def format_tel(value):
+    """'+998 90 123 45 67' -> '+998901234567' for tel: links"""
+    return re.sub(r'[^\d+]', '', value or '')
+
+@app.template_filter('telegram_handle')
+def telegram_handle(link):
+    """'https://t.me/balansai' -> 'balansai'"""
+    return (link or '').rstrip('/').rsplit('/', 1)[-1]
+
 # ============ HELPER FUNCTIONS ============
 
 def validate_email(email):
@@ -66,11 +310,16 @@ def validate_password(password):
         return False, "Parolda kamida bitta raqam bo'lishi kerak"
     return True, "OK"
 
+def busy_response(template):
+    """Re-render a form with 503 when password hashing is saturated"""
+    flash('Server hozir band. Iltimos, birozdan keyin qayta urinib ko\'ring', 'error')
+    return render_template(template), 503, {'Retry-After': '2'}
+
 def generate_slug(title):
     """Generate URL-friendly slug from title"""
     uzbek_chars = {
         'o\'': 'o', 'g\'': 'g', 'sh': 'sh', 'ch': 'ch',
-        'ʻ': '', ''': '', '"': '', '"': ''
+        'ʻ': '', '\u2019': '', '\u201c': '', '\u201d': ''
     }
     slug = title.lower()
     for uz, lat in uzbek_chars.items():
@@ -79,62 +328,198 @@ def generate_slug(title):
     slug = re.sub(r'-+', '-', slug)
     return slug.strip('-')
 
-# ============ PUBLIC ROUTES ============
+# ============ READ MODELS ============
+# Loaders for data that only changes through the admin panel; results are
+# cached by the routes and invalidated via cache.invalidate('blog'/'testimonials').
 
-@app.route('/')
-def index():
-    """Bosh sahifa"""
+def load_user_profile(user_id):
+    cursor = mysql.connection.cursor()
+    cursor.execute(f"SELECT {rows.UserProfile.columns} FROM users WHERE id = %s", (user_id,))
+    profile = fetchone(cursor, rows.UserProfile)
+    cursor.close()
+    return profile
+
+def get_user_profile(user_id):
+    """Cached profile of a user, or None if the account no longer exists"""
+    return profiles.get_or_load(f'user:{user_id}', lambda: load_user_profile(user_id),
+                                ttl=PROFILE_CACHE_TTL, tags=(f'user-{user_id}',))
+
+_profile_tags_pruned_at = time.monotonic()
+
+def invalidate_user_profile(user_id):
+    global _profile_tags_pruned_at
+    profiles.invalidate(f'user-{user_id}')
+    # Every login writes a tag file; drop those of users who have been away
+    # for a while so CACHE_DIR doesn't grow with the users table
+    now = time.monotonic()
+    if now - _profile_tags_pruned_at > PROFILE_TAG_PRUNE_INTERVAL:
+        _profile_tags_pruned_at = now
+        profiles.prune('user-', max_age=2 * PROFILE_CACHE_TTL)
+
+# Fallbacks for settings rows that are missing from the table
+DEFAULT_SETTINGS = {
+    'site_title': 'BalansAI.uz',
+    'site_description': 'AI yordamchi biznesingiz uchun',
+    'free_plan_price': '0',
+    'basic_plan_price': '99000',
+    'premium_plan_price': '299000',
+    'contact_email': 'info@balansai.uz',
+    'telegram_link': 'https://t.me/balansai',
+    'phone_number': '+998 90 123 45 67',
+}
+
+def load_site_settings():
     cursor = mysql.connection.cursor()
+    cursor.execute("SELECT key_name, value FROM settings")
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update((key, value) for key, value in cursor.fetchall() if value is not None)
+    cursor.close()
+    return settings
 
-    # Get testimonials
-    cursor.execute("""
-        SELECT * FROM testimonials
+def get_site_settings():
+    """Process-wide copy of the settings table.
+
+    Loaded once per worker; the 'settings' tag generation acts as the
+    settings version, so a save in any worker reloads it everywhere. Every
+    template reads it, including pages that don't otherwise touch MySQL and
+    the error pages, so while the database is unreachable the defaults are
+    served (and the load retried after the cache's error_ttl) instead.
+    """
+    return cache.get_or_load('settings', load_site_settings, ttl=PAGE_CACHE_TTL, tags=('settings',),
+                             default=DEFAULT_SETTINGS)
+
+def load_home_testimonials():
+    cursor = mysql.connection.cursor()
+    cursor.execute(f"""
+        SELECT {rows.Testimonial.columns} FROM testimonials
         WHERE is_active = 1
         ORDER BY display_order ASC, created_at DESC
         LIMIT 6
     """)
-    testimonials = cursor.fetchall()
+    testimonials = fetchall(cursor, rows.Testimonial)
+    cursor.close()
+    return testimonials
 
-    # Get latest blog posts
-    cursor.execute("""
-        SELECT * FROM blog_posts
+def load_home_blog_posts():
+    cursor = mysql.connection.cursor()
+    cursor.execute(f"""
+        SELECT {rows.BlogCard.columns} FROM blog_posts
         WHERE is_published = 1
         ORDER BY published_at DESC
         LIMIT 3
     """)
-    blog_posts = cursor.fetchall()
+    blog_posts = fetchall(cursor, rows.BlogCard)
+    cursor.close()
+    return blog_posts
 
+def load_blog_count(category):
+    cursor = mysql.connection.cursor()
+    if category:
+        cursor.execute("""
+            SELECT COUNT(*) FROM blog_posts
+            WHERE is_published = 1 AND category = %s
+        """, (category,))
+    else:
+        cursor.execute("SELECT COUNT(*) FROM blog_posts WHERE is_published = 1")
+    total = cursor.fetchone()[0]
     cursor.close()
+    return total
+
+def load_blog_page(category, per_page, page, after, before):
+    cursor = mysql.connection.cursor()
+    query = f"SELECT {rows.BlogCard.columns} FROM blog_posts WHERE is_published = 1"
+    params = []
+    if category:
+        query += " AND category = %s"
+        params.append(category)
+    result = paginate(cursor, query, params, BLOG_KEYSET,
+                      key=lambda post: (post.published_at, post.id),
+                      per_page=per_page, page=page, after=after, before=before,
+                      row_type=rows.BlogCard)
+    cursor.close()
+    return result
+
+def load_dashboard_totals():
+    cursor = mysql.connection.cursor()
+    totals = rollups.totals(cursor)
+    cursor.close()
+    return totals
+
+def load_dashboard_series(column, start, end, granularity, running=False):
+    cursor = mysql.connection.cursor()
+    series = rollups.running_series if running else rollups.series
+    data = series(cursor, column, start, end, granularity)
+    cursor.close()
+    return data
+
+def fanout_or_partial(tasks, empty):
+    """Results of ``fanout.run(tasks)``; on a timeout the late ones are
+    ``empty`` so the page still renders, just without those widgets"""
+    try:
+        return fanout.run(tasks).results
+    except FanOutTimeout as e:
+        app.logger.error("Rendering %s without %s: %s", request.endpoint, ', '.join(e.late), e)
+        return {**dict.fromkeys(tasks, empty), **e.results}
+
+def count_rows(name, loader, tag):
+    """Row count for a listing, cached for COUNT_CACHE_TTL and dropped on writes"""
+    return cache.get_or_load(f'count:{name}', loader, ttl=COUNT_CACHE_TTL, tags=(tag,))
+
+def load_blog_categories():
+    cursor = mysql.connection.cursor()
+    cursor.execute("""
+        SELECT DISTINCT category FROM blog_posts
+        WHERE is_published = 1 AND category IS NOT NULL
+    """)
+    categories = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return categories
+
+# ============ PUBLIC ROUTES ============
+
+@app.route('/')
+def index():
+    """Bosh sahifa"""
+    testimonials = cache.get_or_load('home:testimonials', load_home_testimonials,
+                                     ttl=CACHE_TTL, tags=('testimonials',))
+    blog_posts = cache.get_or_load('home:blog_posts', load_home_blog_posts,
+                                   ttl=CACHE_TTL, tags=('blog',))
 
     return render_template('pages/index.html',
                          testimonials=testimonials,
                          blog_posts=blog_posts)
 
 @app.route('/about')
+@cached_page
 def about():
     """Biz haqimizda"""
     return render_template('pages/about.html')
 
 @app.route('/features')
+@cached_page
 def features():
     """Imkoniyatlar"""
     return render_template('pages/features.html')
 
 @app.route('/pricing')
+@cached_page
 def pricing():
     """Tariflar"""
     return render_template('pages/pricing.html')
 
 @app.route('/faq')
+@cached_page
 def faq():
     """Tez-tez beriladigan savollar"""
     return render_template('pages/faq.html')
 
 @app.route('/contact', methods=['GET', 'POST'])
+@rate_limited('pages/contact.html', ip=Limit(burst=5, per=60), account=Limit(burst=3, per=300))
 def contact():
     """Aloqa"""
     if request.method == 'POST':
-        name = request.form.get('name', '').strip()
+        # The name ends up in an email header: no line breaks
+        name = one_line(request.form.get('name', ''))
         email = request.form.get('email', '').strip()
         message = request.form.get('message', '').strip()
 
@@ -143,18 +528,17 @@ def contact():
             flash('Barcha maydonlarni to\'ldiring', 'error')
             return redirect(url_for('contact'))
 
-        if not validate_email(email):
+        if len(email) > 255 or not validate_email(email):
             flash('Email manzil noto\'g\'ri', 'error')
             return redirect(url_for('contact'))
 
-        # Save to database
-        cursor = mysql.connection.cursor()
-        cursor.execute(
-            "INSERT INTO contacts (name, email, message, created_at) VALUES (%s, %s, %s, %s)",
-            (name, email, message, datetime.datetime.now())
-        )
-        mysql.connection.commit()
-        cursor.close()
+        if len(name) > CONTACT_MAX_NAME or len(message) > CONTACT_MAX_MESSAGE:
+            flash(f'Xabar {CONTACT_MAX_MESSAGE} belgidan, ism {CONTACT_MAX_NAME} belgidan oshmasin', 'error')
+            return redirect(url_for('contact'))
+
+        # Written to the database and emailed in the background; a repeat of a
+        # recent submission is dropped but answered the same way
+        contact_queue.submit(name, email, message)
 
         flash('Xabaringiz muvaffaqiyatli yuborildi! Tez orada siz bilan bog\'lanamiz.', 'success')
         return redirect(url_for('contact'))
@@ -166,58 +550,95 @@ def contact():
 @app.route('/blog')
 def blog():
     """Blog listing"""
-    page = request.args.get('page', 1, type=int)
+    page = min(max(request.args.get('page', 1, type=int), 1), MAX_OFFSET_PAGE)
     per_page = 9
     category = request.args.get('category', '')
-
-    cursor = mysql.connection.cursor()
-
-    # Build query
-    if category:
-        cursor.execute("""
-            SELECT COUNT(*) FROM blog_posts
-            WHERE is_published = 1 AND category = %s
-        """, (category,))
-    else:
-        cursor.execute("SELECT COUNT(*) FROM blog_posts WHERE is_published = 1")
-
-    total = cursor.fetchone()[0]
+    after = request.args.get('after', '')
+    before = request.args.get('before', '')
+
+    categories = cache.get_or_load('blog:categories', load_blog_categories,
+                                   ttl=CACHE_TTL, tags=('blog',))
+
+    # Only a bounded set of keys is cached: real categories, numbered pages.
+    # Cursor pages and made-up categories are read directly, so arbitrary
+    # query strings can't push other entries out of the cache.
+    loaders = {'total': lambda: load_blog_count(category),
+               'page': lambda: load_blog_page(category, per_page, page, after, before)}
+    keys = {}
+    if not category or category in categories:
+        keys['total'] = f'blog:count:{category}'
+        if not after and not before:
+            keys['page'] = f'blog:page:{category}:{page}'
+
+    # Cached values are used inline; only the misses are queried, in parallel
+    data, tasks = {}, {}
+    for name, load in loaders.items():
+        value = cache.get(keys[name], tags=('blog',)) if name in keys else None
+        if value is not None:
+            data[name] = value
+        elif name in keys:
+            tasks[name] = partial(cache.get_or_load, keys[name], load, ttl=CACHE_TTL, tags=('blog',))
+        else:
+            tasks[name] = load
+    if tasks:
+        try:
+            data.update(fanout.run(tasks).results)
+        except FanOutTimeout as e:
+            data.update(e.results)
+            for name in e.late:
+                data[name] = cache.get(keys[name], stale=True) if name in keys else None
+            if any(value is None for value in data.values()):
+                app.logger.error("Blog listing unavailable: %s", e)
+                return render_template('500.html'), 503, {'Retry-After': '5'}
+            app.logger.warning("Serving a stale blog listing: %s", e)
+    total = data['total']
     total_pages = (total + per_page - 1) // per_page
-    offset = (page - 1) * per_page
-
-    # Get posts
-    if category:
-        cursor.execute("""
-            SELECT * FROM blog_posts
-            WHERE is_published = 1 AND category = %s
-            ORDER BY published_at DESC
-            LIMIT %s OFFSET %s
-        """, (category, per_page, offset))
-    else:
-        cursor.execute("""
-            SELECT * FROM blog_posts
-            WHERE is_published = 1
-            ORDER BY published_at DESC
-            LIMIT %s OFFSET %s
-        """, (per_page, offset))
-
-    posts = cursor.fetchall()
-
-    # Get categories
-    cursor.execute("""
-        SELECT DISTINCT category FROM blog_posts
-        WHERE is_published = 1 AND category IS NOT NULL
-    """)
-    categories = [row[0] for row in cursor.fetchall()]
-
-    cursor.close()
+    result = data['page']
 
     return render_template('pages/blog.html',
-                         posts=posts,
+                         posts=result.rows,
                          categories=categories,
                          current_category=category,
+                         page=result.page,
+                         total_pages=total_pages,
+                         next_cursor=result.next_cursor,
+                         prev_cursor=result.prev_cursor)
+
+@app.route('/blog/search')
+def blog_search_results():
+    """Blog qidiruvi"""
+    q = request.args.get('q', '').strip()[:200]
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = 10
+
+    total, results, posts = 0, [], {}
+    if q:
+        cursor = mysql.connection.cursor()
+        total, ranked = blog_search.search(cursor, q, limit=per_page, offset=(page - 1) * per_page)
+
+        # Only the posts on this page are read, by primary key
+        if ranked:
+            ids = [post_id for post_id, _ in ranked]
+            cursor.execute(
+                f"SELECT {rows.BlogSearchHit.columns} FROM blog_posts "
+                f"WHERE is_published = 1 AND id IN ({', '.join(['%s'] * len(ids))})",
+                ids
+            )
+            posts = {post.id: post for post in fetchall(cursor, rows.BlogSearchHit)}
+        cursor.close()
+
+        for post_id, score in ranked:
+            post = posts.get(post_id)
+            if post:
+                text = blog_search.plain_text(post.content)
+                results.append((post, blog_search.snippet(text, q)))
+
+    return render_template('pages/blog_search.html',
+                         q=q,
+                         results=results,
+                         total=total,
                          page=page,
-                         total_pages=total_pages)
+                         total_pages=(total + per_page - 1) // per_page)
 
 @app.route('/blog/<slug>')
 def blog_post(slug):
@@ -225,28 +646,27 @@ def blog_post(slug):
     cursor = mysql.connection.cursor()
 
     # Get post
-    cursor.execute("""
-        SELECT * FROM blog_posts
+    cursor.execute(f"""
+        SELECT {rows.BlogPost.columns} FROM blog_posts
         WHERE slug = %s AND is_published = 1
     """, (slug,))
-    post = cursor.fetchone()
+    post = fetchone(cursor, rows.BlogPost)
 
     if not post:
         cursor.close()
         return render_template('404.html'), 404
 
-    # Increment views
-    cursor.execute("UPDATE blog_posts SET views = views + 1 WHERE id = %s", (post[0],))
-    mysql.connection.commit()
+    # Increment views (written behind in batches)
+    view_counter.increment(post.id)
 
     # Get related posts
-    cursor.execute("""
-        SELECT * FROM blog_posts
+    cursor.execute(f"""
+        SELECT {rows.BlogCard.columns} FROM blog_posts
         WHERE is_published = 1 AND id != %s AND category = %s
         ORDER BY published_at DESC
         LIMIT 3
-    """, (post[0], post[7]))
-    related_posts = cursor.fetchall()
+    """, (post.id, post.category))
+    related_posts = fetchall(cursor, rows.BlogCard)
 
     cursor.close()
 
@@ -255,11 +675,13 @@ def blog_post(slug):
 # ============ LEGAL PAGES ============
 
 @app.route('/terms')
+@cached_page
 def terms():
     """Foydalanish shartlari"""
     return render_template('pages/terms.html')
 
 @app.route('/privacy')
+@cached_page
 def privacy():
     """Maxfiylik siyosati"""
     return render_template('pages/privacy.html')
@@ -267,6 +689,7 @@ def privacy():
 # ============ USER AUTHENTICATION ============
 
 @app.route('/register', methods=['GET', 'POST'])
+@rate_limited('pages/register.html', ip=Limit(burst=5, per=120), account=Limit(burst=3, per=600))
 def user_register():
     """Foydalanuvchi ro'yxatdan o'tishi"""
     if 'user_id' in session:
@@ -306,15 +729,27 @@ def user_register():
             flash('Bu email manzil allaqachon ro\'yxatdan o\'tgan', 'error')
             return redirect(url_for('user_register'))
 
+        cursor.close()
+        # Don't hold a pooled connection while waiting for the hash
+        mysql.release_connection()
+
         # Create user
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = hasher.hash(password)
+        except HasherBusy:
+            return busy_response('pages/register.html')
+        now = datetime.datetime.now()
+        cursor = mysql.connection.cursor()
         cursor.execute("""
             INSERT INTO users (full_name, email, password, phone, company, created_at)
             VALUES (%s, %s, %s, %s, %s, %s)
-        """, (full_name, email, hashed_password, phone, company, datetime.datetime.now()))
-        mysql.connection.commit()
+        """, (full_name, email, hashed_password, phone, company, now))
         user_id = cursor.lastrowid
+        rollups.record_signup(cursor, now)
+        user_search.index_user(cursor, user_id, full_name, email, phone, company)
+        mysql.connection.commit()
         cursor.close()
+        cache.invalidate('users')
 
         # Login user
         session['user_id'] = user_id
@@ -327,6 +762,7 @@ def user_register():
     return render_template('pages/register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limited('pages/login.html', ip=Limit(burst=10, per=6), account=Limit(burst=5, per=60))
 def user_login():
     """Foydalanuvchi tizimga kirishi"""
     if 'user_id' in session:
@@ -341,32 +777,53 @@ def user_login():
             return redirect(url_for('user_login'))
 
         cursor = mysql.connection.cursor()
-        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-        user = cursor.fetchone()
+        cursor.execute(f"SELECT {rows.LoginUser.columns} FROM users WHERE email = %s", (email,))
+        user = fetchone(cursor, rows.LoginUser)
+        cursor.close()
+        mysql.release_connection()
+
+        try:
+            valid = bool(user and user.password) and hasher.verify(user.password, password)
+        except HasherBusy:
+            return busy_response('pages/login.html')
 
-        if user and user[3] and check_password_hash(user[3], password):
+        if valid:
             # Check if active
-            if not user[7]:
+            if not user.is_active:
                 flash('Hisobingiz bloklangan. Iltimos, administrator bilan bog\'laning', 'error')
-                cursor.close()
                 return redirect(url_for('user_login'))
 
+            # Upgrade hashes made with older parameters while the password is at hand
+            new_hash = None
+            if hasher.needs_rehash(user.password):
+                try:
+                    new_hash = hasher.hash(password)
+                except HasherBusy:
+                    pass  # tried again on the next login
+
             # Update last login
-            cursor.execute("UPDATE users SET last_login = %s WHERE id = %s",
-                         (datetime.datetime.now(), user[0]))
+            cursor = mysql.connection.cursor()
+            if new_hash:
+                cursor.execute("UPDATE users SET last_login = %s, password = %s WHERE id = %s",
+                               (datetime.datetime.now(), new_hash, user.id))
+            else:
+                cursor.execute("UPDATE users SET last_login = %s WHERE id = %s",
+                               (datetime.datetime.now(), user.id))
             mysql.connection.commit()
+            cursor.close()
+            invalidate_user_profile(user.id)
+            # A typo or two before getting in shouldn't count against the next login
+            limiter.reset(f'user_login:account:{email.lower()}')
 
             # Set session
-            session['user_id'] = user[0]
-            session['user_name'] = user[1]
-            session['user_email'] = user[2]
-            session['user_plan'] = user[6]
+            session['user_id'] = user.id
+            session['user_name'] = user.full_name
+            session['user_email'] = user.email
+            session['user_plan'] = user.plan_type
 
-            cursor.close()
             flash('Xush kelibsiz!', 'success')
             return redirect(url_for('user_dashboard'))
         else:
-            cursor.close()
             flash('Email yoki parol noto\'g\'ri', 'error')
             return redirect(url_for('user_login'))
 
@@ -385,43 +842,32 @@ def user_logout():
 @login_required
 def user_dashboard():
     """Foydalanuvchi paneli"""
-    cursor = mysql.connection.cursor()
-
-    # Get user info
-    cursor.execute("SELECT * FROM users WHERE id = %s", (session['user_id'],))
-    user = cursor.fetchone()
-
-    # Get conversations
-    cursor.execute("""
-        SELECT * FROM conversations
-        WHERE user_id = %s
-        ORDER BY updated_at DESC
-        LIMIT 10
-    """, (session['user_id'],))
-    conversations = cursor.fetchall()
-
-    # Get recent payments
-    cursor.execute("""
-        SELECT * FROM payments
-        WHERE user_id = %s
-        ORDER BY created_at DESC
-        LIMIT 5
-    """, (session['user_id'],))
-    payments = cursor.fetchall()
-
-    cursor.close()
+    data = fanout_or_partial({
+        # Get conversations
+        'conversations': (f"""
+            SELECT {rows.ConversationRow.columns} FROM conversations
+            WHERE user_id = %s
+            ORDER BY updated_at DESC
+            LIMIT 10
+        """, (session['user_id'],)),
+        # Get recent payments
+        'payments': (f"""
+            SELECT {rows.PaymentRow.columns} FROM payments
+            WHERE user_id = %s
+            ORDER BY created_at DESC
+            LIMIT 5
+        """, (session['user_id'],)),
+    }, empty=[])
 
     return render_template('pages/dashboard.html',
-                         user=user,
-                         conversations=conversations,
-                         payments=payments)
+                         user=g.user,
+                         conversations=[rows.ConversationRow._make(row) for row in data['conversations']],
+                         payments=[rows.PaymentRow._make(row) for row in data['payments']])
 
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
 def user_profile():
     """Foydalanuvchi profili"""
-    cursor = mysql.connection.cursor()
-
     if request.method == 'POST':
         full_name = request.form.get('full_name', '').strip()
         phone = request.form.get('phone', '').strip()
@@ -431,21 +877,55 @@ def user_profile():
             flash('Ismingizni kiriting', 'error')
             return redirect(url_for('user_profile'))
 
+        cursor = mysql.connection.cursor()
         cursor.execute("""
             UPDATE users SET full_name = %s, phone = %s, company = %s
             WHERE id = %s
         """, (full_name, phone, company, session['user_id']))
+        user_search.reindex_user(cursor, session['user_id'])
         mysql.connection.commit()
+        cursor.close()
+        invalidate_user_profile(session['user_id'])
 
         session['user_name'] = full_name
         flash('Profil muvaffaqiyatli yangilandi', 'success')
         return redirect(url_for('user_profile'))
 
-    cursor.execute("SELECT * FROM users WHERE id = %s", (session['user_id'],))
-    user = cursor.fetchone()
-    cursor.close()
-
-    return render_template('pages/profile.html', user=user)
+    return render_template('pages/profile.html', user=g.user)
+
+def load_chat_window(cursor, conversation_id, user_id, before=None, limit=CHAT_WINDOW):
+    """The ``limit`` newest messages older than the ``before`` cursor, oldest first.
+
+    Ownership is checked in the same query: the conversation row is the
+    driving table of a LEFT JOIN, so an owned conversation always yields at
+    least one row and anyone else's yields none. Returns ``None`` for a
+    missing or foreign conversation, else ``(messages, older_cursor)``.
+    Raises ValueError for a malformed cursor.
+    """
+    seek, seek_params = '', []
+    if before:
+        condition, seek_params = MESSAGES_KEYSET.seek(decode_cursor(before, len(MESSAGES_KEYSET.columns)))
+        seek = ' AND ' + condition
+
+    # Walks idx_conversation_date backwards; no filesort, cost independent of length
+    cursor.execute(f"""
+        SELECT {rows.MessageRow.columns} FROM conversations c
+        LEFT JOIN messages m ON m.conversation_id = c.id{seek}
+        WHERE c.id = %s AND c.user_id = %s
+        {MESSAGES_KEYSET.order_by()}
+        LIMIT %s
+    """, seek_params + [conversation_id, user_id, limit + 1])
+    window = cursor.fetchall()
+    if not window:
+        return None
+
+    messages = [rows.MessageRow._make(row) for row in window if row[0] is not None]
+    older_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        older_cursor = encode_cursor([messages[-1].created_at, messages[-1].id])
+    messages.reverse()
+    return messages, older_cursor
 
 @app.route('/chat')
 @login_required
@@ -453,27 +933,179 @@ def user_chat():
     """AI yordamchi chat"""
     conversation_id = request.args.get('id', type=int)
 
-    cursor = mysql.connection.cursor()
     messages = []
+    older_cursor = None
 
     if conversation_id:
-        # Get messages for this conversation
+        cursor = mysql.connection.cursor()
+        window = load_chat_window(cursor, conversation_id, session['user_id'])
+        cursor.close()
+        if window is None:
+            conversation_id = None
+        else:
+            messages, older_cursor = window
+
+    return render_template('pages/chat.html',
+                         conversation_id=conversation_id,
+                         messages=messages,
+                         older_cursor=older_cursor)
+
+@app.route('/chat/messages')
+@login_required
+def chat_messages():
+    """Older messages of a conversation, one window per request (JSON)"""
+    conversation_id = request.args.get('id', type=int)
+    if not conversation_id:
+        return jsonify({'error': 'Suhbat topilmadi'}), 404
+
+    cursor = mysql.connection.cursor()
+    try:
+        window = load_chat_window(cursor, conversation_id, session['user_id'],
+                                  before=request.args.get('before'))
+    except ValueError:
+        return jsonify({'error': 'Noto\'g\'ri kursor'}), 400
+    finally:
+        cursor.close()
+
+    if window is None:
+        return jsonify({'error': 'Suhbat topilmadi'}), 404
+
+    messages, older_cursor = window
+    return jsonify({
+        'messages': [{
+            'id': msg.id,
+            'role': msg.role,
+            'content': msg.content,
+            'time': msg.created_at.strftime('%H:%M'),
+        } for msg in messages],
+        'before': older_cursor,
+    })
+
+@app.route('/chat/send', methods=['POST'])
+@login_required
+def chat_send():
+    """Save the user's message and stream the assistant reply as server-sent events"""
+    data = request.get_json(silent=True) or request.form
+    content = (data.get('message') or '').strip()
+    conversation_id = data.get('conversation_id')
+
+    if not content:
+        return jsonify({'error': 'Xabar bo\'sh'}), 400
+    if len(content) > CHAT_MAX_MESSAGE_LENGTH:
+        return jsonify({'error': 'Xabar juda uzun'}), 400
+    try:
+        conversation_id = int(conversation_id) if conversation_id else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Suhbat topilmadi'}), 404
+
+    # Each open stream holds a worker thread; refuse instead of queueing
+    if not chat_streams.acquire(blocking=False):
+        response = jsonify({'error': 'Server band, birozdan keyin urinib ko\'ring'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+    try:
+        cursor = mysql.connection.cursor()
+        if conversation_id:
+            # Inserts nothing unless the conversation belongs to this user
+            cursor.execute("""
+                INSERT INTO messages (conversation_id, role, content)
+                SELECT id, 'user', %s FROM conversations
+                WHERE id = %s AND user_id = %s
+            """, (content, conversation_id, session['user_id']))
+            if not cursor.rowcount:
+                cursor.close()
+                chat_streams.release()
+                return jsonify({'error': 'Suhbat topilmadi'}), 404
+        else:
+            cursor.execute("INSERT INTO conversations (user_id, title) VALUES (%s, %s)",
+                           (session['user_id'], content[:255]))
+            conversation_id = cursor.lastrowid
+            cursor.execute("""
+                INSERT INTO messages (conversation_id, role, content)
+                VALUES (%s, 'user', %s)
+            """, (conversation_id, content))
+        message_id = cursor.lastrowid
+
         cursor.execute("""
-            SELECT * FROM messages
+            SELECT role, content FROM messages
             WHERE conversation_id = %s
-            ORDER BY created_at ASC
-        """, (conversation_id,))
-        messages = cursor.fetchall()
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (conversation_id, CHAT_HISTORY_MESSAGES))
+        history = [{'role': role, 'content': text} for role, text in reversed(cursor.fetchall())]
 
-    cursor.close()
+        mysql.connection.commit()
+        cursor.close()
+    except Exception:
+        chat_streams.release()
+        raise
+
+    # The stream may run for a while; don't keep a pooled connection idle meanwhile
+    mysql.release_connection()
+
+    response = Response(chat_reply_stream(conversation_id, message_id, history),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Runs even if the client disconnects before the first chunk
+    response.call_on_close(chat_streams.release)
+    return response
 
-    return render_template('pages/chat.html',
-                         conversation_id=conversation_id,
-                         messages=messages)
+def chat_reply_stream(conversation_id, message_id, history):
+    """Relay backend chunks as SSE, then save the whole reply in one insert"""
+    yield chat.sse('meta', {'conversation_id': conversation_id, 'message_id': message_id})
+
+    parts = []
+    failed = False
+    reply_id = None
+    started = time.monotonic()
+    first_token = None
+    try:
+        for chunk in chat_backend.stream(history):
+            if first_token is None:
+                first_token = time.monotonic() - started
+            parts.append(chunk)
+            yield chat.sse('token', {'text': chunk})
+    except Exception:
+        app.logger.exception("Chat backend %s failed", chat_backend.name)
+        failed = True
+    finally:
+        # Also reached when the client goes away mid-stream: keep what was generated
+        if parts:
+            try:
+                reply_id = save_assistant_message(conversation_id, ''.join(parts))
+            except Exception:
+                app.logger.exception("Could not save chat reply for conversation %s", conversation_id)
+                failed = True
+        app.logger.info("chat reply: backend=%s chunks=%d ttft=%.3fs total=%.3fs",
+                        chat_backend.name, len(parts), first_token or 0,
+                        time.monotonic() - started)
+
+    if failed:
+        yield chat.sse('error', {'error': 'Javob olishda xatolik yuz berdi'})
+    else:
+        yield chat.sse('done', {'message_id': reply_id})
+
+def save_assistant_message(conversation_id, content):
+    with mysql.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO messages (conversation_id, role, content)
+            VALUES (%s, 'assistant', %s)
+        """, (conversation_id, content))
+        reply_id = cursor.lastrowid
+        cursor.execute("UPDATE conversations SET updated_at = NOW() WHERE id = %s",
+                       (conversation_id,))
+        conn.commit()
+        cursor.close()
+    return reply_id
 
 # ============ ADMIN ROUTES ============
 
 @app.route('/admin/login', methods=['GET', 'POST'])
+@rate_limited('admin/login.html', ip=Limit(burst=5, per=60), account=Limit(burst=5, per=60), field='username')
 def admin_login():
     """Admin login"""
     if request.method == 'POST':
@@ -505,132 +1137,196 @@ def admin_logout():
 @admin_required
 def admin_dashboard():
     """Admin dashboard"""
-    cursor = mysql.connection.cursor()
-
-    # Get statistics
-    cursor.execute("SELECT COUNT(*) FROM users")
-    total_users = cursor.fetchone()[0]
-
-    cursor.execute("SELECT COUNT(*) FROM users WHERE is_active = 1")
-    active_users = cursor.fetchone()[0]
-
-    cursor.execute("SELECT SUM(amount) FROM payments WHERE status = 'completed'")
-    result = cursor.fetchone()
-    total_revenue = result[0] if result[0] else 0
-
-    cursor.execute("SELECT COUNT(*) FROM contacts WHERE is_read = 0")
-    unread_messages = cursor.fetchone()[0]
-
-    # Get revenue data for chart (last 12 months)
-    cursor.execute("""
-        SELECT DATE_FORMAT(created_at, '%Y-%m') as month, SUM(amount) as total
-        FROM payments
-        WHERE status = 'completed' AND created_at >= DATE_SUB(NOW(), INTERVAL 12 MONTH)
-        GROUP BY month
-        ORDER BY month ASC
-    """)
-    revenue_data = cursor.fetchall()
-
-    # Get user growth data (last 12 months)
-    cursor.execute("""
-        SELECT DATE_FORMAT(created_at, '%Y-%m') as month, COUNT(*) as total
-        FROM users
-        WHERE created_at >= DATE_SUB(NOW(), INTERVAL 12 MONTH)
-        GROUP BY month
-        ORDER BY month ASC
-    """)
-    user_growth_data = cursor.fetchall()
-
-    cursor.close()
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in rollups.GRANULARITY_FORMATS:
+        granularity = 'month'
+
+    # Default range: the current month and the 11 before it
+    today = datetime.date.today()
+    month = today.year * 12 + today.month - 1 - 11
+    default_start = datetime.date(month // 12, month % 12 + 1, 1)
+    try:
+        start, end = parse_date_range(request.args.get('from'), request.args.get('to'))
+    except ValueError:
+        start = end = None
+    start = start.date() if start else default_start
+    end = end.date() if end else today + datetime.timedelta(days=1)
+
+    # Everything below reads the rollup tables, never the fact tables
+    data = fanout_or_partial({
+        'totals': load_dashboard_totals,
+        'revenue': lambda: load_dashboard_series('revenue', start, end, granularity),
+        'signups': lambda: load_dashboard_series('signups', start, end, granularity),
+        'active': lambda: load_dashboard_series('active_users', start, end, granularity, running=True),
+    }, empty=[])
+    # Without totals the counters show a dash
+    totals = data['totals'] or dict.fromkeys(rollups.TOTALS)
 
     stats = {
-        'total_users': total_users,
-        'active_users': active_users,
-        'total_revenue': total_revenue,
-        'unread_messages': unread_messages,
-        'revenue_data': revenue_data,
-        'user_growth_data': user_growth_data
+        'total_users': totals['total_users'],
+        'active_users': totals['active_users'],
+        'total_revenue': totals['total_revenue'],
+        'unread_messages': totals['unread_contacts'],
+        'revenue_data': data['revenue'],
+        'user_growth_data': data['signups'],
+        'active_users_data': data['active']
     }
 
-    return render_template('admin/dashboard.html', stats=stats)
+    return render_template('admin/dashboard.html',
+                         stats=stats,
+                         granularity=granularity,
+                         date_from=start,
+                         date_to=end - datetime.timedelta(days=1))
 
 # ============ ADMIN USER MANAGEMENT ============
 
+def csv_response(name, query, params, header, row_fn, row_type=None):
+    """Stream a CSV export straight from the database (``?gzip=1`` compresses it)"""
+    compress = request.args.get('gzip') == '1'
+    if row_type is not None:
+        format_row = row_fn
+
+        def row_fn(row):
+            return format_row(row_type._make(row))
+    filename = f"{name}.csv.gz" if compress else f"{name}.csv"
+
+    if 'sql_profiler' in app.extensions:
+        body = profiler.profile_stream(
+            stream_csv(mysql.pool, query, params, header, row_fn, compress=compress,
+                       cursor_class=profiler.streaming_cursor_class),
+            request.endpoint)
+    else:
+        body = stream_csv(mysql.pool, query, params, header, row_fn, compress=compress)
+    response = Response(body, mimetype='application/gzip' if compress else 'text/csv')
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 @app.route('/admin/users')
 @admin_required
 def admin_users():
     """Foydalanuvchilar boshqaruvi"""
     page = request.args.get('page', 1, type=int)
     per_page = 20
-    search = request.args.get('search', '')
+    search = request.args.get('search', '').strip()
     plan = request.args.get('plan', '')
     status = request.args.get('status', '')
 
     cursor = mysql.connection.cursor()
 
     # Build query
-    query = "SELECT * FROM users WHERE 1=1"
+    where = " WHERE 1=1"
     params = []
 
     if search:
-        query += " AND (full_name LIKE %s OR email LIKE %s OR phone LIKE %s)"
-        search_term = f"%{search}%"
-        params.extend([search_term, search_term, search_term])
+        clause, search_params = user_search.match_clause(search)
+        where += " AND " + clause
+        params.extend(search_params)
 
     if plan:
-        query += " AND plan_type = %s"
+        where += " AND plan_type = %s"
         params.append(plan)
 
     if status:
-        query += " AND is_active = %s"
+        where += " AND is_active = %s"
         params.append(1 if status == 'active' else 0)
 
     # Get total count
-    count_query = query.replace("SELECT *", "SELECT COUNT(*)")
-    cursor.execute(count_query, params)
-    total = cursor.fetchone()[0]
+    def load_total():
+        cursor.execute("SELECT COUNT(*) FROM users" + where, params)
+        return cursor.fetchone()[0]
+
+    # Only the filter combinations from the page's dropdowns are cached, a
+    # bounded set of keys; typed searches and made-up plans are counted
+    # directly so they can't push other entries out of the cache
+    if search or plan not in ('', *USER_PLANS):
+        total = load_total()
+    else:
+        total = count_rows(f"users:{plan}:{status and ('active' if status == 'active' else 'inactive')}",
+                           load_total, 'users')
     total_pages = (total + per_page - 1) // per_page
 
     # Get users
-    query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
-    params.extend([per_page, (page - 1) * per_page])
-    cursor.execute(query, params)
-    users = cursor.fetchall()
+    result = paginate(cursor, f"SELECT {rows.AdminUserRow.columns} FROM users" + where, params,
+                      USERS_KEYSET, key=lambda user: (user.created_at, user.id),
+                      per_page=per_page, page=page,
+                      after=request.args.get('after'), before=request.args.get('before'),
+                      row_type=rows.AdminUserRow)
 
     cursor.close()
 
     return render_template('admin/users.html',
-                         users=users,
-                         page=page,
+                         users=result.rows,
+                         page=result.page,
                          total_pages=total_pages,
+                         next_cursor=result.next_cursor,
+                         prev_cursor=result.prev_cursor,
                          search=search,
                          plan=plan,
                          status=status)
 
+@app.route('/admin/users/search')
+@admin_required
+def admin_users_search():
+    """Typeahead search over users (JSON)"""
+    q = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+
+    cursor = mysql.connection.cursor()
+    users = [rows.UserSearchHit._make(user) for user in user_search.search(cursor, q, limit)]
+    cursor.close()
+
+    return jsonify([{
+        'id': user.id,
+        'full_name': user.full_name,
+        'email': user.email,
+        'phone': user.phone,
+        'company': user.company,
+        'plan_type': user.plan_type,
+        'is_active': bool(user.is_active),
+        'score': int(user.score),
+        'url': url_for('admin_user_edit', user_id=user.id)
+    } for user in users])
+
 @app.route('/admin/users/export')
 @admin_required
 def admin_users_export():
     """Export users to CSV"""
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT * FROM users ORDER BY created_at DESC")
-    users = cursor.fetchall()
-    cursor.close()
+    try:
+        start, end = parse_date_range(request.args.get('from'), request.args.get('to'))
+    except ValueError:
+        flash('Sana formati noto\'g\'ri (YYYY-MM-DD)', 'error')
+        return redirect(url_for('admin_users'))
+
+    query = f"SELECT {rows.AdminUserRow.columns} FROM users WHERE 1=1"
+    params = []
+
+    plan = request.args.get('plan', '')
+    if plan:
+        query += " AND plan_type = %s"
+        params.append(plan)
+
+    status = request.args.get('status', '')
+    if status:
+        query += " AND is_active = %s"
+        params.append(1 if status == 'active' else 0)
 
-    # Create CSV
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['ID', 'Full Name', 'Email', 'Phone', 'Company', 'Plan', 'Status', 'Created At'])
+    if start:
+        query += " AND created_at >= %s"
+        params.append(start)
+    if end:
+        query += " AND created_at < %s"
+        params.append(end)
 
-    for user in users:
-        writer.writerow([
-            user[0], user[1], user[2], user[4] or '', user[5] or '',
-            user[6], 'Active' if user[7] else 'Inactive', user[10]
-        ])
+    query += " ORDER BY created_at DESC"
 
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=users.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+    def row(user):
+        return [user.id, user.full_name, user.email, user.phone or '', user.company or '',
+                user.plan_type, 'Active' if user.is_active else 'Inactive', user.created_at]
+
+    return csv_response('users', query, params,
+                        ['ID', 'Full Name', 'Email', 'Phone', 'Company', 'Plan', 'Status', 'Created At'],
+                        row, row_type=rows.AdminUserRow)
 
 @app.route('/admin/users/edit/<int:user_id>', methods=['GET', 'POST'])
 @admin_required
@@ -646,20 +1342,28 @@ def admin_user_edit(user_id):
         plan_type = request.form.get('plan_type')
         is_active = 1 if request.form.get('is_active') else 0
 
+        cursor.execute("SELECT is_active FROM users WHERE id = %s FOR UPDATE", (user_id,))
+        current = cursor.fetchone()
+
         cursor.execute("""
             UPDATE users
             SET full_name = %s, email = %s, phone = %s, company = %s,
                 plan_type = %s, is_active = %s
             WHERE id = %s
         """, (full_name, email, phone, company, plan_type, is_active, user_id))
+        if current:
+            rollups.record_user_status(cursor, current[0], is_active)
+        user_search.index_user(cursor, user_id, full_name, email, phone, company)
         mysql.connection.commit()
         cursor.close()
 
+        cache.invalidate('users')
+        invalidate_user_profile(user_id)
         flash('Foydalanuvchi muvaffaqiyatli yangilandi', 'success')
         return redirect(url_for('admin_users'))
 
-    cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-    user = cursor.fetchone()
+    cursor.execute(f"SELECT {rows.UserProfile.columns} FROM users WHERE id = %s", (user_id,))
+    user = fetchone(cursor, rows.UserProfile)
     cursor.close()
 
     if not user:
@@ -673,10 +1377,13 @@ def admin_user_edit(user_id):
 def admin_user_delete(user_id):
     """Delete user"""
     cursor = mysql.connection.cursor()
+    rollups.record_user_delete(cursor, user_id)
     cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
     mysql.connection.commit()
     cursor.close()
 
+    cache.invalidate('users', 'payments')
+    invalidate_user_profile(user_id)
     flash('Foydalanuvchi o\'chirildi', 'success')
     return redirect(url_for('admin_users'))
 
@@ -692,56 +1399,74 @@ def admin_revenue():
     cursor = mysql.connection.cursor()
 
     # Get total count
-    cursor.execute("SELECT COUNT(*) FROM payments")
-    total = cursor.fetchone()[0]
+    def load_total():
+        cursor.execute("SELECT COUNT(*) FROM payments")
+        return cursor.fetchone()[0]
+
+    total = count_rows('payments', load_total, 'payments')
     total_pages = (total + per_page - 1) // per_page
 
     # Get payments
-    cursor.execute("""
-        SELECT p.*, u.full_name, u.email
-        FROM payments p
-        LEFT JOIN users u ON p.user_id = u.id
-        ORDER BY p.created_at DESC
-        LIMIT %s OFFSET %s
-    """, (per_page, (page - 1) * per_page))
-    payments = cursor.fetchall()
+    result = paginate(cursor, f"SELECT {rows.AdminPaymentRow.columns} FROM payments p WHERE 1=1", [],
+                      PAYMENTS_KEYSET, key=lambda payment: (payment.created_at, payment.id),
+                      per_page=per_page, page=page,
+                      after=request.args.get('after'), before=request.args.get('before'),
+                      row_type=rows.AdminPaymentRow)
 
     cursor.close()
 
     return render_template('admin/revenue.html',
-                         payments=payments,
-                         page=page,
-                         total_pages=total_pages)
+                         payments=result.rows,
+                         page=result.page,
+                         total_pages=total_pages,
+                         next_cursor=result.next_cursor,
+                         prev_cursor=result.prev_cursor)
 
 @app.route('/admin/revenue/export')
 @admin_required
 def admin_revenue_export():
     """Export payments to CSV"""
-    cursor = mysql.connection.cursor()
-    cursor.execute("""
-        SELECT p.*, u.full_name, u.email
+    try:
+        start, end = parse_date_range(request.args.get('from'), request.args.get('to'))
+    except ValueError:
+        flash('Sana formati noto\'g\'ri (YYYY-MM-DD)', 'error')
+        return redirect(url_for('admin_revenue'))
+
+    query = f"""
+        SELECT {rows.PaymentExportRow.columns}
         FROM payments p
         LEFT JOIN users u ON p.user_id = u.id
-        ORDER BY p.created_at DESC
-    """)
-    payments = cursor.fetchall()
-    cursor.close()
+        WHERE 1=1
+    """
+    params = []
 
-    # Create CSV
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['ID', 'User', 'Email', 'Amount', 'Plan', 'Method', 'Status', 'Date'])
+    plan = request.args.get('plan', '')
+    if plan:
+        query += " AND p.plan_type = %s"
+        params.append(plan)
 
-    for payment in payments:
-        writer.writerow([
-            payment[0], payment[8] or 'N/A', payment[9] or 'N/A',
-            payment[2], payment[3], payment[4] or 'N/A', payment[5], payment[7]
-        ])
+    status = request.args.get('status', '')
+    if status:
+        query += " AND p.status = %s"
+        params.append(status)
 
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=payments.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+    if start:
+        query += " AND p.created_at >= %s"
+        params.append(start)
+    if end:
+        query += " AND p.created_at < %s"
+        params.append(end)
+
+    query += " ORDER BY p.created_at DESC"
+
+    def row(payment):
+        return [payment.id, payment.full_name or 'N/A', payment.email or 'N/A',
+                payment.amount, payment.plan_type, payment.payment_method or 'N/A',
+                payment.status, payment.created_at]
+
+    return csv_response('payments', query, params,
+                        ['ID', 'User', 'Email', 'Amount', 'Plan', 'Method', 'Status', 'Date'],
+                        row, row_type=rows.PaymentExportRow)
 
 # ============ ADMIN CONTACTS ============
 
@@ -755,31 +1480,37 @@ def admin_contacts():
     cursor = mysql.connection.cursor()
 
     # Get total count
-    cursor.execute("SELECT COUNT(*) FROM contacts")
-    total = cursor.fetchone()[0]
+    def load_total():
+        cursor.execute("SELECT COUNT(*) FROM contacts")
+        return cursor.fetchone()[0]
+
+    total = count_rows('contacts', load_total, 'contacts')
     total_pages = (total + per_page - 1) // per_page
 
     # Get contacts
-    cursor.execute("""
-        SELECT * FROM contacts
-        ORDER BY is_read ASC, created_at DESC
-        LIMIT %s OFFSET %s
-    """, (per_page, (page - 1) * per_page))
-    contacts = cursor.fetchall()
+    result = paginate(cursor, f"SELECT {rows.ContactRow.columns} FROM contacts WHERE 1=1", [],
+                      CONTACTS_KEYSET, key=lambda contact: (contact.is_read, contact.created_at, contact.id),
+                      per_page=per_page, page=page,
+                      after=request.args.get('after'), before=request.args.get('before'),
+                      row_type=rows.ContactRow)
 
     cursor.close()
 
     return render_template('admin/contacts.html',
-                         contacts=contacts,
-                         page=page,
-                         total_pages=total_pages)
+                         contacts=result.rows,
+                         page=result.page,
+                         total_pages=total_pages,
+                         next_cursor=result.next_cursor,
+                         prev_cursor=result.prev_cursor)
 
 @app.route('/admin/contacts/<int:contact_id>/read', methods=['POST'])
 @admin_required
 def admin_contact_read(contact_id):
     """Mark contact as read"""
     cursor = mysql.connection.cursor()
-    cursor.execute("UPDATE contacts SET is_read = 1 WHERE id = %s", (contact_id,))
+    cursor.execute("UPDATE contacts SET is_read = 1 WHERE id = %s AND is_read = 0", (contact_id,))
+    if cursor.rowcount:
+        rollups.record_contacts_read(cursor, cursor.rowcount)
     mysql.connection.commit()
     cursor.close()
 
@@ -790,10 +1521,12 @@ def admin_contact_read(contact_id):
 def admin_contact_delete(contact_id):
     """Delete contact"""
     cursor = mysql.connection.cursor()
+    rollups.record_contact_delete(cursor, contact_id)
     cursor.execute("DELETE FROM contacts WHERE id = %s", (contact_id,))
     mysql.connection.commit()
     cursor.close()
 
+    cache.invalidate('contacts')
     flash('Xabar o\'chirildi', 'success')
     return redirect(url_for('admin_contacts'))
 
@@ -809,24 +1542,28 @@ def admin_blog():
     cursor = mysql.connection.cursor()
 
     # Get total count
-    cursor.execute("SELECT COUNT(*) FROM blog_posts")
-    total = cursor.fetchone()[0]
+    def load_total():
+        cursor.execute("SELECT COUNT(*) FROM blog_posts")
+        return cursor.fetchone()[0]
+
+    total = count_rows('blog_posts', load_total, 'blog')
     total_pages = (total + per_page - 1) // per_page
 
     # Get posts
-    cursor.execute("""
-        SELECT * FROM blog_posts
-        ORDER BY created_at DESC
-        LIMIT %s OFFSET %s
-    """, (per_page, (page - 1) * per_page))
-    posts = cursor.fetchall()
+    result = paginate(cursor, f"SELECT {rows.AdminBlogRow.columns} FROM blog_posts WHERE 1=1", [],
+                      ADMIN_BLOG_KEYSET, key=lambda post: (post.created_at, post.id),
+                      per_page=per_page, page=page,
+                      after=request.args.get('after'), before=request.args.get('before'),
+                      row_type=rows.AdminBlogRow)
 
     cursor.close()
 
     return render_template('admin/blog.html',
-                         posts=posts,
-                         page=page,
-                         total_pages=total_pages)
+                         posts=result.rows,
+                         page=result.page,
+                         total_pages=total_pages,
+                         next_cursor=result.next_cursor,
+                         prev_cursor=result.prev_cursor)
 
 @app.route('/admin/blog/new', methods=['GET', 'POST'])
 @admin_required
@@ -856,9 +1593,13 @@ def admin_blog_new():
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """, (title, slug, excerpt, content, category, tags, author, is_published,
               datetime.datetime.now() if is_published else None, datetime.datetime.now()))
+        post_id = cursor.lastrowid
+        blog_search.index_post(cursor, post_id, title, excerpt, content, tags, is_published)
         mysql.connection.commit()
         cursor.close()
 
+        cache.invalidate('blog')
+        invalidate_sitemap(post_id)
         flash('Blog post yaratildi', 'success')
         return redirect(url_for('admin_blog'))
 
@@ -903,14 +1644,17 @@ def admin_blog_edit(post_id):
                 WHERE id = %s
             """, (title, excerpt, content, category, tags, author, is_published, post_id))
 
+        blog_search.index_post(cursor, post_id, title, excerpt, content, tags, is_published)
         mysql.connection.commit()
         cursor.close()
 
+        cache.invalidate('blog')
+        invalidate_sitemap(post_id)
         flash('Blog post yangilandi', 'success')
         return redirect(url_for('admin_blog'))
 
-    cursor.execute("SELECT * FROM blog_posts WHERE id = %s", (post_id,))
-    post = cursor.fetchone()
+    cursor.execute(f"SELECT {rows.AdminBlogPost.columns} FROM blog_posts WHERE id = %s", (post_id,))
+    post = fetchone(cursor, rows.AdminBlogPost)
     cursor.close()
 
     if not post:
@@ -928,6 +1672,8 @@ def admin_blog_delete(post_id):
     mysql.connection.commit()
     cursor.close()
 
+    cache.invalidate('blog')
+    invalidate_sitemap(post_id)
     flash('Blog post o\'chirildi', 'success')
     return redirect(url_for('admin_blog'))
 
@@ -938,8 +1684,9 @@ def admin_blog_delete(post_id):
 def admin_testimonials():
     """Testimonials boshqaruvi"""
     cursor = mysql.connection.cursor()
-    cursor.execute("SELECT * FROM testimonials ORDER BY display_order ASC, created_at DESC")
-    testimonials = cursor.fetchall()
+    cursor.execute(f"SELECT {rows.AdminTestimonial.columns} FROM testimonials "
+                   "ORDER BY display_order ASC, created_at DESC")
+    testimonials = fetchall(cursor, rows.AdminTestimonial)
     cursor.close()
 
     return render_template('admin/testimonials.html', testimonials=testimonials)
@@ -966,6 +1713,7 @@ def admin_testimonial_new():
         mysql.connection.commit()
         cursor.close()
 
+        cache.invalidate('testimonials')
         flash('Testimonial yaratildi', 'success')
         return redirect(url_for('admin_testimonials'))
 
@@ -995,11 +1743,13 @@ def admin_testimonial_edit(testimonial_id):
         mysql.connection.commit()
         cursor.close()
 
+        cache.invalidate('testimonials')
         flash('Testimonial yangilandi', 'success')
         return redirect(url_for('admin_testimonials'))
 
-    cursor.execute("SELECT * FROM testimonials WHERE id = %s", (testimonial_id,))
-    testimonial = cursor.fetchone()
+    cursor.execute(f"SELECT {rows.AdminTestimonial.columns} FROM testimonials WHERE id = %s",
+                   (testimonial_id,))
+    testimonial = fetchone(cursor, rows.AdminTestimonial)
     cursor.close()
 
     if not testimonial:
@@ -1017,6 +1767,7 @@ def admin_testimonial_delete(testimonial_id):
     mysql.connection.commit()
     cursor.close()
 
+    cache.invalidate('testimonials')
     flash('Testimonial o\'chirildi', 'success')
     return redirect(url_for('admin_testimonials'))
 
@@ -1028,65 +1779,248 @@ def admin_settings():
     """Sozlamalar"""
     if request.method == 'POST':
         # Update settings
-        cursor = mysql.connection.cursor()
-
-        for key in request.form:
-            value = request.form.get(key)
+        keys = list(request.form)
+        if keys:
+            params = []
+            for key in keys:
+                params.extend([key, request.form.get(key)])
+            params.extend(keys)
+
+            # One statement for the whole form
+            cursor = mysql.connection.cursor()
             cursor.execute(
-                "UPDATE settings SET value = %s WHERE key_name = %s",
-                (value, key)
+                f"UPDATE settings SET value = CASE key_name "
+                f"{' '.join(['WHEN %s THEN %s'] * len(keys))} END "
+                f"WHERE key_name IN ({', '.join(['%s'] * len(keys))})",
+                params
             )
+            mysql.connection.commit()
+            cursor.close()
 
-        mysql.connection.commit()
-        cursor.close()
+        # Cached pages embed prices and contact details too
+        cache.invalidate('settings')
+        pages.invalidate('pages')
 
         flash('Sozlamalar yangilandi', 'success')
         return redirect(url_for('admin_settings'))
 
     cursor = mysql.connection.cursor()
-    cursor.execute("SELECT * FROM settings ORDER BY key_name")
-    settings = cursor.fetchall()
+    cursor.execute(f"SELECT {rows.SettingRow.columns} FROM settings ORDER BY key_name")
+    settings = fetchall(cursor, rows.SettingRow)
     cursor.close()
 
     return render_template('admin/settings.html', settings=settings)
 
+@app.route('/admin/db-stats')
+@admin_required
+def admin_db_stats():
+    """Connection pool statistics"""
+    return jsonify(mysql.stats())
+
+@app.route('/admin/db-profile')
+@admin_required
+def admin_db_profile():
+    """Routes and statements with the most database time, across all workers"""
+    report = profiler.report(limit=request.args.get('limit', 20, type=int))
+    if request.args.get('format') == 'json':
+        return jsonify(report)
+    return render_template('admin/db_profile.html', report=report)
+
+metrics.gauge('db_pool_connections', 'Pooled MySQL connections by state')
+metrics.counter('db_pool_checkouts_total', 'Connections taken from the pool')
+metrics.counter('db_pool_waits_total', 'Checkouts that had to wait for a free connection')
+metrics.counter('db_pool_wait_seconds_total', 'Time spent waiting for a free connection')
+metrics.counter('db_pool_timeouts_total', 'Checkouts that gave up after DB_POOL_TIMEOUT')
+metrics.gauge('cache_entries', 'Entries held in the worker-local cache')
+metrics.counter('cache_hits_total', 'Cache lookups answered from memory')
+metrics.counter('cache_misses_total', 'Cache lookups that ran the loader')
+metrics.counter('cache_stale_served_total', 'Stale entries served while another thread reloaded')
+
+@metrics.collector
+def db_pool_metrics():
+    stats = mysql.stats()
+    return [
+        ('db_pool_connections', {'state': 'in_use'}, stats['in_use']),
+        ('db_pool_connections', {'state': 'idle'}, stats['idle']),
+        ('db_pool_checkouts_total', {}, stats['checkouts']),
+        ('db_pool_waits_total', {}, stats['waits']),
+        ('db_pool_wait_seconds_total', {}, stats['wait_time_total']),
+        ('db_pool_timeouts_total', {}, stats['timeouts']),
+    ]
+
+@metrics.collector
+def cache_metrics():
+    samples = []
+    for name, instance in (('read', cache), ('pages', pages), ('profiles', profiles)):
+        stats = instance.stats()
+        samples += [
+            ('cache_entries', {'cache': name}, stats['entries']),
+            ('cache_hits_total', {'cache': name}, stats['hits']),
+            ('cache_misses_total', {'cache': name}, stats['misses']),
+            ('cache_stale_served_total', {'cache': name}, stats['stale_served']),
+        ]
+    return samples
+
+metrics.counter('rate_limited_total', 'Form posts rejected by the rate limiter')
+metrics.gauge('contact_queue_pending', 'Contact submissions accepted but not yet in the database')
+metrics.gauge('contact_notifications_pending', 'Contact notification emails not yet sent')
+metrics.gauge('contact_queue_failed', 'Contact submissions and notifications set aside in failed/')
+
+@metrics.shared_collector
+def contact_queue_metrics():
+    pending = contact_queue.pending()
+    return [
+        ('contact_queue_pending', {}, pending['contacts']),
+        ('contact_notifications_pending', {}, pending['notifications']),
+        ('contact_queue_failed', {}, pending['failed']),
+    ]
+
+def is_local_request():
+    """Direct request from this machine. nginx also connects from 127.0.0.1,
+    so anything carrying proxy headers came from outside."""
+    return (request.remote_addr in ('127.0.0.1', '::1')
+            and 'X-Forwarded-For' not in request.headers
+            and 'X-Real-IP' not in request.headers)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint: admins or local scrapers only"""
+    if 'metrics' not in app.extensions:
+        return render_template('404.html'), 404
+    if 'admin_logged_in' not in session and not is_local_request():
+        return render_template('404.html'), 404
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE,
+                    headers={'Cache-Control': 'no-store'})
+
 # ============ SEO ROUTES ============
 
-@app.route('/sitemap.xml')
-def sitemap():
-    """Sitemap"""
-    pages = []
-    ten_days_ago = datetime.datetime.now() - datetime.timedelta(days=10)
+# Sitemap protocol limit per file; posts are sharded by id range of this width
+SITEMAP_MAX_URLS = 50000
+SITEMAP_TTL = 86400
+SITEMAP_EXCLUDE = ['/admin', '/dashboard', '/profile', '/chat', '/logout',
+                   '/blog/search', '/sitemap', '/robots.txt', '/metrics']
 
-    # Static pages
+def sitemap_static_pages():
+    """Public GET pages, with the page template's mtime as lastmod"""
+    entries = []
     for rule in app.url_map.iter_rules():
         if "GET" in rule.methods and len(rule.arguments) == 0:
-            if not any(x in rule.rule for x in ['/admin', '/dashboard', '/profile', '/chat', '/logout']):
-                pages.append({
-                    'loc': url_for(rule.endpoint, _external=True),
-                    'lastmod': ten_days_ago.strftime('%Y-%m-%d'),
+            if not any(x in rule.rule for x in SITEMAP_EXCLUDE):
+                template = os.path.join(app.root_path, app.template_folder,
+                                        'pages', f'{rule.endpoint}.html')
+                lastmod = None
+                if os.path.exists(template):
+                    lastmod = datetime.date.fromtimestamp(os.path.getmtime(template)).isoformat()
+                entries.append({
+                    'loc': external_url(rule.endpoint),
+                    'lastmod': lastmod,
                     'changefreq': 'weekly',
                     'priority': '0.8'
                 })
+    return entries
 
-    # Blog posts
+def load_sitemap_shards():
+    """[(shard, published posts, last update)] for every non-empty shard"""
     cursor = mysql.connection.cursor()
-    cursor.execute("SELECT slug, updated_at FROM blog_posts WHERE is_published = 1")
+    cursor.execute("""
+        SELECT id DIV %s AS shard, COUNT(*), MAX(updated_at)
+        FROM blog_posts
+        WHERE is_published = 1
+        GROUP BY shard
+        ORDER BY shard
+    """, (SITEMAP_MAX_URLS,))
+    shards = cursor.fetchall()
+    cursor.close()
+    return shards
+
+def load_sitemap_posts(shard):
+    cursor = mysql.connection.cursor()
+    cursor.execute("""
+        SELECT slug, updated_at FROM blog_posts
+        WHERE is_published = 1 AND id >= %s AND id < %s
+        ORDER BY id
+    """, (shard * SITEMAP_MAX_URLS, (shard + 1) * SITEMAP_MAX_URLS))
     posts = cursor.fetchall()
-    for post in posts:
-        pages.append({
-            'loc': url_for('blog_post', slug=post[0], _external=True),
-            'lastmod': post[1].strftime('%Y-%m-%d'),
-            'changefreq': 'monthly',
-            'priority': '0.7'
-        })
     cursor.close()
+    return posts
+
+def sitemap_shard_posts(shard):
+    """Cached posts of one shard; only shards whose posts changed are reloaded"""
+    return cache.get_or_load(f'sitemap:posts:{shard}', lambda: load_sitemap_posts(shard),
+                             ttl=SITEMAP_TTL, tags=(f'sitemap-{shard}',))
+
+def sitemap_post_pages(shard):
+    return [{
+        'loc': external_url('blog_post', slug=post[0]),
+        'lastmod': post[1].strftime('%Y-%m-%d'),
+        'changefreq': 'monthly',
+        'priority': '0.7'
+    } for post in sitemap_shard_posts(shard)]
+
+def invalidate_sitemap(post_id):
+    cache.invalidate(f'sitemap-{post_id // SITEMAP_MAX_URLS}')
+
+def sitemap_shards():
+    return cache.get_or_load('sitemap:shards', load_sitemap_shards, ttl=SITEMAP_TTL, tags=('blog',))
+
+def build_sitemap():
+    """A single urlset while under the protocol limit, a sitemap index above it"""
+    static_pages = sitemap_static_pages()
+    shards = sitemap_shards()
+
+    if len(static_pages) + sum(shard[1] for shard in shards) <= SITEMAP_MAX_URLS:
+        entries = static_pages
+        for shard in shards:
+            entries.extend(sitemap_post_pages(shard[0]))
+        return CachedPage(render_template('sitemap.xml', pages=entries), mimetype='application/xml')
+
+    lastmods = [page['lastmod'] for page in static_pages if page['lastmod']]
+    sitemaps = [{
+        'loc': external_url('sitemap_pages'),
+        'lastmod': max(lastmods) if lastmods else None
+    }]
+    for shard, _, updated_at in shards:
+        sitemaps.append({
+            'loc': external_url('sitemap_posts', shard=shard),
+            'lastmod': updated_at.strftime('%Y-%m-%d')
+        })
+    return CachedPage(render_template('sitemap_index.xml', sitemaps=sitemaps), mimetype='application/xml')
 
-    sitemap_xml = render_template('sitemap.xml', pages=pages)
-    response = app.make_response(sitemap_xml)
-    response.headers["Content-Type"] = "application/xml"
+def sitemap_file_response(page):
+    """Serve a child sitemap as a .xml.gz file, honouring conditional GETs"""
+    response = Response(page.bodies['gzip'], mimetype='application/gzip')
+    response.set_etag(page.etag)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response.make_conditional(request)
 
-    return response
+@app.route('/sitemap.xml')
+def sitemap():
+    """Sitemap"""
+    # URLs are built on SITE_URL, so one copy serves every Host header
+    page = cache.get_or_load('sitemap', build_sitemap,
+                             ttl=SITEMAP_TTL, tags=('blog',))
+    return page.make_response(request, 'public, no-cache')
+
+@app.route('/sitemap-pages.xml.gz')
+def sitemap_pages():
+    """Static pages child sitemap"""
+    page = cache.get_or_load('sitemap:pages',
+                             lambda: CachedPage(render_template('sitemap.xml', pages=sitemap_static_pages()),
+                                                mimetype='application/xml'),
+                             ttl=SITEMAP_TTL)
+    return sitemap_file_response(page)
+
+@app.route('/sitemap-posts-<int:shard>.xml.gz')
+def sitemap_posts(shard):
+    """Blog posts child sitemap"""
+    # Only shards that exist, so made-up numbers can't add cache entries
+    if shard not in (row[0] for row in sitemap_shards()):
+        return render_template('404.html'), 404
+    page = cache.get_or_load(f'sitemap:posts-xml:{shard}',
+                             lambda: CachedPage(render_template('sitemap.xml', pages=sitemap_post_pages(shard)),
+                                                mimetype='application/xml'),
+                             ttl=SITEMAP_TTL, tags=(f'sitemap-{shard}',))
+    return sitemap_file_response(page)
 
 @app.route('/robots.txt')
 def robots():
@@ -1098,7 +2032,94 @@ Disallow: /dashboard/
 Disallow: /profile/
 Disallow: /chat/
 Sitemap: {}/sitemap.xml
-""".format(request.url_root.rstrip('/'))
+""".format(SITE_URL)
+
+# ============ CLI COMMANDS ============
+
+@app.cli.command('rebuild-user-search')
+def rebuild_user_search_command():
+    """Rebuild the admin user search index"""
+    with mysql.pool.connection() as conn:
+        cursor = conn.cursor()
+        user_search.rebuild(cursor)
+        conn.commit()
+        cursor.close()
+    print('User search index rebuilt')
+
+@app.cli.command('rebuild-blog-search')
+def rebuild_blog_search_command():
+    """Rebuild the blog full-text search index"""
+    with mysql.pool.connection() as conn:
+        cursor = conn.cursor()
+        blog_search.rebuild(cursor)
+        conn.commit()
+        cursor.close()
+    print('Blog search index rebuilt')
+
+@app.cli.command('calibrate-password-hash')
+@click.option('--target-ms', default=250, show_default=True, help='Target time per hash')
+@click.option('--algorithm', type=click.Choice(['scrypt', 'pbkdf2']), default='scrypt', show_default=True)
+def calibrate_password_hash_command(target_ms, algorithm):
+    """Print a PASSWORD_HASH_METHOD that takes about --target-ms on this host"""
+    method = passwords.calibrate(target_ms, algorithm)
+    print(f'PASSWORD_HASH_METHOD={method}')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Build Tailwind and minified, fingerprinted static files into static/dist"""
+    try:
+        manifest = assets.build(app.root_path, app.static_folder)
+    except assets.AssetBuildError as e:
+        raise click.ClickException(str(e))
+    for name, built in manifest.items():
+        print(f'{name} -> {built}')
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+    """Compile every template into the shared bytecode cache"""
+    count, elapsed = warmup.compile_templates(app.jinja_env)
+    print(f'Compiled {count} templates in {elapsed * 1000:.0f} ms '
+          f'({app.jinja_env.bytecode_cache.directory})')
+
+@app.cli.command('warm-up')
+def warm_up_command():
+    """Measure a cold worker: template load and first vs second render of the hot pages"""
+    count, elapsed = warmup.compile_templates(app.jinja_env)
+    print(f'Templates: {count} loaded in {elapsed * 1000:.0f} ms')
+    paths = app.config['WARMUP_PATHS']
+    print('First request: ' + warmup.format_timings(warmup.warm_up(app, paths, budget=60)))
+    print('Second request: ' + warmup.format_timings(warmup.warm_up(app, paths, budget=60)))
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Backfill the dashboard rollup tables from the fact tables"""
+    with mysql.pool.connection() as conn:
+        cursor = conn.cursor()
+        rollups.rebuild(cursor)
+        conn.commit()
+        cursor.close()
+    print('Dashboard statistics rebuilt')
+
+@app.cli.command('migrate-db')
+@click.option('--rebuild', 'rebuild_all', is_flag=True, help='Also rebuild every derived table')
+def migrate_db_command(rebuild_all):
+    """Add the tables and indexes an existing database is missing"""
+    with open(os.path.join(app.root_path, 'init_db.sql')) as f:
+        schema_sql = f.read()
+    with mysql.pool.connection() as conn:
+        cursor = conn.cursor()
+        rebuilds = migrations.migrate(cursor, schema_sql)
+        if rebuild_all:
+            rebuilds = {'user-search', 'blog-search', 'stats'}
+        # The new tables are filled the same way the rebuild-* commands do
+        for name, rebuild in (('user-search', user_search.rebuild), ('blog-search', blog_search.rebuild),
+                              ('stats', rollups.rebuild)):
+            if name in rebuilds:
+                rebuild(cursor)
+                conn.commit()
+                print(f'Rebuilt {name}')
+        cursor.close()
+    print('Database schema is up to date')
 
 # ============ ERROR HANDLERS ============
 
@@ -0,0 +1,187 @@
+"""Build-time static assets.
+
+``build`` compiles Tailwind from the classes used in ``templates/`` and
+``static/js/`` (instead of the CDN compiler running in every visitor's
+browser), minifies ``css/main.css`` and ``js/main.js``, and writes each file
+under ``static/dist/`` with a content hash in its name plus precompressed
+``.gz``/``.br`` copies. ``manifest.json`` maps the source names to the built
+ones.
+
+``init_app`` reads the manifest so ``url_for('static', filename='css/main.css')``
+returns the fingerprinted URL, and serves ``dist/`` files with a year-long
+immutable ``Cache-Control`` and the precompressed variant the client accepts.
+Without a build the source files are served as before.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import subprocess
+import tempfile
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# tailwind.config.js and the @tailwind directives are Tailwind 3 syntax
+TAILWIND_VERSION = 'v3.4.17'
+
+# Precompressed suffixes in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class AssetBuildError(Exception):
+    """Raised when an asset could not be built"""
+
+
+def _tailwind_command():
+    """Tailwind CLI to run: ``TAILWIND_BIN``, the standalone binary
+    (``pip install pytailwindcss`` puts it on PATH) or npx."""
+    if os.getenv('TAILWIND_BIN'):
+        return os.getenv('TAILWIND_BIN').split()
+    if shutil.which('tailwindcss'):
+        return ['tailwindcss']
+    if shutil.which('npx'):
+        return ['npx', '--yes', f'tailwindcss@{TAILWIND_VERSION[1:]}']
+    raise AssetBuildError("Tailwind CLI not found: pip install -r requirements-build.txt "
+                          "or set TAILWIND_BIN")
+
+
+def build_tailwind(root):
+    """Purged, minified Tailwind CSS for the templates under ``root``"""
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'tailwind.css')
+        command = _tailwind_command() + [
+            '--config', os.path.join(root, 'tailwind.config.js'),
+            '--input', os.path.join(root, 'static', 'src', 'tailwind.css'),
+            '--output', output,
+            '--minify',
+        ]
+        # pytailwindcss downloads this release instead of the latest one
+        env = dict(os.environ, TAILWINDCSS_VERSION=os.getenv('TAILWINDCSS_VERSION', TAILWIND_VERSION))
+        try:
+            subprocess.run(command, cwd=root, env=env, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise AssetBuildError(f"Tailwind build failed: {e}") from e
+        with open(output, 'rb') as f:
+            return f.read()
+
+
+def minify_css(path):
+    import rcssmin
+    with open(path, encoding='utf-8') as f:
+        return rcssmin.cssmin(f.read()).encode('utf-8')
+
+
+def minify_js(path):
+    import rjsmin
+    with open(path, encoding='utf-8') as f:
+        return rjsmin.jsmin(f.read()).encode('utf-8')
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_asset(dist, name, data):
+    """Write ``data`` as ``name`` with a content hash and its compressed
+    copies; returns the path relative to the static folder"""
+    base, ext = os.path.splitext(name)
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    hashed = f'{base}.{digest}{ext}'
+    path = os.path.join(dist, hashed)
+
+    _write(path, data)
+    _write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write(path + '.br', brotli.compress(data, quality=11))
+    return f'{DIST_DIR}/{hashed}'
+
+
+def build(root, static_folder=None):
+    """Rebuild ``static/dist`` and return the manifest"""
+    static_folder = static_folder or os.path.join(root, 'static')
+    dist = os.path.join(static_folder, DIST_DIR)
+
+    outputs = {
+        'css/tailwind.css': build_tailwind(root),
+        'css/main.css': minify_css(os.path.join(static_folder, 'css', 'main.css')),
+        'js/main.js': minify_js(os.path.join(static_folder, 'js', 'main.js')),
+    }
+
+    # Built next to dist and swapped in, so a failed build leaves the old one
+    staging = tempfile.mkdtemp(prefix='dist-', dir=static_folder)
+    try:
+        manifest = {name: write_asset(staging, name, data) for name, data in outputs.items()}
+        _write(os.path.join(staging, MANIFEST), json.dumps(manifest, indent=2).encode('utf-8'))
+        shutil.rmtree(dist, ignore_errors=True)
+        os.chmod(staging, 0o755)
+        os.rename(staging, dist)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning("Ignoring unreadable asset manifest in %s", static_folder)
+        return {}
+
+
+def init_app(app):
+    """Fingerprinted ``url_for('static')`` URLs and immutable serving of ``dist/``"""
+    manifest = load_manifest(app.static_folder)
+    app.extensions['assets'] = manifest
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    @app.context_processor
+    def inject_assets():
+        # Templates fall back to the Tailwind CDN until assets are built
+        return {'assets_built': bool(manifest)}
+
+    def static(filename):
+        if not filename.startswith(DIST_DIR + '/'):
+            return app.send_static_file(filename)
+
+        mimetype = mimetypes.guess_type(filename)[0]
+        encoding = None
+        for candidate, suffix in ENCODINGS:
+            path = safe_join(app.static_folder, filename + suffix)
+            if request.accept_encodings[candidate] and path and os.path.isfile(path):
+                encoding = candidate
+                filename += suffix
+                break
+
+        response = send_from_directory(app.static_folder, filename, mimetype=mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
@@ -0,0 +1,587 @@
+"""Route-level load benchmark.
+
+    python benchmark.py seed --scale 1
+    python benchmark.py run --duration 60 --concurrency 16
+    python benchmark.py compare benchmarks/before.json benchmarks/after.json
+
+``seed`` (re)creates a separate database (``balansai_bench`` by default) on
+the MySQL/MariaDB server from ``DB_HOST``/``DB_USER``/..., using the schema
+in ``init_db.sql`` plus deterministic synthetic users, payments, posts,
+contacts and conversations, ``--scale`` times the base volume. The search
+indexes and dashboard rollups are rebuilt as the CLI commands would.
+
+``run`` boots the app with gunicorn against that database (or targets
+``--url``), drives a mix of anonymous visitors, members who log in and use
+their dashboard, and admins browsing and exporting, and records every
+request under its Flask endpoint name. Throughput and p50/p95/p99 latency
+per route are printed and written as JSON.
+
+``compare`` lines up two result files and exits with status 1 if any route
+got slower at p95 (or lost throughput) by more than ``--threshold``.
+"""
+import datetime
+import http.client
+import http.cookies
+import json
+import math
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+import click
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Rows per unit of --scale
+BASE_USERS = 1000
+BASE_POSTS = 100
+BASE_CONTACTS = 200
+PAYMENTS_PER_USER = 3
+CONVERSATION_SHARE = 0.5
+MESSAGES_PER_CONVERSATION = 6
+
+BENCH_PASSWORD = 'bench-password'
+BENCH_ADMIN = ('bench-admin', 'bench-admin-password')
+
+PLANS = ('free', 'basic', 'premium')
+CATEGORIES = ('Moliya', 'Biznes', 'AI', 'Soliq', 'Yangiliklar')
+WORDS = ('balans', 'hisobot', 'moliya', 'daromad', 'xarajat', 'soliq', 'biznes', 'tahlil',
+         'budjet', 'foyda', 'kassa', 'hisob', 'reja', 'bank', 'kredit', 'investitsiya')
+
+
+# ============ SEED ============
+
+def _connect(database=None):
+    import MySQLdb
+    kwargs = dict(host=os.getenv('DB_HOST', 'localhost'), user=os.getenv('DB_USER', 'root'),
+                  passwd=os.getenv('DB_PASSWORD', ''), port=int(os.getenv('DB_PORT', 3306)),
+                  charset='utf8mb4')
+    if database:
+        kwargs['db'] = database
+    return MySQLdb.connect(**kwargs)
+
+
+def schema_statements(database):
+    """``init_db.sql`` as single statements, pointed at ``database``, without its sample rows"""
+    with open(os.path.join(ROOT, 'init_db.sql')) as f:
+        sql = f.read()
+    sql = re.sub(r'^\s*--.*$', '', sql, flags=re.MULTILINE)
+    sql = sql.replace('EXISTS balansai ', f'EXISTS {database} ').replace('USE balansai;', f'USE {database};')
+    statements = [s.strip() for s in re.split(r';\s*$', sql, flags=re.MULTILINE) if s.strip()]
+    # Keep the settings/stats_totals defaults; users, posts etc. come from the generator
+    return [s for s in statements if not re.match(
+        r'INSERT INTO (users|payments|blog_posts|testimonials)\b', s)]
+
+
+def plan_prices():
+    """Plan prices from the ``*_plan_price`` defaults that ``init_db.sql`` seeds into settings"""
+    with open(os.path.join(ROOT, 'init_db.sql')) as f:
+        sql = f.read()
+    prices = dict(re.findall(r"\('(\w+)_plan_price', '(\d+)'", sql))
+    return {plan: int(prices[plan]) for plan in PLANS}
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _when(rng, now, days=365):
+    return now - datetime.timedelta(seconds=rng.randrange(days * 86400))
+
+
+def generate(scale, seed=42):
+    """Synthetic rows per table; the same scale and seed always give the same data"""
+    from werkzeug.security import generate_password_hash
+    import passwords
+
+    rng = random.Random(seed)
+    now = datetime.datetime.now().replace(microsecond=0)
+    prices = plan_prices()
+    method = os.getenv('PASSWORD_HASH_METHOD', passwords.DEFAULT_METHOD)
+    password = generate_password_hash(BENCH_PASSWORD, method=method)
+
+    users, payments, conversations, messages = [], [], [], []
+    for i in range(1, int(BASE_USERS * scale) + 1):
+        plan = rng.choices(PLANS, weights=(70, 20, 10))[0]
+        created = _when(rng, now)
+        users.append((i, f'Bench User {i}', f'bench{i}@example.com', password,
+                      f'+99890{i:07d}', rng.choice([None, f'Kompaniya {i % 97}']), plan,
+                      int(i % 50 != 0), created))
+        for _ in range(rng.randrange(PAYMENTS_PER_USER * 2 + 1)):
+            payment_plan = rng.choice(PLANS[1:])
+            payments.append((i, prices[payment_plan], payment_plan,
+                             rng.choice(['click', 'payme', 'uzcard']),
+                             rng.choices(['completed', 'pending', 'failed'], weights=(85, 10, 5))[0],
+                             _when(rng, now)))
+        if rng.random() < CONVERSATION_SHARE:
+            conversation_id = len(conversations) + 1
+            started = _when(rng, now, 90)
+            conversations.append((conversation_id, i, _sentence(rng, 3), started, started))
+            for n in range(MESSAGES_PER_CONVERSATION):
+                messages.append((conversation_id, ('user', 'assistant')[n % 2],
+                                 _sentence(rng, rng.randrange(8, 60)),
+                                 started + datetime.timedelta(seconds=n * 30)))
+
+    posts = []
+    for i in range(1, int(BASE_POSTS * scale) + 1):
+        published = _when(rng, now)
+        content = '\n'.join(f'<p>{_sentence(rng, rng.randrange(20, 80))}</p>' for _ in range(8))
+        posts.append((i, f'{_sentence(rng, 5)[:-1]} {i}', f'bench-post-{i}', _sentence(rng, 25),
+                      content, rng.choice(CATEGORIES), ', '.join(rng.sample(WORDS, 3)),
+                      int(i % 10 != 0), rng.randrange(5000), published, published))
+
+    contacts = [(f'Mijoz {i}', f'client{i}@example.com', _sentence(rng, rng.randrange(10, 60)),
+                 int(rng.random() > 0.3), _when(rng, now))
+                for i in range(1, int(BASE_CONTACTS * scale) + 1)]
+
+    testimonials = [(f'Mijoz {i}', 'Direktor', f'Kompaniya {i}', _sentence(rng, 20), 5, i, 1)
+                    for i in range(1, 7)]
+
+    return {
+        'users': ("INSERT INTO users (id, full_name, email, password, phone, company, plan_type,"
+                  " is_active, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)", users),
+        'payments': ("INSERT INTO payments (user_id, amount, plan_type, payment_method, status,"
+                     " created_at) VALUES (%s, %s, %s, %s, %s, %s)", payments),
+        'blog_posts': ("INSERT INTO blog_posts (id, title, slug, excerpt, content, category, tags,"
+                       " is_published, views, created_at, published_at)"
+                       " VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", posts),
+        'contacts': ("INSERT INTO contacts (name, email, message, is_read, created_at)"
+                     " VALUES (%s, %s, %s, %s, %s)", contacts),
+        'testimonials': ("INSERT INTO testimonials (name, position, company, content, rating,"
+                         " display_order, is_active) VALUES (%s, %s, %s, %s, %s, %s, %s)", testimonials),
+        'conversations': ("INSERT INTO conversations (id, user_id, title, created_at, updated_at)"
+                          " VALUES (%s, %s, %s, %s, %s)", conversations),
+        'messages': ("INSERT INTO messages (conversation_id, role, content, created_at)"
+                     " VALUES (%s, %s, %s, %s)", messages),
+    }
+
+
+def seed(database, scale, batch_size=1000):
+    import blog_search
+    import rollups
+    import user_search
+
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {database}")
+    for statement in schema_statements(database):
+        cursor.execute(statement)
+    conn.commit()
+
+    counts = {}
+    for table, (sql, data) in generate(scale).items():
+        for start in range(0, len(data), batch_size):
+            cursor.executemany(sql, data[start:start + batch_size])
+        conn.commit()
+        counts[table] = len(data)
+
+    rollups.rebuild(cursor)
+    user_search.rebuild(cursor)
+    blog_search.rebuild(cursor)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return counts
+
+
+# ============ LOAD ============
+
+class Client:
+    """Keep-alive HTTP connection with a cookie jar, timing each request"""
+
+    def __init__(self, url, timeout=30):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.timeout = timeout
+        self.cookies = {}
+        self.conn = None
+
+    def request(self, method, path, form=None):
+        body, headers = None, {'Accept-Encoding': 'gzip, br'}
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+
+        start = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return None, time.perf_counter() - start
+        elapsed = time.perf_counter() - start
+
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in http.cookies.SimpleCookie(header).items():
+                if morsel.value and morsel['max-age'] != '0':
+                    self.cookies[name] = morsel.value
+                else:
+                    self.cookies.pop(name, None)
+        if response.will_close:
+            self.close()
+        return response, elapsed
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class VirtualUser:
+    """One simulated visitor: a persona's setup steps, then weighted steps until stopped.
+
+    Steps are ``(weight, endpoint, method, path or callable, form or callable, expect)``.
+    A response counts as an error if it is 5xx, a transport failure, or a
+    redirect anywhere but ``expect`` (a failed login bounces back to the
+    form, an expired session to the login page).
+    """
+
+    def __init__(self, persona, url, scale, rng, recorder):
+        self.persona = persona
+        self.client = Client(url)
+        self.rng = rng
+        self.recorder = recorder
+        self.users = max(1, int(BASE_USERS * scale))
+        self.posts = max(1, int(BASE_POSTS * scale))
+        self.user_id = None
+
+    # ---- parameters ----
+
+    # Every 10th post is a draft and every 50th user is blocked (see generate)
+
+    def post_path(self):
+        post_id = self.rng.randrange(1, self.posts + 1)
+        if post_id % 10 == 0:
+            post_id -= 1
+        return f'/blog/bench-post-{max(post_id, 1)}'
+
+    def search_path(self):
+        return '/blog/search?' + urllib.parse.urlencode({'q': self.rng.choice(WORDS)})
+
+    def admin_search_path(self):
+        return '/admin/users/search?' + urllib.parse.urlencode({'q': f'bench{self.rng.randrange(1, 100)}'})
+
+    def login_form(self):
+        self.client.cookies.clear()
+        self.user_id = self.rng.randrange(1, self.users + 1)
+        if self.user_id % 50 == 0:
+            self.user_id -= 1
+        return {'email': f'bench{self.user_id}@example.com', 'password': BENCH_PASSWORD}
+
+    def admin_form(self):
+        return {'username': os.getenv('ADMIN_USERNAME', BENCH_ADMIN[0]),
+                'password': os.getenv('ADMIN_PASSWORD', BENCH_ADMIN[1])}
+
+    # ---- loop ----
+
+    def step(self, endpoint, method, path, form=None, expect=None):
+        if callable(path):
+            path = path(self)
+        if callable(form):
+            form = form(self)
+        response, elapsed = self.client.request(method, path, form)
+        ok = response is not None and response.status < 500
+        if ok and response.status in (301, 302, 303):
+            ok = urllib.parse.urlsplit(response.getheader('Location', '')).path == expect
+        self.recorder.record(endpoint, elapsed, ok)
+
+    def run(self, stop):
+        setup, steps = PERSONAS[self.persona][1:]
+        weights = [step[0] for step in steps]
+        for step in setup:
+            self.step(*step[1:])
+        while time.monotonic() < stop:
+            self.step(*self.rng.choices(steps, weights=weights)[0][1:])
+        self.client.close()
+
+
+LOGIN = (0, 'user_login', 'POST', '/login', VirtualUser.login_form, '/dashboard')
+ADMIN_LOGIN = (0, 'admin_login', 'POST', '/admin/login', VirtualUser.admin_form, '/admin')
+
+# persona -> (share of virtual users, setup steps, weighted steps)
+PERSONAS = {
+    'anonymous': (70, [], [
+        (25, 'index', 'GET', '/', None, None),
+        (10, 'pricing', 'GET', '/pricing', None, None),
+        (5, 'features', 'GET', '/features', None, None),
+        (15, 'blog', 'GET', '/blog', None, None),
+        (30, 'blog_post', 'GET', VirtualUser.post_path, None, None),
+        (10, 'blog_search_results', 'GET', VirtualUser.search_path, None, None),
+        (5, 'contact', 'GET', '/contact', None, None),
+    ]),
+    'member': (20, [LOGIN], [
+        (45, 'user_dashboard', 'GET', '/dashboard', None, None),
+        (20, 'user_profile', 'GET', '/profile', None, None),
+        (20, 'user_chat', 'GET', '/chat', None, None),
+        (15, *LOGIN[1:]),
+    ]),
+    'admin': (10, [ADMIN_LOGIN], [
+        (25, 'admin_dashboard', 'GET', '/admin', None, None),
+        (20, 'admin_users', 'GET', '/admin/users', None, None),
+        (10, 'admin_users_search', 'GET', VirtualUser.admin_search_path, None, None),
+        (10, 'admin_revenue', 'GET', '/admin/revenue', None, None),
+        (10, 'admin_contacts', 'GET', '/admin/contacts', None, None),
+        (10, 'admin_blog', 'GET', '/admin/blog', None, None),
+        (8, 'admin_users_export', 'GET', '/admin/users/export', None, None),
+        (7, 'admin_revenue_export', 'GET', '/admin/revenue/export', None, None),
+    ]),
+}
+
+
+class Recorder:
+    """Latencies per endpoint, ignoring everything before ``record_from``"""
+
+    def __init__(self, record_from):
+        self.record_from = record_from
+        self.started = self.finished = None
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._errors = {}
+
+    def record(self, endpoint, elapsed, ok):
+        now = time.monotonic()
+        if now < self.record_from:
+            return
+        with self._lock:
+            if self.started is None:
+                self.started = now - elapsed
+            self.finished = now
+            if ok:
+                self._latencies.setdefault(endpoint, []).append(elapsed)
+            else:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def summary(self):
+        elapsed = max((self.finished or 0) - (self.started or 0), 1e-9)
+        every = sorted(x for latencies in self._latencies.values() for x in latencies)
+        routes = {endpoint: _stats(sorted(self._latencies.get(endpoint, [])),
+                                   self._errors.get(endpoint, 0), elapsed)
+                  for endpoint in sorted(set(self._latencies) | set(self._errors))}
+        return {'seconds': round(elapsed, 2),
+                'total': _stats(every, sum(self._errors.values()), elapsed),
+                'routes': routes}
+
+
+def _percentile(latencies, p):
+    """Nearest-rank percentile of a sorted list, in ms"""
+    if not latencies:
+        return None
+    rank = math.ceil(p / 100 * len(latencies))
+    return round(latencies[max(rank, 1) - 1] * 1000, 2)
+
+
+def _stats(latencies, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'p99_ms': _percentile(latencies, 99),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True,
+                              capture_output=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(database, port):
+    """gunicorn (gunicorn.conf.py) serving the app on ``database``; returns once / answers"""
+    env = dict(os.environ, DB_NAME=database, PORT=str(port), GUNICORN_ACCESS_LOG='/dev/null',
+               ADMIN_USERNAME=BENCH_ADMIN[0], ADMIN_PASSWORD=BENCH_ADMIN[1], CHAT_BACKEND='stub',
+               # every virtual user logs in from 127.0.0.1
+               RATE_LIMIT='0')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                              cwd=ROOT, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise click.ClickException(f'gunicorn exited with status {server.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/')
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.5)
+    stop_server(server)
+    raise click.ClickException('gunicorn did not answer on / within 60s')
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def run_load(url, scale, concurrency, duration, warmup, seed=1):
+    rng = random.Random(seed)
+    recorder = Recorder(time.monotonic() + warmup)
+    stop = time.monotonic() + warmup + duration
+    personas = list(PERSONAS)
+    users = [VirtualUser(rng.choices(personas, weights=[PERSONAS[p][0] for p in personas])[0],
+                         url, scale, random.Random(rng.random()), recorder)
+             for _ in range(concurrency)]
+    threads = [threading.Thread(target=user.run, args=(stop,), daemon=True) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = recorder.summary()
+    result['personas'] = {p: sum(1 for u in users if u.persona == p) for p in personas}
+    return result
+
+
+# ============ COMPARE ============
+
+def _change(before, after):
+    if before is None or after is None or before == 0:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(base, new, threshold=10.0, min_ms=1.0):
+    """Per-route rows ``(endpoint, before, after, p95 change %, rps change %, verdict)``"""
+    report = []
+    for endpoint in sorted(set(base['routes']) | set(new['routes'])):
+        before, after = base['routes'].get(endpoint), new['routes'].get(endpoint)
+        if before is None or after is None:
+            report.append((endpoint, before, after, None, None, 'new' if before is None else 'gone'))
+            continue
+        p95 = _change(before['p95_ms'], after['p95_ms'])
+        rps = _change(before['rps'], after['rps'])
+        slower = (p95 is not None and p95 > threshold
+                  and after['p95_ms'] - before['p95_ms'] >= min_ms)
+        errors = after['errors'] > 0 and before['errors'] == 0
+        if slower or errors or (rps is not None and rps < -threshold):
+            verdict = 'REGRESSION'
+        elif p95 is not None and p95 < -threshold and before['p95_ms'] - after['p95_ms'] >= min_ms:
+            verdict = 'faster'
+        else:
+            verdict = ''
+        report.append((endpoint, before, after, p95, rps, verdict))
+    return report
+
+
+def _format(value, suffix=''):
+    return '-' if value is None else f'{value:.1f}{suffix}'
+
+
+def print_result(result):
+    click.echo(f"{'endpoint':<24}{'req':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for endpoint, stats in [*result['routes'].items(), ('TOTAL', result['total'])]:
+        click.echo(f"{endpoint:<24}{stats['requests']:>8}{stats['errors']:>6}{stats['rps']:>9.1f}"
+                   f"{_format(stats['p50_ms']):>9}{_format(stats['p95_ms']):>9}{_format(stats['p99_ms']):>9}")
+
+
+# ============ CLI ============
+
+@click.group()
+def cli():
+    load_dotenv(os.path.join(ROOT, '.env'))
+
+
+def _check_database(database):
+    # seed drops the database, so never point it at the real one
+    if 'bench' not in database:
+        raise click.BadParameter('database name must contain "bench"', param_hint='--database')
+
+
+@cli.command('seed')
+@click.option('--database', default='balansai_bench', show_default=True)
+@click.option('--scale', default=1.0, show_default=True,
+              help=f'Multiplier on {BASE_USERS} users, {BASE_POSTS} posts, {BASE_CONTACTS} contacts')
+def seed_command(database, scale):
+    """Recreate the benchmark database from init_db.sql and fill it"""
+    _check_database(database)
+    start = time.perf_counter()
+    counts = seed(database, scale)
+    click.echo(', '.join(f'{n} {table}' for table, n in counts.items()))
+    click.echo(f'Seeded {database} in {time.perf_counter() - start:.1f}s')
+
+
+@cli.command('run')
+@click.option('--database', default='balansai_bench', show_default=True)
+@click.option('--scale', default=1.0, show_default=True, help='Scale the database was seeded with')
+@click.option('--url', help='Benchmark a running server instead of starting gunicorn')
+@click.option('--port', default=5100, show_default=True)
+@click.option('--concurrency', default=16, show_default=True, help='Virtual users')
+@click.option('--duration', default=60.0, show_default=True, help='Measured seconds')
+@click.option('--warmup', default=5.0, show_default=True, help='Unmeasured seconds first')
+@click.option('--out', type=click.Path(dir_okay=False), help='Result file [benchmarks/<time>-<commit>.json]')
+def run_command(database, scale, url, port, concurrency, duration, warmup, out):
+    """Drive mixed traffic and record throughput and latency per route"""
+    server = None
+    if url is None:
+        _check_database(database)
+        server = start_server(database, port)
+        url = f'http://127.0.0.1:{port}'
+    try:
+        result = run_load(url, scale, concurrency, duration, warmup)
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    commit = _git_commit()
+    result['meta'] = {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit, 'url': url, 'scale': scale, 'concurrency': concurrency,
+        'duration': duration, 'warmup': warmup,
+        'worker_class': os.getenv('GUNICORN_WORKER_CLASS', 'gthread'),
+        'workers': os.getenv('WEB_CONCURRENCY'), 'threads': os.getenv('GUNICORN_THREADS'),
+        'worker_connections': os.getenv('GUNICORN_WORKER_CONNECTIONS'),
+        'db_pool_size': os.getenv('DB_POOL_SIZE'), 'cpus': os.cpu_count(),
+    }
+    if out is None:
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        out = os.path.join(ROOT, 'benchmarks', f'{stamp}-{commit or "nogit"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    print_result(result)
+    click.echo(f'Saved {out}')
+
+
+@cli.command('compare')
+@click.argument('base', type=click.File())
+@click.argument('new', type=click.File())
+@click.option('--threshold', default=10.0, show_default=True, help='Percent change that counts')
+@click.option('--min-ms', default=1.0, show_default=True, help='Ignore p95 changes smaller than this')
+def compare_command(base, new, threshold, min_ms):
+    """Compare two result files; exit status 1 if any route regressed"""
+    report = compare(json.load(base), json.load(new), threshold, min_ms)
+    click.echo(f"{'endpoint':<24}{'p95 before':>11}{'p95 after':>11}{'change':>9}{'rps change':>12}")
+    for endpoint, before, after, p95, rps, verdict in report:
+        click.echo(f"{endpoint:<24}{_format(before and before['p95_ms']):>11}"
+                   f"{_format(after and after['p95_ms']):>11}{_format(p95, '%'):>9}"
+                   f"{_format(rps, '%'):>12}  {verdict}")
+    regressions = [row[0] for row in report if row[5] == 'REGRESSION']
+    if regressions:
+        click.echo(f"Regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,205 @@
+"""Full-text search over published blog posts.
+
+Posts are tokenized once, when they are written, into an inverted index
+(``blog_search_terms``: term -> post, weighted term frequency) plus a
+per-post length table (``blog_search_docs``). A query only reads the
+postings of its own terms and ranks them with BM25 in Python; the
+``content`` column is read by primary key for the handful of posts whose
+snippets are shown, never scanned.
+
+Tokenization follows ``generate_slug``: every apostrophe variant used for
+o'/g' and the tutuq belgisi (' ʻ ʼ ’ ‘ `) is dropped, so "o'zbek",
+"oʻzbek" and "ozbek" are the same term. Common plural and case suffixes
+are stripped so "hisobotlarni" also finds "hisobot".
+"""
+import html
+import math
+import re
+
+from markupsafe import Markup, escape
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Term frequency multipliers per field
+FIELD_WEIGHTS = (('title', 3), ('tags', 2), ('excerpt', 1), ('content', 1))
+
+MAX_TERM = 64
+SNIPPET_WORDS = 30
+
+_apostrophes_re = re.compile("['ʻʼ’‘`]")
+_tag_re = re.compile(r'<[^>]+>')
+_word_re = re.compile(r"[^\W_]+(?:['ʻʼ’‘`][^\W_]+)*", re.UNICODE)
+
+STOPWORDS = {
+    'va', 'bu', 'u', 'ham', 'esa', 'yoki', 'bilan', 'uchun', 'emas', 'edi',
+    'bir', 'har', 'shu', 'lekin', 'ammo', 'kabi', 'qanday', 'nima', 'the', 'and',
+}
+
+# Longest first; a suffix is only removed if a 3+ letter stem remains
+SUFFIXES = sorted([
+    'larning', 'lardan', 'larda', 'larga', 'larni', 'lari', 'lar',
+    'ning', 'dagi', 'dan', 'da', 'ga', 'ka', 'qa', 'ni', 'imiz', 'ingiz',
+], key=len, reverse=True)
+
+
+def plain_text(markup):
+    """Strip HTML tags and entities from stored post content"""
+    return html.unescape(_tag_re.sub(' ', markup or ''))
+
+
+def normalize(word):
+    """Canonical form of one word (lowercase, no apostrophes, suffixes stripped)"""
+    word = _apostrophes_re.sub('', word.lower())
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    return word[:MAX_TERM]
+
+
+def tokenize(text):
+    """Normalized terms of ``text``, stopwords removed"""
+    terms = []
+    for word in _word_re.findall(text or ''):
+        term = normalize(word)
+        if len(term) > 1 and term not in STOPWORDS:
+            terms.append(term)
+    return terms
+
+
+def document_terms(title, excerpt, content, tags):
+    """Weighted term frequencies and length of one post"""
+    fields = {
+        'title': title,
+        'tags': (tags or '').replace(',', ' '),
+        'excerpt': excerpt,
+        'content': plain_text(content),
+    }
+    frequencies = {}
+    length = 0
+    for field, weight in FIELD_WEIGHTS:
+        for term in tokenize(fields[field]):
+            frequencies[term] = frequencies.get(term, 0) + weight
+            length += weight
+    return frequencies, length
+
+
+# ---- index maintenance (call in the same transaction as the write) ----
+
+def remove_post(cursor, post_id):
+    cursor.execute("DELETE FROM blog_search_terms WHERE post_id = %s", (post_id,))
+    cursor.execute("DELETE FROM blog_search_docs WHERE post_id = %s", (post_id,))
+
+
+def index_post(cursor, post_id, title, excerpt, content, tags, is_published=True):
+    """(Re)index one post; unpublished posts are removed from the index"""
+    remove_post(cursor, post_id)
+    if not is_published:
+        return
+    frequencies, length = document_terms(title, excerpt, content, tags)
+    cursor.execute("INSERT INTO blog_search_docs (post_id, length) VALUES (%s, %s)",
+                   (post_id, length))
+    if frequencies:
+        cursor.executemany(
+            "INSERT INTO blog_search_terms (term, post_id, tf) VALUES (%s, %s, %s)",
+            [(term, post_id, min(tf, 65535)) for term, tf in frequencies.items()]
+        )
+
+
+def rebuild(cursor, batch_size=200):
+    """Reindex every published post (caller commits)"""
+    cursor.execute("DELETE FROM blog_search_terms")
+    cursor.execute("DELETE FROM blog_search_docs")
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, title, excerpt, content, tags FROM blog_posts
+            WHERE is_published = 1 AND id > %s ORDER BY id LIMIT %s
+        """, (last_id, batch_size))
+        posts = cursor.fetchall()
+        if not posts:
+            break
+        for post in posts:
+            index_post(cursor, *post)
+        last_id = posts[-1][0]
+
+
+# ---- querying ----
+
+def search(cursor, q, limit=10, offset=0):
+    """Rank published posts for ``q`` with BM25.
+
+    Returns ``(total, [(post_id, score)])`` for the requested slice.
+    """
+    terms = list(dict.fromkeys(tokenize(q)))
+    if not terms:
+        return 0, []
+
+    cursor.execute("SELECT COUNT(*), AVG(length) FROM blog_search_docs")
+    doc_count, avg_length = cursor.fetchone()
+    if not doc_count:
+        return 0, []
+    avg_length = float(avg_length) or 1.0
+
+    cursor.execute(
+        "SELECT t.term, t.post_id, t.tf, d.length "
+        "FROM blog_search_terms t JOIN blog_search_docs d ON d.post_id = t.post_id "
+        "WHERE t.term IN ({})".format(', '.join(['%s'] * len(terms))),
+        terms
+    )
+    postings = {}
+    for term, post_id, tf, length in cursor.fetchall():
+        postings.setdefault(term, []).append((post_id, tf, length))
+
+    scores = {}
+    for term, docs in postings.items():
+        idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+        for post_id, tf, length in docs:
+            norm = tf + K1 * (1 - B + B * length / avg_length)
+            scores[post_id] = scores.get(post_id, 0.0) + idf * tf * (K1 + 1) / norm
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+    return len(ranked), ranked[offset:offset + limit]
+
+
+def snippet(text, q, words=SNIPPET_WORDS):
+    """HTML-safe excerpt of ``text`` around the densest cluster of query hits"""
+    wanted = set(tokenize(q))
+    tokens = list(_word_re.finditer(text))
+    if not tokens:
+        return Markup('')
+
+    hits = [i for i, m in enumerate(tokens) if normalize(m.group()) in wanted]
+    start = 0
+    if hits:
+        # Sliding window over the sorted hits: the window starting at the
+        # first hit that covers the most hits within ``words`` tokens
+        best, best_count, right = hits[0], 0, 0
+        for left, first in enumerate(hits):
+            while right < len(hits) and hits[right] < first + words:
+                right += 1
+            if right - left > best_count:
+                best, best_count = first, right - left
+        start = max(0, best - words // 4)
+    end = min(len(tokens), start + words)
+
+    hits = set(hits)
+    parts = []
+    position = tokens[start].start()
+    for i in range(start, end):
+        m = tokens[i]
+        parts.append(escape(text[position:m.start()]))
+        if i in hits:
+            parts.append(Markup('<mark>') + escape(m.group()) + Markup('</mark>'))
+        else:
+            parts.append(escape(m.group()))
+        position = m.end()
+
+    result = Markup('').join(parts)
+    if start > 0:
+        result = Markup('… ') + result
+    if end < len(tokens):
+        result = result + Markup(' …')
+    return result
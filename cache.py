@@ -0,0 +1,262 @@
+"""In-process read-model cache.
+
+Entries are tagged (``'blog'``, ``'testimonials'``, ...) and invalidated by
+tag. An invalidation bumps a generation file shared by every worker on the
+host, so a write handled by one gunicorn worker is seen by the others within
+``check_interval`` seconds. Expired or invalidated entries are kept as a
+fallback: if reloading fails (MySQL down, pool exhausted) the last good copy
+is served instead of an error.
+
+``CachedPage`` holds a fully rendered response body together with its
+strong ETag and precompressed gzip/brotli variants.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'generations', 'lock')
+
+    def __init__(self):
+        self.value = None
+        self.expires_at = 0.0
+        self.generations = None
+        self.lock = threading.Lock()
+
+
+class Cache:
+    """TTL cache with tag invalidation, single-flight loads and stale-on-error"""
+
+    def __init__(self, directory=None, max_entries=1024, check_interval=1.0, error_ttl=30):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'balansai-cache')
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.error_ttl = error_ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # tag -> (generation, checked_at), least recently checked first; only
+        # saves a stat, so it is capped at max_entries like the entries are
+        self._generations = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+
+    # ---- tag generations ----
+
+    def _tag_path(self, tag):
+        return os.path.join(self.directory, f'{tag}.gen')
+
+    def generation(self, tag):
+        """Current generation of a tag, re-read from disk at most every check_interval"""
+        now = time.monotonic()
+        cached = self._generations.get(tag)
+        if cached is not None and now - cached[1] < self.check_interval:
+            return cached[0]
+        try:
+            gen = os.stat(self._tag_path(tag)).st_mtime_ns
+        except FileNotFoundError:
+            gen = 0
+        self._remember(tag, gen, now)
+        return gen
+
+    def _remember(self, tag, gen, checked_at):
+        with self._lock:
+            self._generations[tag] = (gen, checked_at)
+            self._generations.move_to_end(tag)
+            while len(self._generations) > self.max_entries:
+                self._generations.popitem(last=False)
+
+    def invalidate(self, *tags):
+        """Mark every entry carrying one of ``tags`` as outdated, in all workers"""
+        for tag in tags:
+            path = self._tag_path(tag)
+            gen = time.time_ns()
+            with open(path, 'a'):
+                pass
+            os.utime(path, ns=(gen, gen))
+            self._remember(tag, os.stat(path).st_mtime_ns, time.monotonic())
+
+    def prune(self, prefix, max_age):
+        """Delete the generation files of ``prefix*`` tags not invalidated for ``max_age`` seconds.
+
+        A missing file reads as generation 0, so an entry cached while the
+        file existed is reloaded, never served stale. One cached before the
+        file was first written also has generation 0; keep ``max_age`` above
+        the entries' TTL so those have expired by the time it is removed.
+        """
+        cutoff = time.time_ns() - int(max_age * 1e9)
+        removed = 0
+        with os.scandir(self.directory) as files:
+            for file in files:
+                if not (file.name.startswith(prefix) and file.name.endswith('.gen')):
+                    continue
+                try:
+                    if file.stat().st_mtime_ns < cutoff:
+                        os.unlink(file.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass  # pruned by another worker
+        with self._lock:
+            for tag in [tag for tag in self._generations if tag.startswith(prefix)]:
+                del self._generations[tag]
+        return removed
+
+    # ---- entries ----
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _fresh(self, entry, tags):
+        return (entry.generations is not None
+                and time.monotonic() < entry.expires_at
+                and entry.generations == tuple(self.generation(t) for t in tags))
+
+    def get(self, key, tags=(), stale=False, default=None):
+        """The cached value for ``key`` without loading it, or ``default``.
+
+        Outdated values count as missing unless ``stale`` is set, which
+        returns the last good copy whatever its age.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.generations is None:
+            return default
+        if self._fresh(entry, tags):
+            self.hits += 1
+            return entry.value
+        if stale:
+            self.stale_served += 1
+            return entry.value
+        return default
+
+    def get_or_load(self, key, loader, ttl=300, tags=(), default=_MISSING):
+        """Return the cached value for ``key``, calling ``loader()`` when needed.
+
+        Only one thread per worker reloads a given key; concurrent callers get
+        the previous value if there is one, or wait for the load otherwise.
+        If there is no previous value either, a failed load raises, or serves
+        ``default`` for ``error_ttl`` seconds when one is given.
+        """
+        entry = self._entry(key)
+        if self._fresh(entry, tags):
+            self.hits += 1
+            return entry.value
+
+        has_value = entry.generations is not None
+        if not entry.lock.acquire(blocking=not has_value):
+            # Someone else is already reloading; serve what we have
+            self.stale_served += 1
+            return entry.value
+
+        try:
+            if self._fresh(entry, tags):
+                self.hits += 1
+                return entry.value
+
+            self.misses += 1
+            generations = tuple(self.generation(t) for t in tags)
+            try:
+                value = loader()
+            except Exception:
+                if has_value:
+                    logger.exception("Reloading cache key %r failed, serving stale copy", key)
+                    self.stale_served += 1
+                elif default is not _MISSING:
+                    logger.exception("Loading cache key %r failed, serving the default", key)
+                    entry.value = default
+                else:
+                    raise
+                # Back off for error_ttl before trying the database again
+                entry.generations = generations
+                entry.expires_at = time.monotonic() + self.error_ttl
+                return entry.value
+
+            entry.value = value
+            entry.generations = generations
+            entry.expires_at = time.monotonic() + ttl
+            return value
+        finally:
+            entry.lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_served': self.stale_served,
+        }
+
+
+class CachedPage:
+    """Rendered HTML body with its ETag and precompressed encodings"""
+
+    __slots__ = ('etag', 'bodies', 'mimetype')
+
+    def __init__(self, body, mimetype='text/html'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.bodies = {
+            'identity': body,
+            'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=11)
+
+    def _etag_for(self, encoding):
+        # Strong ETags must differ between encodings of the same content
+        return self.etag if encoding == 'identity' else f'{self.etag}-{encoding}'
+
+    def make_response(self, request, cache_control='no-cache'):
+        """Build a 200 or 304 response for ``request``"""
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in self.bodies and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        if any(request.if_none_match.contains(self._etag_for(e)) for e in self.bodies):
+            response = Response(status=304)
+        else:
+            response = Response(self.bodies[encoding], mimetype=self.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(self._etag_for(encoding))
+        response.headers['Cache-Control'] = cache_control
+        response.vary.add('Accept-Encoding')
+        return response
@@ -0,0 +1,98 @@
+"""AI assistant chat: model adapters and server-sent events.
+
+A backend turns the conversation history (``[{'role', 'content'}]``,
+oldest first) into an iterator of text chunks. ``load_backend`` picks one
+by name or by ``package.module:ClassName`` import path, so a real model
+client can be plugged in without touching the routes. ``StubBackend``
+answers deterministically with configurable latencies, which makes
+throughput and time-to-first-token measurable offline.
+"""
+import hashlib
+import importlib
+import json
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+
+
+class ChatBackend(ABC):
+    """Base class for model adapters; a subclass must implement ``stream``"""
+
+    name = 'base'
+
+    @classmethod
+    def from_env(cls):
+        """Build the backend from environment variables"""
+        return cls()
+
+    @abstractmethod
+    def stream(self, history):
+        """Yield the assistant reply to ``history`` chunk by chunk"""
+
+
+class StubBackend(ChatBackend):
+    """Deterministic local backend for development and load tests.
+
+    The reply depends only on the last user message, waits
+    ``first_token_delay`` seconds before the first chunk and
+    ``token_delay`` seconds between the following ones.
+    """
+
+    name = 'stub'
+
+    VOCABULARY = (
+        'daromad', 'xarajat', 'foyda', 'hisobot', 'tahlil', 'mijozlar', 'savdo',
+        'oylik', 'prognoz', 'byudjet', 'biznesingiz', 'ko\'rsatkichlar', 'o\'sish',
+        'naqd', 'pul', 'oqimi', 'soliq', 'rejalashtirish', 'samaradorlik', 'narx',
+        'va', 'uchun', 'bo\'yicha', 'sizning', 'keyingi', 'oyda', 'tavsiya', 'qilaman',
+    )
+
+    def __init__(self, tokens=60, first_token_delay=0.3, token_delay=0.03):
+        self.tokens = tokens
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            tokens=int(os.getenv('CHAT_STUB_TOKENS', 60)),
+            first_token_delay=float(os.getenv('CHAT_STUB_FIRST_TOKEN_DELAY', 0.3)),
+            token_delay=float(os.getenv('CHAT_STUB_TOKEN_DELAY', 0.03)),
+        )
+
+    def stream(self, history):
+        prompt = next((m['content'] for m in reversed(history) if m['role'] == 'user'), '')
+        seed = int.from_bytes(hashlib.sha256(prompt.encode('utf-8')).digest()[:8], 'big')
+        rng = random.Random(seed)
+
+        for i in range(self.tokens):
+            time.sleep(self.first_token_delay if i == 0 else self.token_delay)
+            word = rng.choice(self.VOCABULARY)
+            if i == 0:
+                yield word.capitalize()
+            elif i == self.tokens - 1:
+                yield f" {word}."
+            else:
+                yield f" {word}"
+
+
+BACKENDS = {
+    'stub': StubBackend,
+}
+
+
+def load_backend(spec):
+    """Instantiate a backend from a registered name or ``module:Class`` path"""
+    if spec in BACKENDS:
+        return BACKENDS[spec].from_env()
+    module_name, _, class_name = spec.partition(':')
+    if not class_name:
+        raise ValueError(f"Unknown chat backend: {spec}")
+    cls = getattr(importlib.import_module(module_name), class_name)
+    return cls.from_env()
+
+
+def sse(event, data):
+    """Encode one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
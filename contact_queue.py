@@ -0,0 +1,350 @@
+"""Durable intake queue for contact-form submissions.
+
+``submit`` only writes the submission to a JSON file in
+``directory/incoming`` (fsynced, then renamed into place) and returns, so
+the request never waits on MySQL or a mail server. A background thread in
+each worker then:
+
+1. claims up to ``batch_size`` files by renaming them into ``writing/``
+   (a rename succeeds for exactly one worker),
+2. inserts them into ``contacts`` with one multi-row INSERT and one rollup
+   update per day, in a single commit,
+3. moves them to ``outbox/``, from where the notification email for each
+   one is sent through the mail transport, and deletes them once sent.
+
+Only failures that can pass are retried: a database ``OperationalError``
+(or no pooled connection) puts the batch back, a transport error puts the
+notifications back. A submission that can't be parsed or that MySQL rejects
+for its content, and a notification that can't be built, are moved to
+``failed/`` for a look by hand, so one bad file can't hold back the ones
+queued after it.
+
+Files claimed by a worker that died are put back on the next pass, so a
+submission is written at least once. It can be written twice only if the
+worker dies between the commit and the rename that follows it.
+
+Repeated submissions (same email and message, ignoring case and spacing)
+within ``duplicate_window`` seconds are recognised with a single ``stat``
+of a marker file in ``seen/`` and dropped without touching the queue.
+"""
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from email.message import EmailMessage
+
+import MySQLdb
+
+import rollups
+from db import PoolClosed, PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+_SPACE = re.compile(r'\s+')
+
+# Worth retrying later: the database or the pool, not the rows, is the problem
+TRANSIENT_ERRORS = (MySQLdb.OperationalError, PoolTimeout, PoolClosed)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def one_line(value):
+    """``value`` with every run of whitespace, line breaks included, as one space"""
+    return _SPACE.sub(' ', value).strip()
+
+
+def contact_row(entry):
+    """``(name, email, message, created_at)`` of a spooled submission; ValueError if malformed"""
+    try:
+        row = (entry['name'], entry['email'], entry['message'],
+               datetime.datetime.fromisoformat(entry['created_at']))
+    except (KeyError, TypeError) as e:
+        raise ValueError(f'Malformed contact submission: {e!r}') from e
+    if not all(isinstance(value, str) for value in row[:3]):
+        raise ValueError('Malformed contact submission')
+    return row
+
+
+def fingerprint(email, message):
+    """Duplicate key: the same text from the same address, however it is spaced or cased"""
+    text = f"{email.strip().lower()}\0{_SPACE.sub(' ', message).strip().lower()}"
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+class ContactQueue:
+    """Accepts submissions into a spool directory and writes them behind the request"""
+
+    def __init__(self, db, directory, transport=None, notify_to=None, notify_from=None,
+                 flush_interval=2.0, batch_size=200, duplicate_window=86400, on_written=None):
+        self.db = db
+        self.directory = directory
+        self.transport = transport
+        self.notify_to = notify_to
+        self.notify_from = notify_from or notify_to
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.duplicate_window = duplicate_window
+        self.on_written = on_written
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._pruned_at = 0.0
+
+        for name in ('incoming', 'writing', 'outbox', 'sending', 'failed', 'seen'):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+        atexit.register(self.flush)
+
+    # ---- intake (request thread) ----
+
+    def submit(self, name, email, message):
+        """Queue a validated submission; False if it repeats a recent one"""
+        key = fingerprint(email, message)
+        if not self._mark_seen(key):
+            return False
+
+        now = datetime.datetime.now()
+        entry = {'name': name, 'email': email, 'message': message,
+                 'created_at': now.isoformat(timespec='seconds')}
+        filename = f'{now:%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}.json'
+        tmp = os.path.join(self.directory, 'incoming', f'.{filename}.tmp')
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(entry, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, os.path.join(self.directory, 'incoming', filename))
+        except OSError:
+            # Not queued, so a retry must not count as a duplicate
+            os.unlink(os.path.join(self.directory, 'seen', key))
+            raise
+
+        self._ensure_thread()
+        return True
+
+    def _mark_seen(self, key):
+        path = os.path.join(self.directory, 'seen', key)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(path).st_mtime < self.duplicate_window:
+                    return False
+            except FileNotFoundError:
+                pass  # pruned in between
+            open(path, 'w').close()  # old marker: refresh its mtime
+            return True
+        os.close(fd)
+        return True
+
+    def pending(self):
+        """Submissions not yet in the database, notifications not yet sent, and
+        files set aside in ``failed/``"""
+        def count(*names):
+            return sum(len(os.listdir(os.path.join(self.directory, name))) for name in names)
+        return {'contacts': count('incoming', 'writing'), 'notifications': count('outbox', 'sending'),
+                'failed': count('failed')}
+
+    # ---- background writer ----
+
+    def _ensure_thread(self):
+        # After a fork only the calling thread survives, so each worker starts its own
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='contact-queue', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Contact queue pass failed")
+
+    def start(self):
+        """Start this worker's writer without waiting for a submission (drains leftovers)"""
+        self._ensure_thread()
+
+    def flush(self):
+        """Write everything waiting in ``incoming/`` and send pending notifications"""
+        self._recover()
+        while self._write_batch():
+            pass
+        self._send_outbox()
+        if time.monotonic() - self._pruned_at > 3600:
+            self._prune_seen()
+
+    def _claim(self, source, target, limit):
+        """Rename up to ``limit`` files from ``source`` into ``target`` as ``{pid}.{name}``"""
+        claimed = []
+        prefix = f'{os.getpid()}.'
+        for name in sorted(os.listdir(os.path.join(self.directory, source))):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.directory, target, prefix + name)
+            try:
+                os.rename(os.path.join(self.directory, source, name), path)
+            except FileNotFoundError:
+                continue  # another worker took it
+            claimed.append(path)
+            if len(claimed) >= limit:
+                break
+        return claimed
+
+    def _recover(self):
+        """Put back files claimed by workers that no longer exist"""
+        for claimed, source in (('writing', 'incoming'), ('sending', 'outbox')):
+            for name in os.listdir(os.path.join(self.directory, claimed)):
+                pid, _, original = name.partition('.')
+                if pid.isdigit() and int(pid) != os.getpid() and not _alive(int(pid)):
+                    try:
+                        os.rename(os.path.join(self.directory, claimed, name),
+                                  os.path.join(self.directory, source, original))
+                    except FileNotFoundError:
+                        pass
+
+    def _move(self, path, target):
+        os.rename(path, os.path.join(self.directory, target, os.path.basename(path).partition('.')[2]))
+
+    def _write_batch(self):
+        paths = self._claim('incoming', 'writing', self.batch_size)
+        if not paths:
+            return False
+
+        rows = {}
+        for path in paths:
+            try:
+                with open(path) as f:
+                    rows[path] = contact_row(json.load(f))
+            except (OSError, ValueError):
+                logger.exception("Unreadable contact submission %s, moved to failed/", path)
+                self._move(path, 'failed')
+
+        written, retry = self._write_rows(rows)
+        for path in retry:
+            self._move(path, 'incoming')
+        for path in written:
+            if self.transport is not None and self.notify_to:
+                self._move(path, 'outbox')
+            else:
+                os.unlink(path)
+        if written and self.on_written is not None:
+            self.on_written(len(written))
+        return not retry and len(paths) == self.batch_size
+
+    def _write_rows(self, rows):
+        """Insert ``{path: row}``; returns the paths written and those to retry"""
+        try:
+            self._insert(list(rows.values()))
+            return list(rows), []
+        except TRANSIENT_ERRORS:
+            logger.exception("Failed to write %d contact submissions, retrying later", len(rows))
+            return [], list(rows)
+        except Exception:
+            logger.exception("Batch of %d contact submissions rejected, writing them one by one", len(rows))
+
+        # One bad row fails the whole INSERT: find it, and write the rest
+        written = []
+        paths = list(rows)
+        for index, path in enumerate(paths):
+            try:
+                self._insert([rows[path]])
+            except TRANSIENT_ERRORS:
+                logger.exception("Failed to write contact submission %s, retrying later", path)
+                return written, paths[index:]
+            except Exception:
+                logger.exception("Contact submission %s rejected by the database, moved to failed/", path)
+                self._move(path, 'failed')
+            else:
+                written.append(path)
+        return written, []
+
+    def _insert(self, rows):
+        if not rows:
+            return
+        days = Counter(row[3].date() for row in rows)
+        with self.db.pool.connection() as conn:
+            cursor = conn.cursor()
+            # MySQLdb sends this as one multi-row INSERT
+            cursor.executemany(
+                "INSERT INTO contacts (name, email, message, created_at) VALUES (%s, %s, %s, %s)",
+                rows
+            )
+            rollups.record_contacts(cursor, days)
+            conn.commit()
+            cursor.close()
+
+    # ---- notifications ----
+
+    def _message(self, entry):
+        # Header values must be single lines; /contact already collapses the
+        # name, this also covers files queued before it did
+        message = EmailMessage()
+        message['Subject'] = f"Yangi murojaat: {one_line(entry['name'])}"
+        message['From'] = self.notify_from
+        message['To'] = self.notify_to
+        message['Reply-To'] = one_line(entry['email'])
+        message.set_content(
+            f"Ism: {entry['name']}\n"
+            f"Email: {entry['email']}\n"
+            f"Vaqt: {entry['created_at']}\n\n"
+            f"{entry['message']}\n"
+        )
+        return message
+
+    def _send_outbox(self):
+        if self.transport is None:
+            return
+        paths = self._claim('outbox', 'sending', self.batch_size)
+        for index, path in enumerate(paths):
+            try:
+                with open(path) as f:
+                    message = self._message(json.load(f))
+            except Exception:
+                # Retrying can't fix the file itself; set it aside and go on
+                logger.exception("Cannot build contact notification %s, moved to failed/", path)
+                self._move(path, 'failed')
+                continue
+            try:
+                self.transport.send(message)
+            except Exception:
+                logger.exception("Failed to send contact notification %s, retrying later", path)
+                # The transport is probably down: hand the rest back for the next pass
+                for rest in paths[index:]:
+                    self._move(rest, 'outbox')
+                return
+            os.unlink(path)
+
+    def _prune_seen(self):
+        self._pruned_at = time.monotonic()
+        cutoff = time.time() - self.duplicate_window
+        seen = os.path.join(self.directory, 'seen')
+        for name in os.listdir(seen):
+            try:
+                if os.stat(os.path.join(seen, name)).st_mtime < cutoff:
+                    os.unlink(os.path.join(seen, name))
+            except FileNotFoundError:
+                pass
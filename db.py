@@ -0,0 +1,296 @@
+"""Pooled MySQL connections.
+
+``MySQLPool`` is a drop-in replacement for ``flask_mysqldb.MySQL``: route code
+keeps calling ``mysql.connection.cursor()`` and ``mysql.connection.commit()``,
+but the connection is checked out of a bounded per-process pool on first use
+and handed back when the app context tears down instead of being closed.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import MySQLdb
+from flask import g
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out in time"""
+
+
+class PoolClosed(Exception):
+    """Raised when checking a connection out of a pool after ``close_all``"""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of MySQLdb connections.
+
+    Idle connections are reused LIFO so the warmest one is handed out first.
+    A connection is pinged on checkout when it has been idle longer than
+    ``ping_interval`` seconds and is replaced once it is older than
+    ``recycle`` seconds, so server-side ``wait_timeout`` kills never reach
+    route code.
+    """
+
+    def __init__(self, connect_kwargs, size=5, timeout=10.0, recycle=3600, ping_interval=30):
+        self.connect_kwargs = connect_kwargs
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+
+        self._cond = threading.Condition()
+        self._idle = []      # [(conn, created_at, last_used)]
+        self._in_use = {}    # id(conn) -> (conn, created_at)
+        self._created = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._ping_failures = 0
+
+    def _connect(self):
+        return MySQLdb.connect(**self.connect_kwargs)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        """Check a connection out of the pool"""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        waited = False
+
+        with self._cond:
+            if self._closed:
+                raise PoolClosed("Connection pool is closed")
+            while not self._idle and self._created >= self.size:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No MySQL connection available after {timeout:.1f}s "
+                        f"(pool size {self.size})"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+                if self._closed:
+                    raise PoolClosed("Connection pool is closed")
+
+            if self._idle:
+                conn, created_at, last_used = self._idle.pop()
+            else:
+                conn, created_at, last_used = None, None, None
+                self._created += 1
+
+            elapsed = time.monotonic() - start
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += elapsed
+                self._max_wait = max(self._max_wait, elapsed)
+
+        # Network round trips happen outside the lock
+        try:
+            conn, created_at = self._checkout(conn, created_at, last_used)
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use[id(conn)] = (conn, created_at)
+        return conn
+
+    def _checkout(self, conn, created_at, last_used):
+        now = time.monotonic()
+
+        if conn is not None and now - created_at > self.recycle:
+            self._close(conn)
+            with self._cond:
+                self._recycled += 1
+            conn = None
+
+        if conn is not None and now - last_used > self.ping_interval:
+            try:
+                conn.ping()
+            except MySQLdb.Error:
+                self._close(conn)
+                with self._cond:
+                    self._ping_failures += 1
+                conn = None
+
+        if conn is None:
+            conn = self._connect()
+            created_at = time.monotonic()
+
+        return conn, created_at
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool.
+
+        Any open transaction is rolled back so the next borrower never sees
+        uncommitted writes or a stale REPEATABLE READ snapshot.
+        """
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            return
+
+        if not discard:
+            try:
+                conn.rollback()
+            except MySQLdb.Error:
+                discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._close(conn)
+                self._created -= 1
+            else:
+                self._idle.append((conn, entry[1], time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection outside of a request (background jobs, CLI)"""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except MySQLdb.OperationalError:
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close_all(self):
+        """Close the pool: idle connections now, in-use ones when they are released.
+
+        Later checkouts raise ``PoolClosed``.
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_max': round(self._max_wait, 6),
+                'timeouts': self._timeouts,
+                'recycled': self._recycled,
+                'ping_failures': self._ping_failures,
+            }
+
+
+class MySQLPool:
+    """Flask extension exposing ``connection`` backed by a ``ConnectionPool``"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('MYSQL_HOST', 'localhost')
+        app.config.setdefault('MYSQL_USER', None)
+        app.config.setdefault('MYSQL_PASSWORD', None)
+        app.config.setdefault('MYSQL_DB', None)
+        app.config.setdefault('MYSQL_PORT', 3306)
+        app.config.setdefault('MYSQL_UNIX_SOCKET', None)
+        app.config.setdefault('MYSQL_CONNECT_TIMEOUT', 10)
+        app.config.setdefault('MYSQL_CHARSET', 'utf8mb4')
+        app.config.setdefault('MYSQL_POOL_SIZE', 5)
+        app.config.setdefault('MYSQL_POOL_TIMEOUT', 10)
+        app.config.setdefault('MYSQL_POOL_RECYCLE', 3600)
+        app.config.setdefault('MYSQL_POOL_PING_INTERVAL', 30)
+        app.config.setdefault('MYSQL_CURSORCLASS', None)
+
+        app.teardown_appcontext(self.teardown)
+
+    def _connect_kwargs(self):
+        config = self.app.config
+        kwargs = {
+            'host': config['MYSQL_HOST'],
+            'port': config['MYSQL_PORT'],
+            'connect_timeout': config['MYSQL_CONNECT_TIMEOUT'],
+            'charset': config['MYSQL_CHARSET'],
+            'use_unicode': True,
+        }
+        if config['MYSQL_USER']:
+            kwargs['user'] = config['MYSQL_USER']
+        if config['MYSQL_PASSWORD']:
+            kwargs['passwd'] = config['MYSQL_PASSWORD']
+        if config['MYSQL_DB']:
+            kwargs['db'] = config['MYSQL_DB']
+        if config['MYSQL_UNIX_SOCKET']:
+            kwargs['unix_socket'] = config['MYSQL_UNIX_SOCKET']
+        if config['MYSQL_CURSORCLASS']:
+            kwargs['cursorclass'] = config['MYSQL_CURSORCLASS']
+        return kwargs
+
+    @property
+    def pool(self):
+        """Per-process pool, rebuilt after a fork so workers never share sockets"""
+        pid = os.getpid()
+        if self._pool is None or self._pid != pid:
+            with self._lock:
+                if self._pool is None or self._pid != pid:
+                    config = self.app.config
+                    self._pool = ConnectionPool(
+                        self._connect_kwargs(),
+                        size=int(config['MYSQL_POOL_SIZE']),
+                        timeout=float(config['MYSQL_POOL_TIMEOUT']),
+                        recycle=int(config['MYSQL_POOL_RECYCLE']),
+                        ping_interval=int(config['MYSQL_POOL_PING_INTERVAL']),
+                    )
+                    self._pid = pid
+        return self._pool
+
+    @property
+    def connection(self):
+        """Connection bound to the current app context"""
+        conn = g.get('_mysql_conn')
+        if conn is None:
+            conn = self.pool.acquire()
+            g._mysql_conn = conn
+        return conn
+
+    def release_connection(self):
+        """Hand the request's connection back early (e.g. before a long stream)"""
+        conn = g.pop('_mysql_conn', None)
+        if conn is not None:
+            self.pool.release(conn)
+
+    def teardown(self, exception):
+        conn = g.pop('_mysql_conn', None)
+        if conn is not None:
+            self.pool.release(conn, discard=isinstance(exception, MySQLdb.OperationalError))
+
+    def stats(self):
+        return self.pool.stats()
@@ -0,0 +1,71 @@
+"""Streaming CSV exports.
+
+Rows are read from an unbuffered server-side cursor (``SSCursor``) in
+batches and encoded to CSV as they arrive, so memory use stays flat no
+matter how large the table is and the first bytes reach the client
+immediately. Output can optionally be gzip-compressed on the fly.
+"""
+import csv
+import datetime
+import zlib
+from io import StringIO
+
+from MySQLdb.cursors import SSCursor
+
+
+def parse_date_range(date_from, date_to):
+    """Turn ``YYYY-MM-DD`` strings into a half-open [start, end) datetime range"""
+    start = end = None
+    if date_from:
+        start = datetime.datetime.strptime(date_from, '%Y-%m-%d')
+    if date_to:
+        end = datetime.datetime.strptime(date_to, '%Y-%m-%d') + datetime.timedelta(days=1)
+    return start, end
+
+
+def stream_csv(pool, query, params, header, row_fn, compress=False, batch_size=500,
+               cursor_class=SSCursor):
+    """Yield CSV (or gzip) chunks for ``query``, one batch of rows per chunk.
+
+    A connection is borrowed from ``pool`` for the lifetime of the stream and
+    returned when the generator finishes. ``cursor_class`` must be an
+    unbuffered cursor (the profiler passes its ``SSCursor`` subclass). If the
+    client goes away mid-stream the connection is discarded rather than
+    drained: reading off the rest of a large result would keep the worker
+    and the MySQL session busy for nobody.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def take():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        if compressor is not None:
+            data = compressor.compress(data)
+        return data
+
+    writer.writerow(header)
+    yield take()
+
+    conn = pool.acquire()
+    discard = True
+    try:
+        cursor = conn.cursor(cursor_class)
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            writer.writerows(row_fn(row) for row in rows)
+            chunk = take()
+            if chunk:
+                yield chunk
+        cursor.close()
+        discard = False
+    finally:
+        pool.release(conn, discard=discard)
+
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,137 @@
+"""Parallel execution of independent read queries.
+
+A route that needs several unrelated reads hands them to ``FanOut.run`` as a
+dict of named tasks. Each task runs on a shared per-process thread pool
+inside its own app context, so ``mysql.connection`` in the task checks out a
+separate pooled connection (only if the task actually touches the database)
+and returns it when the task ends. The batch takes as long as its slowest
+query instead of the sum of all of them.
+
+The calling request hands its own connection back before the batch starts,
+so it never holds one while waiting for more: a worker needs at most one
+connection per request being served plus one per fan-out thread, and
+requests can't starve each other's tasks out of the pool.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+Batch = namedtuple('Batch', ['results', 'timings', 'elapsed'])
+
+
+class FanOutTimeout(Exception):
+    """Raised when a batch did not finish within its timeout.
+
+    ``results`` holds the tasks that did finish, by name, and ``late`` the
+    names of the rest (still running, or failed), so a page can still be
+    rendered without them.
+    """
+
+    def __init__(self, message, results=None, late=()):
+        super().__init__(message)
+        self.results = results or {}
+        self.late = list(late)
+
+
+class FanOut:
+    """Runs named read tasks concurrently on pooled connections.
+
+    A task is either a zero-argument callable (typically a read-model
+    loader) or a ``(sql, params)`` tuple whose rows are fetched with
+    ``fetchall()``.
+    """
+
+    def __init__(self, app, db, max_workers=4, timeout=5.0, slow_threshold=0.5):
+        self.app = app
+        self.db = db
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.slow_threshold = slow_threshold
+
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Per-process thread pool; worker threads don't survive a fork"""
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='fanout')
+                    self._pid = pid
+        return self._executor
+
+    def _call(self, task, submitted):
+        started = time.monotonic()
+        with self.app.app_context():
+            if callable(task):
+                result = task()
+            else:
+                sql, params = task
+                cursor = self.db.connection.cursor()
+                cursor.execute(sql, params)
+                result = cursor.fetchall()
+                cursor.close()
+        finished = time.monotonic()
+        # Time spent queued for a thread is reported separately from run time
+        return result, {'queued': started - submitted, 'duration': finished - started}
+
+    def run(self, tasks, timeout=None):
+        """Run every task and return a ``Batch`` of results and timings by name.
+
+        Raises ``FanOutTimeout``, carrying the finished tasks' results, if the
+        batch is not done after ``timeout`` seconds; tasks already running
+        finish in the background and release their connections. The first
+        task exception is re-raised.
+
+        The caller's connection is released first, which rolls back anything
+        it left uncommitted: fan out before writing, or after committing.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.db.release_connection()
+        start = time.monotonic()
+        # Each task runs in a copy of the caller's context, so per-request
+        # state in context variables (the SQL profile) follows it
+        futures = {name: self.executor.submit(contextvars.copy_context().run, self._call, task, start)
+                   for name, task in tasks.items()}
+
+        done, pending = wait(futures.values(), timeout=timeout)
+        if pending:
+            for future in pending:
+                future.cancel()
+            late = sorted(name for name, future in futures.items() if future in pending)
+            message = f"Queries {', '.join(late)} did not finish in {timeout:g}s"
+            # A task that finished by raising has no result either: it is
+            # reported with the late ones instead of replacing the timeout
+            results, failed = {}, []
+            for name, future in futures.items():
+                if future in done:
+                    error = future.exception()
+                    if error is None:
+                        results[name] = future.result()[0]
+                    else:
+                        logger.error("Query %s failed: %r", name, error)
+                        failed.append(name)
+            if failed:
+                message += f"; {', '.join(sorted(failed))} failed"
+            raise FanOutTimeout(message, results, sorted(late + failed))
+
+        results = {}
+        timings = {}
+        for name, future in futures.items():
+            results[name], timings[name] = future.result()
+        elapsed = time.monotonic() - start
+
+        if elapsed > self.slow_threshold:
+            logger.warning("Slow query batch (%.3fs): %s", elapsed, ', '.join(
+                f"{name}={timing['duration']:.3f}s" for name, timing in timings.items()))
+        return Batch(results, timings, elapsed)
@@ -0,0 +1,146 @@
+"""Gunicorn settings, read automatically when gunicorn starts in this directory.
+
+Serving modes (GUNICORN_WORKER_CLASS):
+
+- ``gthread`` (default): ``WEB_CONCURRENCY`` processes x ``GUNICORN_THREADS``
+  threads. mysqlclient releases the GIL while it waits on MySQL, so other
+  threads keep serving.
+- ``gevent``: one event loop per process with up to
+  ``GUNICORN_WORKER_CONNECTIONS`` greenlets (25 by default). Needs
+  ``requirements-async.txt``; the stdlib is monkey-patched and PyMySQL (pure
+  Python, so its sockets cooperate with the loop) is installed in place of
+  mysqlclient, whose C calls would block the whole loop.
+- ``sync``: one request at a time per process (the old behaviour).
+
+Each worker's MySQL pool is sized from the same numbers: one connection per
+request it can serve at once (threads, greenlets or 1), plus the fan-out
+and background threads. Greenlets are cheap but connections aren't, so
+``GUNICORN_WORKER_CONNECTIONS`` is what bounds the connections a gevent
+worker opens.
+
+All workers together may open workers x pool connections, which must stay
+under MySQL's ``max_connections`` (151 by default) with room left for the
+CLI and other clients: ``DB_MAX_CONNECTIONS`` (140 by default) is that
+budget. The default worker count is capped to fit it, and an explicit
+``WEB_CONCURRENCY`` that doesn't fit is refused at startup.
+
+The app is preloaded in the master so workers share its memory
+copy-on-write. Pools, caches and background threads in the app check the
+PID and rebuild themselves in each worker after the fork.
+
+Every template is compiled in the master before the first fork, and each
+worker requests the hot pages once (``WARMUP_PATHS``) before it accepts
+traffic. The time from fork to ready is logged per worker.
+
+When a worker exits it writes its last request metrics and SQL profile,
+and the master folds them into the retired totals, so ``/metrics`` counters keep counting across worker
+restarts and no per-worker files pile up.
+"""
+import multiprocessing
+import os
+import time
+
+from dotenv import load_dotenv
+
+# The same .env the app reads, so the pool settings below agree with it
+load_dotenv()
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # Must happen before preload_app imports the app and creates its locks
+    from gevent import monkey
+    monkey.patch_all()
+
+    import pymysql
+    pymysql.install_as_MySQLdb()
+
+cpus = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+threads = int(os.getenv('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 25))
+
+# Requests a worker serves at once; the app sizes its MySQL pool from this
+# (and refuses an explicit DB_POOL_SIZE below what it implies)
+concurrency = {'gthread': threads, 'gevent': worker_connections}.get(worker_class, 1)
+os.environ['WORKER_CONCURRENCY'] = str(concurrency)
+
+# The app's default pool: concurrent requests + fan-out threads + the view
+# counter and contact queue threads (checked against the app in when_ready)
+pool_size = int(os.getenv('DB_POOL_SIZE', concurrency + int(os.getenv('DB_FANOUT_WORKERS', 4)) + 2))
+db_max_connections = int(os.getenv('DB_MAX_CONNECTIONS', 140))
+
+workers = int(os.getenv('WEB_CONCURRENCY', max(1, min(cpus * 2 + 1, db_max_connections // pool_size))))
+if workers * pool_size > db_max_connections:
+    raise RuntimeError(
+        f"{workers} workers x a pool of {pool_size} = {workers * pool_size} MySQL connections, over "
+        f"DB_MAX_CONNECTIONS={db_max_connections}. Lower WEB_CONCURRENCY or the per-worker "
+        f"concurrency, or raise MySQL's max_connections and DB_MAX_CONNECTIONS together."
+    )
+
+preload_app = True
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so slow leaks can't accumulate
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    import warmup
+    app = server.app.wsgi()
+    count, elapsed = warmup.compile_templates(app.jinja_env)
+    server.log.info("Compiled %d templates in %.0fms", count, elapsed * 1000)
+    app_pool_size = app.config['MYSQL_POOL_SIZE']
+    server.log.info("MySQL connections: up to %d of %d (%d workers x pool of %d for %d concurrent requests)",
+                    workers * app_pool_size, db_max_connections, workers, app_pool_size, concurrency)
+    if workers * app_pool_size > db_max_connections:
+        raise RuntimeError(f"The app's pool of {app_pool_size} connections per worker doesn't fit "
+                           f"DB_MAX_CONNECTIONS={db_max_connections} with {workers} workers")
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    import warmup
+    app = worker.wsgi
+    # Drain contact submissions left in the spool by earlier workers
+    app.extensions['contact_queue'].start()
+    timings = warmup.warm_up(app, app.config['WARMUP_PATHS'],
+                             budget=app.config['WARMUP_BUDGET'], notify=worker.notify)
+    worker.log.info("Worker %s ready in %.0fms (%s)", worker.pid,
+                    (time.monotonic() - worker.forked_at) * 1000, warmup.format_timings(timings))
+
+
+def worker_exit(server, worker):
+    # Values recorded since the last periodic write, before child_exit retires them
+    app = getattr(worker, 'wsgi', None)  # unset if the worker failed to boot
+    if app is None:
+        return
+    for name in ('metrics', 'sql_profiler'):
+        if name in app.extensions:
+            app.extensions[name].flush()
+
+
+def child_exit(server, worker):
+    if not server.cfg.preload_app:
+        return
+    extensions = server.app.wsgi().extensions
+    for name in ('metrics', 'sql_profiler'):
+        if name not in extensions:
+            continue
+        try:
+            extensions[name].retire(worker.pid)
+        except OSError:
+            server.log.exception("Could not retire %s of worker %s", name, worker.pid)
@@ -20,7 +20,8 @@ CREATE TABLE IF NOT EXISTS users (
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     INDEX idx_email (email),
     INDEX idx_plan (plan_type),
-    INDEX idx_active (is_active)
+    INDEX idx_active (is_active),
+    INDEX idx_created (created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Payments table
@@ -48,7 +49,8 @@ CREATE TABLE IF NOT EXISTS contacts (
     is_read BOOLEAN DEFAULT 0,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     INDEX idx_read (is_read),
-    INDEX idx_date (created_at)
+    INDEX idx_date (created_at),
+    INDEX idx_read_date (is_read, created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Settings table
@@ -80,7 +82,8 @@ CREATE TABLE IF NOT EXISTS blog_posts (
     INDEX idx_slug (slug),
     INDEX idx_published (is_published),
     INDEX idx_category (category),
-    INDEX idx_date (created_at)
+    INDEX idx_date (created_at),
+    INDEX idx_published_date (is_published, published_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Testimonials table
@@ -119,7 +122,8 @@ CREATE TABLE IF NOT EXISTS messages (
     content TEXT NOT NULL,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
-    INDEX idx_conversation (conversation_id),
+    -- Chat windows seek backwards along this index (also serves the FK)
+    INDEX idx_conversation_date (conversation_id, created_at, id),
     INDEX idx_date (created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
@@ -136,6 +140,108 @@ CREATE TABLE IF NOT EXISTS password_resets (
     INDEX idx_user (user_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Prefix index for admin user search (flask rebuild-user-search)
+CREATE TABLE IF NOT EXISTS user_search_terms (
+    term VARCHAR(32) NOT NULL,
+    user_id INT NOT NULL,
+    weight TINYINT NOT NULL DEFAULT 1,
+    PRIMARY KEY (term, user_id),
+    INDEX idx_user (user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin;
+
+-- Inverted index for blog search (flask rebuild-blog-search)
+CREATE TABLE IF NOT EXISTS blog_search_docs (
+    post_id INT PRIMARY KEY,
+    length INT NOT NULL,
+    FOREIGN KEY (post_id) REFERENCES blog_posts(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS blog_search_terms (
+    term VARCHAR(64) NOT NULL,
+    post_id INT NOT NULL,
+    tf SMALLINT UNSIGNED NOT NULL,
+    PRIMARY KEY (term, post_id),
+    INDEX idx_post (post_id),
+    FOREIGN KEY (post_id) REFERENCES blog_posts(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin;
+
+-- Dashboard rollups, maintained by the app on every write and, for
+-- payments, by the triggers below. Backfill or repair with: flask rebuild-stats
+CREATE TABLE IF NOT EXISTS stats_daily (
+    day DATE PRIMARY KEY,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    payments INT NOT NULL DEFAULT 0,
+    signups INT NOT NULL DEFAULT 0,
+    contacts INT NOT NULL DEFAULT 0,
+    -- net change in active (not blocked) users
+    active_users INT NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Each total is split over up to 16 slots (rollups.TOTALS_SLOTS); reads sum them
+CREATE TABLE IF NOT EXISTS stats_totals (
+    name VARCHAR(50) NOT NULL,
+    slot TINYINT UNSIGNED NOT NULL DEFAULT 0,
+    value DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, slot)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+INSERT INTO stats_totals (name, slot, value) VALUES
+('total_users', 0, 0),
+('active_users', 0, 0),
+('total_revenue', 0, 0),
+('unread_contacts', 0, 0)
+ON DUPLICATE KEY UPDATE name=name;
+
+-- Payments are also written by the billing side, so their rollups are kept
+-- by triggers rather than by the app. Each trigger is a single statement
+-- (no DELIMITER needed); totals use slot id % 16 (rollups.TOTALS_SLOTS).
+-- Deletes cascaded from users don't fire triggers: rollups.record_user_delete
+-- subtracts those payments itself.
+DROP TRIGGER IF EXISTS payments_insert_daily;
+CREATE TRIGGER payments_insert_daily AFTER INSERT ON payments FOR EACH ROW
+    INSERT INTO stats_daily (day, revenue, payments)
+    SELECT DATE(NEW.created_at), NEW.amount, 1 FROM DUAL WHERE NEW.status = 'completed'
+    ON DUPLICATE KEY UPDATE revenue = revenue + VALUES(revenue), payments = payments + VALUES(payments);
+
+DROP TRIGGER IF EXISTS payments_insert_totals;
+CREATE TRIGGER payments_insert_totals AFTER INSERT ON payments FOR EACH ROW
+    INSERT INTO stats_totals (name, slot, value)
+    SELECT 'total_revenue', NEW.id % 16, NEW.amount FROM DUAL WHERE NEW.status = 'completed'
+    ON DUPLICATE KEY UPDATE value = value + VALUES(value);
+
+-- A status, amount or date change takes the old row out and puts the new one in
+DROP TRIGGER IF EXISTS payments_update_daily;
+CREATE TRIGGER payments_update_daily AFTER UPDATE ON payments FOR EACH ROW
+    INSERT INTO stats_daily (day, revenue, payments)
+    SELECT change_day, change_revenue, change_count FROM (
+        SELECT DATE(OLD.created_at) AS change_day, -OLD.amount AS change_revenue, -1 AS change_count
+        FROM DUAL WHERE OLD.status = 'completed'
+        UNION ALL
+        SELECT DATE(NEW.created_at), NEW.amount, 1 FROM DUAL WHERE NEW.status = 'completed'
+    ) AS changes
+    ON DUPLICATE KEY UPDATE revenue = revenue + VALUES(revenue), payments = payments + VALUES(payments);
+
+DROP TRIGGER IF EXISTS payments_update_totals;
+CREATE TRIGGER payments_update_totals AFTER UPDATE ON payments FOR EACH ROW
+    INSERT INTO stats_totals (name, slot, value)
+    SELECT 'total_revenue', NEW.id % 16,
+           IF(NEW.status = 'completed', NEW.amount, 0) - IF(OLD.status = 'completed', OLD.amount, 0)
+    FROM DUAL WHERE OLD.status = 'completed' OR NEW.status = 'completed'
+    ON DUPLICATE KEY UPDATE value = value + VALUES(value);
+
+DROP TRIGGER IF EXISTS payments_delete_daily;
+CREATE TRIGGER payments_delete_daily AFTER DELETE ON payments FOR EACH ROW
+    INSERT INTO stats_daily (day, revenue, payments)
+    SELECT DATE(OLD.created_at), -OLD.amount, -1 FROM DUAL WHERE OLD.status = 'completed'
+    ON DUPLICATE KEY UPDATE revenue = revenue + VALUES(revenue), payments = payments + VALUES(payments);
+
+DROP TRIGGER IF EXISTS payments_delete_totals;
+CREATE TRIGGER payments_delete_totals AFTER DELETE ON payments FOR EACH ROW
+    INSERT INTO stats_totals (name, slot, value)
+    SELECT 'total_revenue', OLD.id % 16, -OLD.amount FROM DUAL WHERE OLD.status = 'completed'
+    ON DUPLICATE KEY UPDATE value = value + VALUES(value);
+
 -- Insert default settings
 INSERT INTO settings (key_name, value, description) VALUES
 ('site_title', 'BalansAI.uz', 'Sayt nomi'),
@@ -0,0 +1,105 @@
+"""Outgoing email transports.
+
+A transport delivers ready ``EmailMessage`` objects. ``load_transport``
+picks one by name or by ``package.module:ClassName`` import path, the same
+way chat backends are loaded, so a provider API can be plugged in without
+touching the callers:
+
+- ``file`` writes each message as an ``.eml`` file into ``MAIL_FILE_DIR``
+  (development, and a record of what would have been sent);
+- ``smtp`` sends through ``SMTP_HOST``/``SMTP_PORT``, with STARTTLS and
+  login when ``SMTP_USER`` is set.
+
+Transports are called from background threads, never inside a request.
+"""
+import importlib
+import os
+import smtplib
+import time
+import uuid
+
+
+class Transport:
+    """Base class for mail transports"""
+
+    name = 'base'
+
+    @classmethod
+    def from_env(cls):
+        """Build the transport from environment variables"""
+        return cls()
+
+    def send(self, message):
+        """Deliver one ``EmailMessage``; raise on failure so it is retried"""
+        raise NotImplementedError
+
+
+class FileTransport(Transport):
+    """Writes messages to ``directory`` instead of sending them"""
+
+    name = 'file'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv('MAIL_FILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           '.mail')))
+
+    def send(self, message):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}.eml')
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(message.as_bytes())
+        os.replace(f'{path}.tmp', path)
+
+
+class SMTPTransport(Transport):
+    """Sends through an SMTP relay, one connection per call"""
+
+    name = 'smtp'
+
+    def __init__(self, host, port=587, username=None, password=None, starttls=True, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            host=os.getenv('SMTP_HOST', 'localhost'),
+            port=int(os.getenv('SMTP_PORT', 587)),
+            username=os.getenv('SMTP_USER') or None,
+            password=os.getenv('SMTP_PASSWORD') or None,
+            starttls=os.getenv('SMTP_STARTTLS', '1') == '1',
+            timeout=float(os.getenv('SMTP_TIMEOUT', 10)),
+        )
+
+    def send(self, message):
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+
+TRANSPORTS = {
+    'file': FileTransport,
+    'smtp': SMTPTransport,
+}
+
+
+def load_transport(spec):
+    """Instantiate a transport from a registered name or ``module:Class`` path"""
+    if spec in TRANSPORTS:
+        return TRANSPORTS[spec].from_env()
+    module_name, _, class_name = spec.partition(':')
+    if not class_name:
+        raise ValueError(f"Unknown mail transport: {spec}")
+    cls = getattr(importlib.import_module(module_name), class_name)
+    return cls.from_env()
@@ -0,0 +1,336 @@
+"""Prometheus metrics aggregated over all gunicorn workers.
+
+Each worker keeps its own counters, gauges and histograms in memory and a
+background thread writes them to ``metrics-{pid}.json`` in ``directory``
+every ``flush_interval`` seconds, busy or idle; gunicorn's ``worker_exit``
+hook writes the final values.
+``render()`` merges every worker's file into the Prometheus text format:
+counters and histograms are summed, gauges are summed (in-flight requests,
+pool connections) over the workers that are still running.
+
+A worker that exits (``max_requests`` recycling, a crash) leaves its last
+snapshot behind. Its counters and histograms are folded into
+``metrics-retired.json`` and its gauges dropped, so totals never go
+backwards and the directory doesn't fill up with dead workers. Retiring
+holds ``metrics.lock`` exclusively and scrapes read under a shared lock, so
+a scrape never counts a retiring worker twice or not at all.
+
+Values from other workers are at most ``flush_interval`` seconds old; the
+worker answering the scrape writes its own snapshot first.
+"""
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers cached pages (~1ms) up to slow exports
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Any other method token a client sends is counted as 'other'
+HTTP_METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(labels):
+    """``{'endpoint': 'index'}`` -> ``endpoint="index"`` (also the snapshot key)"""
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _number(value):
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """Flask extension recording request metrics, plus a registry for the rest"""
+
+    def __init__(self, app=None, directory=None, flush_interval=5.0):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'balansai-cache')
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._types = {}       # name -> (type, help, buckets)
+        self._values = {}      # name -> {labels: value, or [bucket counts..., sum] for histograms}
+        self._collectors = []  # callables returning current values of counters/gauges kept elsewhere
+        self._shared_collectors = []
+        self._pid = os.getpid()
+        self._thread_pid = None
+
+        self.counter('http_requests_total', 'Requests by endpoint, method and status code')
+        self.histogram('http_request_duration_seconds', 'Time to build the response, by endpoint',
+                       LATENCY_BUCKETS)
+        self.gauge('http_requests_in_flight', 'Requests being handled right now')
+        self.histogram('http_request_db_seconds', 'SQL time per request, by endpoint', DB_BUCKETS)
+        self.counter('http_request_db_queries_total', 'SQL statements run, by endpoint')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['metrics'] = self
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    # ---- registry ----
+
+    def counter(self, name, help):
+        self._types[name] = ('counter', help, None)
+
+    def gauge(self, name, help):
+        self._types[name] = ('gauge', help, None)
+
+    def histogram(self, name, help, buckets):
+        self._types[name] = ('histogram', help, tuple(buckets))
+
+    def collector(self, fn):
+        """Register ``fn() -> [(name, labels, value), ...]``, read at every snapshot.
+
+        For numbers another object already keeps per process (pool and cache
+        stats); counters reported this way are that process's running total.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def shared_collector(self, fn):
+        """Register ``fn() -> [(name, labels, value), ...]`` for numbers that are the
+        same in every worker (a shared directory); read once per scrape, not summed"""
+        self._shared_collectors.append(fn)
+        return fn
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Forked worker: start from zero instead of the master's numbers
+            self._values.clear()
+            self._pid = os.getpid()
+
+    def _series(self, name):
+        self._check_fork()
+        return self._values.setdefault(name, {})
+
+    def inc(self, name, labels, amount=1):
+        key = _labels(labels)
+        with self._lock:
+            series = self._series(name)
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = self._types[name][2]
+        key = _labels(labels)
+        with self._lock:
+            series = self._series(name)
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * (len(buckets) + 1) + [0.0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(buckets)
+            counts[index] += 1
+            counts[-1] += value
+
+    # ---- request hooks ----
+
+    def _start(self):
+        g._metrics_started = time.perf_counter()
+        self.inc('http_requests_in_flight', {}, 1)
+
+    def _finish(self, response):
+        started = g.get('_metrics_started')
+        if started is None:
+            return response
+        # Unmatched URLs and unknown methods share one series each so
+        # scanners can't grow the table
+        endpoint = request.endpoint or '<unmatched>'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        self.inc('http_requests_total', {'endpoint': endpoint, 'method': method,
+                                         'status': response.status_code})
+        self.observe('http_request_duration_seconds', {'endpoint': endpoint},
+                     time.perf_counter() - started)
+
+        profile = g.get('_sql_profile')  # set when the SQL profiler is on
+        if profile is not None:
+            statements = list(profile.statements)
+            self.observe('http_request_db_seconds', {'endpoint': endpoint},
+                         sum(statement[1] for statement in statements))
+            if statements:
+                self.inc('http_request_db_queries_total', {'endpoint': endpoint}, len(statements))
+        return response
+
+    def _teardown(self, exception):
+        if g.pop('_metrics_started', None) is not None:
+            self.inc('http_requests_in_flight', {}, -1)
+            self._ensure_thread()
+
+    # ---- snapshots ----
+
+    def _path(self, name):
+        return os.path.join(self.directory, f'metrics-{name}.json')
+
+    def _run_collectors(self, collectors):
+        collected = {}
+        for fn in collectors:
+            try:
+                for name, labels, value in fn():
+                    collected.setdefault(name, {})[_labels(labels)] = value
+            except Exception:
+                logger.exception("Metrics collector %r failed", fn)
+        return collected
+
+    def _snapshot(self):
+        collected = self._run_collectors(self._collectors)
+        with self._lock:
+            self._check_fork()
+            values = {name: {key: list(value) if isinstance(value, list) else value
+                             for key, value in series.items()}
+                      for name, series in self._values.items()}
+        values.update(collected)
+        return values
+
+    def _ensure_thread(self):
+        # Threads don't survive the fork: each worker starts its own writer
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self._thread_pid = pid
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write this worker's snapshot now"""
+        self._write(self._path(os.getpid()), self._snapshot())
+
+    def _write(self, path, values):
+        tmp = f'{path}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(values, f)
+            os.replace(tmp, path)
+        except OSError:
+            logger.exception("Could not write metrics to %s", path)
+
+    def _locked(self, mode):
+        """``metrics.lock`` held in ``mode``; released when the returned file closes"""
+        lock = open(os.path.join(self.directory, 'metrics.lock'), 'a')
+        fcntl.flock(lock, mode)
+        return lock
+
+    def retire(self, pid):
+        """Fold a finished worker's counters and histograms into the retired totals"""
+        path = self._path(pid)
+        # Exclusive: a scrape must see the worker either in its own file or in
+        # the retired totals, never in both or neither
+        with self._locked(fcntl.LOCK_EX):
+            try:
+                with open(path) as f:
+                    values = json.load(f)
+            except (OSError, ValueError):
+                return
+            retired = self._read(self._path('retired')) or {}
+            self._merge(retired, values, gauges=False)
+            self._write(self._path('retired'), retired)
+            os.unlink(path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _merge(self, into, values, gauges=True):
+        for name, series in values.items():
+            kind = self._types.get(name, ('gauge',))[0]
+            if kind == 'gauge' and not gauges:
+                continue
+            target = into.setdefault(name, {})
+            for key, value in series.items():
+                if isinstance(value, list):
+                    current = target.get(key)
+                    if current is None or len(current) != len(value):
+                        target[key] = list(value)
+                    else:
+                        target[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target[key] = target.get(key, 0) + value
+
+    def collect(self):
+        """Every worker's values merged, retiring the files of workers that are gone"""
+        self.flush()
+        for name in os.listdir(self.directory):
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            pid = name[len('metrics-'):-len('.json')]
+            if pid.isdigit() and int(pid) != os.getpid() and not _alive(int(pid)):
+                try:
+                    self.retire(int(pid))
+                except OSError:
+                    logger.exception("Could not retire metrics of worker %s", pid)
+
+        merged = {}
+        with self._locked(fcntl.LOCK_SH):
+            for name in os.listdir(self.directory):
+                if name.startswith('metrics-') and name.endswith('.json'):
+                    values = self._read(os.path.join(self.directory, name))
+                    if values:
+                        self._merge(merged, values)
+        merged.update(self._run_collectors(self._shared_collectors))
+        return merged
+
+    def render(self):
+        """Prometheus text exposition of ``collect()``"""
+        merged = self.collect()
+        lines = []
+        for name in sorted(merged):
+            kind, help, buckets = self._types.get(name, ('gauge', '', None))
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(merged[name].items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{{{key}}} {_number(value)}' if key
+                                 else f'{name} {_number(value)}')
+                    continue
+                prefix = f'{key},' if key else ''
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else repr(bound)
+                    lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+                suffix = f'{{{key}}}' if key else ''
+                lines.append(f'{name}_sum{suffix} {_number(value[-1])}')
+                lines.append(f'{name}_count{suffix} {cumulative}')
+        return '\n'.join(lines) + '\n'
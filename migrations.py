@@ -0,0 +1,106 @@
+"""Schema upgrades for databases created from the original ``init_db.sql``.
+
+``init_db.sql`` only creates what is missing (``CREATE TABLE IF NOT
+EXISTS``), so running it on an existing database adds new tables but never
+the indexes added to tables that are already there. ``migrate`` compares
+the live schema (``information_schema``) with what the app expects and
+applies only the missing pieces, so it is safe to run on every deploy.
+Triggers are created the same way, from the ``CREATE TRIGGER`` statements
+of ``init_db.sql``.
+
+Tables it creates are derived data; the caller fills them with the
+existing rebuild commands (see ``REBUILDS``).
+"""
+import re
+
+# New tables and the rebuild that fills them
+REBUILDS = {
+    'user_search_terms': 'user-search',
+    'blog_search_docs': 'blog-search',
+    'blog_search_terms': 'blog-search',
+    'stats_daily': 'stats',
+    'stats_totals': 'stats',
+}
+
+# (table, index, ALTER TABLE clause), in the order they must be applied
+INDEXES = [
+    # Keyset pagination of the admin listings and the blog
+    ('users', 'idx_created', 'ADD INDEX idx_created (created_at)'),
+    ('contacts', 'idx_read_date', 'ADD INDEX idx_read_date (is_read, created_at)'),
+    ('blog_posts', 'idx_published_date', 'ADD INDEX idx_published_date (is_published, published_at)'),
+    # Chat windows seek backwards along it; also serves the conversation FK
+    ('messages', 'idx_conversation_date', 'ADD INDEX idx_conversation_date (conversation_id, created_at, id)'),
+]
+
+# Indexes replaced by a wider one in INDEXES, dropped after it exists
+DROPPED_INDEXES = [
+    ('messages', 'idx_conversation'),
+]
+
+_CREATE_TABLE = re.compile(r'CREATE TABLE IF NOT EXISTS (\w+) \(.*?\) ENGINE=[^;]*;', re.DOTALL)
+_CREATE_TRIGGER = re.compile(r'^CREATE TRIGGER (\w+) .*?;$', re.DOTALL | re.MULTILINE)
+
+
+def create_statements(schema_sql):
+    """``{table: CREATE TABLE IF NOT EXISTS ...}`` from the text of ``init_db.sql``"""
+    return {match.group(1): match.group(0).rstrip(';') for match in _CREATE_TABLE.finditer(schema_sql)}
+
+
+def trigger_statements(schema_sql):
+    """``{trigger: CREATE TRIGGER ...}`` from the text of ``init_db.sql``"""
+    return {match.group(1): match.group(0).rstrip(';') for match in _CREATE_TRIGGER.finditer(schema_sql)}
+
+
+def _exists(cursor, sql, params):
+    cursor.execute(sql, params)
+    return cursor.fetchone() is not None
+
+
+def has_table(cursor, table):
+    return _exists(cursor, "SELECT 1 FROM information_schema.tables "
+                           "WHERE table_schema = DATABASE() AND table_name = %s", (table,))
+
+
+def has_trigger(cursor, trigger):
+    return _exists(cursor, "SELECT 1 FROM information_schema.triggers "
+                           "WHERE trigger_schema = DATABASE() AND trigger_name = %s", (trigger,))
+
+
+def has_index(cursor, table, index):
+    return _exists(cursor, "SELECT 1 FROM information_schema.statistics "
+                           "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s "
+                           "LIMIT 1", (table, index))
+
+
+def migrate(cursor, schema_sql, log=print):
+    """Bring the connected database up to ``schema_sql``; returns the rebuilds needed.
+
+    DDL commits implicitly in MySQL, so every step is applied on its own and
+    an interrupted run picks up where it stopped.
+    """
+    rebuilds = set()
+
+    for table, statement in create_statements(schema_sql).items():
+        if not has_table(cursor, table):
+            cursor.execute(statement)
+            log(f'Created table {table}')
+            if table in REBUILDS:
+                rebuilds.add(REBUILDS[table])
+
+    # After the tables: the triggers write to the rollup tables
+    for trigger, statement in trigger_statements(schema_sql).items():
+        if not has_trigger(cursor, trigger):
+            cursor.execute(statement)
+            log(f'Created trigger {trigger}')
+
+    for table, index, clause in INDEXES:
+        if not has_index(cursor, table, index):
+            cursor.execute(f"ALTER TABLE {table} {clause}")
+            log(f'Added index {table}.{index}')
+
+    for table, index in DROPPED_INDEXES:
+        if has_index(cursor, table, index):
+            cursor.execute(f"ALTER TABLE {table} DROP INDEX {index}")
+            log(f'Dropped index {table}.{index}')
+
+    return rebuilds
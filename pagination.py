@@ -0,0 +1,160 @@
+"""Keyset (seek) pagination.
+
+Instead of ``LIMIT n OFFSET k`` the next page is fetched with a
+``WHERE (sort columns) < (last row's values)`` condition, so the cost of a
+page does not grow with its depth. Pages are addressed by opaque
+``after``/``before`` tokens that encode the sort values of the boundary row.
+The first ``MAX_OFFSET_PAGE`` pages can still be opened by number.
+"""
+import base64
+import datetime
+import json
+import math
+from collections import namedtuple
+from decimal import Decimal
+
+MAX_OFFSET_PAGE = 10
+
+Page = namedtuple('Page', ['rows', 'page', 'next_cursor', 'prev_cursor'])
+
+
+def encode_cursor(values):
+    """Encode a row's sort values as a URL-safe token"""
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime.datetime):
+            encoded.append({'dt': value.isoformat()})
+        elif isinstance(value, Decimal):
+            encoded.append({'dec': str(value)})
+        else:
+            encoded.append(value)
+    raw = json.dumps(encoded, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if len(value) != 1:
+            raise ValueError('Invalid page cursor')
+        (kind, text), = value.items()
+        if not isinstance(text, str) or kind not in ('dt', 'dec'):
+            raise ValueError('Invalid page cursor')
+        if kind == 'dt':
+            return datetime.datetime.fromisoformat(text)
+        try:
+            number = Decimal(text)
+        except ArithmeticError as e:  # decimal.InvalidOperation is not a ValueError
+            raise ValueError('Invalid page cursor') from e
+        if not number.is_finite():
+            raise ValueError('Invalid page cursor')
+        return number
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError('Invalid page cursor')
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    raise ValueError('Invalid page cursor')
+
+
+def decode_cursor(token, size=None):
+    """Decode a token produced by encode_cursor, raising ValueError if malformed.
+
+    ``size`` is the number of keyset columns the token must carry. Only
+    ValueError escapes, so a token that decodes can always be passed to
+    ``Keyset.seek``.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        encoded = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid page cursor') from e
+    if not isinstance(encoded, list) or not encoded or (size is not None and len(encoded) != size):
+        raise ValueError('Invalid page cursor')
+    return [_decode_value(value) for value in encoded]
+
+
+class Keyset:
+    """Sort order of a listing, e.g. ``Keyset([('created_at', 'DESC'), ('id', 'DESC')])``
+
+    The last column must be unique (normally the primary key) so that every
+    row has a distinct position.
+    """
+
+    def __init__(self, columns):
+        self.columns = [(name, direction.upper()) for name, direction in columns]
+
+    def order_by(self, reverse=False):
+        parts = []
+        for name, direction in self.columns:
+            if reverse:
+                direction = 'ASC' if direction == 'DESC' else 'DESC'
+            parts.append(f"{name} {direction}")
+        return ' ORDER BY ' + ', '.join(parts)
+
+    def seek(self, values, reverse=False):
+        """Condition selecting rows strictly after ``values`` in sort order.
+
+        Expanded to ``a < x OR (a = x AND b < y)`` rather than a row
+        constructor so mixed ASC/DESC orders work and MySQL can range-scan
+        the leading index column.
+        """
+        if len(values) != len(self.columns):
+            raise ValueError('Invalid page cursor')
+
+        clauses = []
+        params = []
+        for i, (name, direction) in enumerate(self.columns):
+            descending = (direction == 'DESC') != reverse
+            parts = [f"{prev} = %s" for prev, _ in self.columns[:i]]
+            parts.append(f"{name} {'<' if descending else '>'} %s")
+            clauses.append('(' + ' AND '.join(parts) + ')')
+            params.extend(values[:i + 1])
+        return '(' + ' OR '.join(clauses) + ')', params
+
+
+def paginate(cursor, query, params, keyset, key, per_page, page=1, after=None, before=None,
+             row_type=None):
+    """Run ``query`` (which must end in a WHERE clause) one page at a time.
+
+    Rows are returned as ``row_type`` if given (see ``rows.row_type``).
+    ``key(row)`` returns the row's values for the keyset columns. Malformed
+    cursors fall back to numbered pages; page numbers past MAX_OFFSET_PAGE
+    are clamped so deep OFFSET scans can't be requested directly.
+    """
+    params = list(params)
+    page = max(page, 1)
+    reverse = False
+
+    try:
+        after = decode_cursor(after, len(keyset.columns)) if after else None
+        before = decode_cursor(before, len(keyset.columns)) if before else None
+    except ValueError:
+        after = before = None
+
+    if after is not None or before is not None:
+        reverse = after is None
+        condition, seek_params = keyset.seek(after if not reverse else before, reverse=reverse)
+        query += ' AND ' + condition + keyset.order_by(reverse) + ' LIMIT %s'
+        params.extend(seek_params)
+        params.append(per_page + 1)
+    else:
+        page = min(page, MAX_OFFSET_PAGE)
+        query += keyset.order_by() + ' LIMIT %s OFFSET %s'
+        params.extend([per_page + 1, (page - 1) * per_page])
+
+    cursor.execute(query, params)
+    rows = list(cursor.fetchall())
+    if row_type is not None:
+        rows = [row_type._make(row) for row in rows]
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if reverse:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next = has_more
+        has_prev = after is not None or page > 1
+
+    next_cursor = encode_cursor(key(rows[-1])) if rows and has_next else None
+    prev_cursor = encode_cursor(key(rows[0])) if rows and has_prev else None
+    return Page(rows, page, next_cursor, prev_cursor)
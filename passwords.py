@@ -0,0 +1,139 @@
+"""Password hashing off the request thread.
+
+Hashing is deliberately slow, so ``PasswordHasher`` runs it in a small
+per-worker process pool: a burst of logins uses at most ``processes`` CPUs
+instead of pinning every gunicorn worker, and page views keep being served.
+Callers beyond ``processes + queue_size`` in flight get ``HasherBusy`` after
+``wait`` seconds rather than piling up.
+
+The hash method (e.g. ``scrypt:65536:8:1``) is configurable and
+``calibrate`` picks the cost that meets a target latency on the current
+host. Hashes made with weaker parameters are reported by
+``needs_rehash`` so they can be upgraded on the next successful login.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Werkzeug's default; existing hashes were made with it
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+# Calibration never goes below these costs
+MIN_SCRYPT_N = 2 ** 15
+MAX_SCRYPT_N = 2 ** 20
+MIN_PBKDF2_ITERATIONS = 600_000
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated"""
+
+
+def _cost(method):
+    """``(algorithm, cost tuple)`` of a Werkzeug method string"""
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else MIN_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}', (iterations,)
+    if name == 'scrypt':
+        n, r, p = (int(a) for a in args) if args else (MIN_SCRYPT_N, 8, 1)
+        return name, (n, r, p)
+    return name, ()
+
+
+def needs_rehash(pwhash, method):
+    """Whether ``pwhash`` was made with another algorithm or a lower cost than ``method``"""
+    stored = pwhash.split('$', 1)[0]
+    stored_name, stored_cost = _cost(stored)
+    name, cost = _cost(method)
+    return stored_name != name or any(s < c for s, c in zip(stored_cost, cost))
+
+
+def calibrate(target_ms=250, algorithm='scrypt'):
+    """Method string whose hash takes about ``target_ms`` on this host.
+
+    scrypt's N is doubled while a hash stays within the target (it also
+    doubles memory: 128 * N * r bytes); PBKDF2 iterations scale linearly.
+    """
+    target = target_ms / 1000
+    if algorithm == 'scrypt':
+        n = MIN_SCRYPT_N
+        while n < MAX_SCRYPT_N and _time_hash(f'scrypt:{n * 2}:8:1') <= target:
+            n *= 2
+        return f'scrypt:{n}:8:1'
+
+    probe = 100_000
+    elapsed = min(_time_hash(f'pbkdf2:sha256:{probe}') for _ in range(3))
+    iterations = max(MIN_PBKDF2_ITERATIONS, round(int(probe * target / elapsed), -4))
+    return f'pbkdf2:sha256:{iterations}'
+
+
+def _time_hash(method):
+    start = time.perf_counter()
+    generate_password_hash('calibration-password', method=method)
+    return time.perf_counter() - start
+
+
+class PasswordHasher:
+    """Bounded process pool for ``generate_password_hash``/``check_password_hash``"""
+
+    def __init__(self, method=DEFAULT_METHOD, processes=2, queue_size=16, wait=3.0, timeout=30.0):
+        self.method = method
+        self.processes = processes
+        self.wait = wait
+        self.timeout = timeout
+
+        self._slots = threading.BoundedSemaphore(processes + queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Per-process pool; spawned, not forked, since workers run threads"""
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context('spawn'),
+                    )
+                    self._pid = pid
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait):
+            raise HasherBusy(f"Password hashing queue full after {self.wait:g}s")
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # A hash already running in a pool process can't be cancelled, so
+        # the slot is held until the work ends, not until the caller gives up
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy("Password hashing timed out") from None
+        except BrokenProcessPool:
+            # A pool process died (e.g. OOM-killed); start a fresh pool next time
+            self._executor = None
+            raise
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return needs_rehash(pwhash, self.method)
@@ -0,0 +1,471 @@
+"""Per-request SQL profiling.
+
+``QueryProfiler`` installs a cursor class on the pool's connections that
+times every statement and records its normalized text, duration, row count
+and call site into the current request's profile (a context variable, so
+``FanOut`` tasks that copy the context report into the same request). After
+the request:
+
+- a ``Server-Timing`` header reports the query count, database time,
+  template time and total time (visible in the browser's network panel);
+- statements slower than ``slow_query`` seconds and statements repeated
+  ``repeat_threshold`` or more times in one request (the N+1 pattern) are
+  logged with their call site;
+- per-route and per-statement totals are added to the worker's stats, which
+  are written to ``directory`` every few seconds so ``report()`` can merge
+  all workers for the admin view.
+
+Streamed bodies (CSV exports) run after the header is sent: their
+unbuffered cursor is profiled with the time spent in execute and fetch
+calls, and ``profile_stream`` reports it under ``<endpoint> (stream)``.
+
+When a worker exits its snapshot is folded into ``sqlprofile-retired.json``
+and deleted (from gunicorn's ``child_exit``, or by the next report for a
+worker that died without it), so recycled workers don't leave a file each.
+
+The cost per statement is two clock reads, a short stack walk and a cached
+normalization, so it is meant to stay on in production.
+"""
+import contextvars
+import fcntl
+import functools
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import MySQLdb
+from flask import before_render_template, g, request, template_rendered
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('sql_profile', default=None)
+
+# Plumbing whose frames are skipped when looking for a statement's call site
+_SKIP_FILES = {os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+               for name in ('profiler.py', 'db.py', 'fanout.py', 'pagination.py')}
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_VALUES_LIST = re.compile(r'(VALUES\s*\([^)]*\))(?:\s*,\s*\([^)]*\))+', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@functools.lru_cache(maxsize=2048)
+def normalize(sql):
+    """Statement text with literals and IN/VALUES lists collapsed, so
+    ``id IN (%s, %s, %s)`` and ``id IN (%s)`` count as the same statement"""
+    sql = _SPACE.sub(' ', sql).strip()
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    sql = _VALUES_LIST.sub(r'\1, ...', sql)
+    return sql
+
+
+def _call_site():
+    """``file:line function`` of the app code that ran the statement"""
+    fallback = '?'
+    frame = sys._getframe(3)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_ROOT) and 'site-packages' not in filename:
+            site = f'{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}'
+            if filename not in _SKIP_FILES:
+                return site
+            if fallback == '?':
+                fallback = site
+        frame = frame.f_back
+    return fallback
+
+
+class RequestProfile:
+    """Statements and template time of one request"""
+
+    __slots__ = ('statements', 'template_time', 'template_started', 'started')
+
+    def __init__(self):
+        self.statements = []   # (normalized sql, seconds, rows, call site)
+        self.template_time = 0.0
+        self.template_started = None
+        self.started = time.perf_counter()
+
+
+def _record(sql, elapsed, rows):
+    profile = _current.get()
+    if profile is not None:
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', 'replace')
+        profile.statements.append((normalize(sql), elapsed, rows, _call_site()))
+
+
+class ProfiledCursorMixin:
+    """Times ``execute``/``executemany`` into the current request's profile"""
+
+    _in_executemany = False
+
+    def execute(self, query, args=None):
+        if self._in_executemany:
+            return super().execute(query, args)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            _record(query, time.perf_counter() - start, max(self.rowcount or 0, 0))
+
+    def executemany(self, query, args):
+        # MySQLdb may fall back to execute() per row; record the batch once
+        self._in_executemany = True
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, args)
+        finally:
+            self._in_executemany = False
+            _record(query, time.perf_counter() - start, max(self.rowcount or 0, 0))
+
+
+class ProfiledStreamingCursorMixin:
+    """Profiling for unbuffered cursors (``SSCursor``).
+
+    Their rows arrive while fetching, so a statement's time is the sum of
+    its execute and fetch calls (not the gaps between them, which are spent
+    sending rows to the client), recorded when the next statement starts or
+    the cursor closes.
+    """
+
+    _statement = None   # [query, seconds, rows]
+
+    def _flush_statement(self):
+        statement, self._statement = self._statement, None
+        if statement is not None:
+            _record(*statement)
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._statement is not None:
+                self._statement[1] += time.perf_counter() - start
+
+    def execute(self, query, args=None):
+        self._flush_statement()
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            self._statement = [query, time.perf_counter() - start, 0]
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is not None and self._statement is not None:
+            self._statement[2] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, size)
+        if self._statement is not None:
+            self._statement[2] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self._statement is not None:
+            self._statement[2] += len(rows)
+        return rows
+
+    def close(self):
+        # Closing reads off whatever the client didn't fetch
+        try:
+            return self._timed(super().close)
+        finally:
+            self._flush_statement()
+
+
+def profiled_cursor_class(base, streaming=False):
+    mixin = ProfiledStreamingCursorMixin if streaming else ProfiledCursorMixin
+    return type('Profiled' + base.__name__, (mixin, base), {})
+
+
+class QueryProfiler:
+    """Flask extension wiring the profile into each request"""
+
+    def __init__(self, app=None, directory=None, slow_query=0.1, repeat_threshold=5,
+                 flush_interval=10.0, max_statements=500):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'balansai-cache')
+        self.slow_query = slow_query
+        self.repeat_threshold = repeat_threshold
+        self.flush_interval = flush_interval
+        self.max_statements = max_statements
+
+        self._lock = threading.Lock()
+        self._routes = {}       # endpoint -> [requests, total s, db s, queries, max s]
+        self._statements = {}   # sql -> [calls, total s, max s, rows, call site]
+        self._flushed_at = time.monotonic()
+        self._pid = os.getpid()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['sql_profiler'] = self
+        app.config['MYSQL_CURSORCLASS'] = profiled_cursor_class(MySQLdb.cursors.Cursor)
+        self.streaming_cursor_class = profiled_cursor_class(MySQLdb.cursors.SSCursor, streaming=True)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+
+    # ---- request hooks ----
+
+    def _start(self):
+        profile = RequestProfile()
+        g._sql_profile = profile
+        g._sql_profile_token = _current.set(profile)
+
+    def _template_started(self, sender, template, context, **extra):
+        profile = _current.get()
+        if profile is not None:
+            profile.template_started = time.perf_counter()
+
+    def _template_finished(self, sender, template, context, **extra):
+        profile = _current.get()
+        if profile is not None and profile.template_started is not None:
+            profile.template_time += time.perf_counter() - profile.template_started
+            profile.template_started = None
+
+    def _finish(self, response):
+        profile = g.get('_sql_profile')
+        if profile is None:
+            return response
+
+        total = time.perf_counter() - profile.started
+        statements = list(profile.statements)
+        db_time = sum(statement[1] for statement in statements)
+        response.headers['Server-Timing'] = (
+            f'db;desc="{len(statements)} queries";dur={db_time * 1000:.1f}, '
+            f'tpl;dur={profile.template_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+        # Unmatched URLs share one entry so scanners can't grow the table
+        endpoint = request.endpoint or '<unmatched>'
+        self._check(endpoint, statements)
+        self._add(endpoint, total, db_time, statements)
+        return response
+
+    def _teardown(self, exception):
+        token = g.pop('_sql_profile_token', None)
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:  # torn down from another context (streamed response)
+                _current.set(None)
+
+    def profile_stream(self, chunks, endpoint):
+        """Iterate a streamed response body under a profile of its own.
+
+        The body runs after the request's profile is closed and its
+        Server-Timing header sent, so its statements (CSV exports) are
+        checked and added to the stats as ``<endpoint> (stream)``.
+        """
+        profile = RequestProfile()
+
+        def step(action):
+            token = _current.set(profile)
+            try:
+                return action()
+            finally:
+                _current.reset(token)
+
+        try:
+            while True:
+                try:
+                    chunk = step(lambda: next(chunks))
+                except StopIteration:
+                    break
+                yield chunk
+        finally:
+            step(chunks.close)
+            statements = list(profile.statements)
+            label = f'{endpoint} (stream)'
+            self._check(label, statements)
+            self._add(label, time.perf_counter() - profile.started,
+                      sum(statement[1] for statement in statements), statements)
+
+    # ---- analysis ----
+
+    def _check(self, endpoint, statements):
+        counts = {}
+        for sql, elapsed, rows, site in statements:
+            if elapsed >= self.slow_query:
+                logger.warning("Slow query (%.0fms, %d rows) in %s at %s: %s",
+                               elapsed * 1000, rows, endpoint, site, sql)
+            counts[sql] = counts.get(sql, 0) + 1
+
+        for sql, count in counts.items():
+            if count >= self.repeat_threshold:
+                sites = sorted({site for s, _, _, site in statements if s == sql})
+                logger.warning("Statement repeated %d times in %s (possible N+1) at %s: %s",
+                               count, endpoint, ', '.join(sites), sql)
+
+    def _add(self, endpoint, total, db_time, statements):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: start from zero instead of the master's numbers
+                self._routes.clear()
+                self._statements.clear()
+                self._pid = os.getpid()
+
+            route = self._routes.setdefault(endpoint, [0, 0.0, 0.0, 0, 0.0])
+            route[0] += 1
+            route[1] += total
+            route[2] += db_time
+            route[3] += len(statements)
+            route[4] = max(route[4], total)
+
+            for sql, elapsed, rows, site in statements:
+                stats = self._statements.get(sql)
+                if stats is None:
+                    if len(self._statements) >= self.max_statements:
+                        continue
+                    stats = self._statements[sql] = [0, 0.0, 0.0, 0, site]
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+                stats[3] += rows
+
+            now = time.monotonic()
+            if now - self._flushed_at < self.flush_interval:
+                return
+            self._flushed_at = now
+            snapshot = {'routes': dict(self._routes), 'statements': dict(self._statements)}
+        self._write(snapshot)
+
+    # ---- cross-worker report ----
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'sqlprofile-{pid}.json')
+
+    def _write(self, snapshot, path=None):
+        path = path or self._path(os.getpid())
+        tmp = f'{path}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, path)
+        except OSError:
+            logger.exception("Could not write SQL profile to %s", path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _locked(self, mode):
+        """``sqlprofile.lock`` held in ``mode``; released when the returned file closes"""
+        lock = open(os.path.join(self.directory, 'sqlprofile.lock'), 'a')
+        fcntl.flock(lock, mode)
+        return lock
+
+    def _merge(self, routes, statements, snapshot, max_statements=None):
+        for endpoint, (count, total, db_time, queries, worst) in snapshot['routes'].items():
+            route = routes.setdefault(endpoint, [0, 0.0, 0.0, 0, 0.0])
+            route[0] += count
+            route[1] += total
+            route[2] += db_time
+            route[3] += queries
+            route[4] = max(route[4], worst)
+        for sql, (calls, total, worst, rows, site) in snapshot['statements'].items():
+            stats = statements.get(sql)
+            if stats is None:
+                if max_statements is not None and len(statements) >= max_statements:
+                    continue
+                stats = statements[sql] = [0, 0.0, 0.0, 0, site]
+            stats[0] += calls
+            stats[1] += total
+            stats[2] = max(stats[2], worst)
+            stats[3] += rows
+
+    def retire(self, pid):
+        """Fold a finished worker's snapshot into the retired totals and delete it"""
+        path = self._path(pid)
+        with self._locked(fcntl.LOCK_EX):
+            snapshot = self._read(path)
+            if snapshot is None:
+                return
+            retired = self._read(self._path('retired')) or {'routes': {}, 'statements': {}}
+            self._merge(retired['routes'], retired['statements'], snapshot, self.max_statements)
+            self._write(retired, self._path('retired'))
+            os.unlink(path)
+
+    def flush(self):
+        """Write this worker's snapshot now (nothing in a process that ran no requests)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                self._write({'routes': dict(self._routes), 'statements': dict(self._statements)})
+
+    def report(self, limit=20):
+        """Worst routes and statements, merged over every worker's last snapshot"""
+        self.flush()
+
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith('sqlprofile-') and name.endswith('.json')]
+        for name in names:
+            pid = name[len('sqlprofile-'):-len('.json')]
+            if pid.isdigit() and int(pid) != os.getpid() and not _alive(int(pid)):
+                try:
+                    self.retire(int(pid))
+                except OSError:
+                    logger.exception("Could not retire SQL profile of worker %s", pid)
+
+        routes, statements, workers = {}, {}, 0
+        with self._locked(fcntl.LOCK_SH):
+            for name in os.listdir(self.directory):
+                if not (name.startswith('sqlprofile-') and name.endswith('.json')):
+                    continue
+                snapshot = self._read(os.path.join(self.directory, name))
+                if snapshot is None:
+                    continue
+                if name != 'sqlprofile-retired.json':
+                    workers += 1
+                self._merge(routes, statements, snapshot)
+
+        return {
+            'workers': workers,
+            'routes': sorted((
+                {'endpoint': endpoint, 'requests': count,
+                 'avg_ms': total / count * 1000, 'max_ms': worst * 1000,
+                 'avg_db_ms': db_time / count * 1000, 'db_ms': db_time * 1000,
+                 'avg_queries': queries / count}
+                for endpoint, (count, total, db_time, queries, worst) in routes.items()
+            ), key=lambda route: route['db_ms'], reverse=True)[:limit],
+            'statements': sorted((
+                {'sql': sql, 'calls': calls, 'total_ms': total * 1000,
+                 'avg_ms': total / calls * 1000, 'max_ms': worst * 1000,
+                 'avg_rows': rows / calls, 'call_site': site}
+                for sql, (calls, total, worst, rows, site) in statements.items()
+            ), key=lambda statement: statement['total_ms'], reverse=True)[:limit],
+        }
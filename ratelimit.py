@@ -0,0 +1,150 @@
+"""Token-bucket rate limiting shared by all gunicorn workers.
+
+Buckets are fixed-size slots in a file mapped into every worker
+(``ratelimit.buckets`` in ``directory``), so all workers on the host read
+and update the same table; an ``flock`` on ``ratelimit.lock`` serialises
+updates between processes and a thread lock between threads. The kernel
+drops the ``flock`` if a worker dies holding it, so a killed worker can't
+wedge the others. A check is one hash, two lock syscalls and a few struct
+reads: a few microseconds.
+
+Each key hashes to a short run of ``PROBE`` slots. A new key takes an empty
+slot or the one updated longest ago; with the default 65536 slots that only
+forgets a bucket that is still draining when tens of thousands of keys are
+being limited at once. State survives worker restarts.
+
+Keys are mostly client input (emails, addresses), so the hash is keyed with
+a per-deployment ``secret``: without it, keys landing in a victim's run of
+slots could be computed offline and used to evict its bucket. A rejected
+hit writes nothing, so a throttled client can't claim slots either.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+# key hash (0 = empty), tokens left, last update (epoch seconds)
+_SLOT = struct.Struct('<Qdd')
+PROBE = 8
+
+
+class Limit(namedtuple('Limit', ['burst', 'per'])):
+    """``burst`` requests at once, then one more every ``per`` seconds"""
+
+    __slots__ = ()
+
+
+class RateLimiter:
+    """Token buckets keyed by strings, shared between processes through a mapped file"""
+
+    def __init__(self, directory=None, slots=65536, enabled=True, secret=''):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'balansai-cache')
+        self.slots = slots
+        self.enabled = enabled
+        # blake2b takes a key of at most 64 bytes; this one is also kept
+        # apart from other uses of the same secret
+        self._hash_key = hashlib.sha256(b'ratelimit:' + secret.encode('utf-8')).digest()
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._map = None
+        self._lock_fd = None
+
+    def _open(self):
+        # Per process: a forked worker must take the flock on its own file
+        # description, or the lock would be shared with its siblings
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        size = self.slots * _SLOT.size
+        fd = os.open(os.path.join(self.directory, 'ratelimit.buckets'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._lock_fd = os.open(os.path.join(self.directory, 'ratelimit.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        self._pid = pid
+
+    def _hash(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8, key=self._hash_key).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def _find(self, key_hash, claimed=()):
+        """Offset of ``key_hash``'s slot, claiming an empty or the stalest one if it has none.
+
+        Offsets in ``claimed`` are already promised to other keys of the same
+        ``hit()`` and are never chosen as the victim.
+        """
+        start = key_hash % self.slots
+        victim, victim_updated = None, math.inf
+        for i in range(PROBE):
+            offset = (start + i) % self.slots * _SLOT.size
+            stored, _, updated = _SLOT.unpack_from(self._map, offset)
+            if stored == key_hash:
+                return offset, True
+            # Empty slots have updated == 0, so they are taken first
+            if updated < victim_updated and offset not in claimed:
+                victim, victim_updated = offset, updated
+        return victim, False
+
+    def hit(self, rules, cost=1):
+        """Take ``cost`` tokens from every ``(key, Limit)`` bucket in ``rules``.
+
+        All or nothing: returns 0 and charges every bucket if each has enough
+        tokens, otherwise returns the seconds until the request would be
+        allowed and writes nothing (a bucket's refill is computed on read, so
+        an existing one loses nothing, and no new one is created).
+        """
+        if not self.enabled:
+            return 0
+        now = time.time()
+        with self._lock:
+            self._open()
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                buckets, wait = [], 0
+                for key, limit in rules:
+                    key_hash = self._hash(key)
+                    # Nothing is written until every bucket is checked, so two
+                    # new keys could otherwise pick the same stalest slot
+                    offset, found = self._find(key_hash, {bucket[0] for bucket in buckets})
+                    if offset is None:
+                        # Every slot of the run went to this call's other keys
+                        continue
+                    tokens = limit.burst
+                    if found:
+                        _, tokens, updated = _SLOT.unpack_from(self._map, offset)
+                        # max(): the wall clock may have stepped back
+                        tokens = min(limit.burst, tokens + max(now - updated, 0) / limit.per)
+                    if tokens < cost:
+                        wait = max(wait, (cost - tokens) * limit.per)
+                    buckets.append((offset, key_hash, tokens))
+
+                if wait:
+                    return wait
+                for offset, key_hash, tokens in buckets:
+                    _SLOT.pack_into(self._map, offset, key_hash, tokens - cost, now)
+                return 0
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def reset(self, key):
+        """Forget ``key``'s bucket (e.g. after a successful login)"""
+        with self._lock:
+            self._open()
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                offset, found = self._find(self._hash(key))
+                if found:
+                    _SLOT.pack_into(self._map, offset, 0, 0.0, 0.0)
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
@@ -0,0 +1,202 @@
+"""Dashboard statistics rollups.
+
+``stats_daily`` holds one row per day of flow counters (revenue, completed
+payments, signups, contact messages, net change in active users) and
+``stats_totals`` holds running gauges (total/active users, total revenue,
+unread contacts). Both are updated with relative increments in the same
+transaction as the write to the fact table: by the hooks below for the
+app's own writes to users and contacts, and by triggers on ``payments``
+(see ``init_db.sql``), which the billing side writes directly. The admin
+dashboard reads only these tables; ``rebuild`` recomputes them from the
+fact tables.
+
+Each gauge is spread over ``TOTALS_SLOTS`` rows and a write bumps a random
+one, so concurrent signups, payments and contacts rarely wait on the same
+row lock; reads sum the slots.
+"""
+import datetime
+import random
+from decimal import Decimal
+
+GRANULARITY_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%x-W%v',
+    'month': '%Y-%m',
+}
+
+DAILY_COLUMNS = ('revenue', 'payments', 'signups', 'contacts', 'active_users')
+TOTALS = ('total_users', 'active_users', 'total_revenue', 'unread_contacts')
+TOTALS_SLOTS = 16
+
+
+def _day(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value or datetime.date.today()
+
+
+def bump_daily(cursor, day, **deltas):
+    """Add ``deltas`` to the counters of one day, creating the row if needed"""
+    columns = [c for c in DAILY_COLUMNS if deltas.get(c)]
+    if not columns:
+        return
+    cursor.execute(
+        f"INSERT INTO stats_daily (day, {', '.join(columns)}) "
+        f"VALUES (%s, {', '.join(['%s'] * len(columns))}) "
+        f"ON DUPLICATE KEY UPDATE {', '.join(f'{c} = {c} + VALUES({c})' for c in columns)}",
+        [_day(day)] + [deltas[c] for c in columns]
+    )
+
+
+def bump_totals(cursor, **deltas):
+    """Add ``deltas`` to one random slot of each running total in a single statement"""
+    names = [n for n in TOTALS if deltas.get(n)]
+    if not names:
+        return
+    slot = random.randrange(TOTALS_SLOTS)
+    params = []
+    for name in names:
+        params.extend([name, slot, deltas[name]])
+    cursor.execute(
+        f"INSERT INTO stats_totals (name, slot, value) "
+        f"VALUES {', '.join(['(%s, %s, %s)'] * len(names))} "
+        f"ON DUPLICATE KEY UPDATE value = value + VALUES(value)",
+        params
+    )
+
+
+# ---- write hooks (call before commit) ----
+
+def record_signup(cursor, created_at=None, is_active=True):
+    bump_daily(cursor, created_at, signups=1, active_users=1 if is_active else 0)
+    bump_totals(cursor, total_users=1, active_users=1 if is_active else 0)
+
+
+def record_user_status(cursor, was_active, is_active):
+    if bool(was_active) != bool(is_active):
+        bump_daily(cursor, None, active_users=1 if is_active else -1)
+        bump_totals(cursor, active_users=1 if is_active else -1)
+
+
+def record_user_delete(cursor, user_id):
+    """Subtract a user, and the payments that cascade with it, before deleting.
+
+    Cascaded deletes don't fire the payments triggers, so those payments are
+    subtracted here.
+    """
+    cursor.execute("SELECT is_active, created_at FROM users WHERE id = %s", (user_id,))
+    user = cursor.fetchone()
+    if not user:
+        return
+
+    cursor.execute("""
+        SELECT DATE(created_at), SUM(amount), COUNT(*)
+        FROM payments
+        WHERE user_id = %s AND status = 'completed'
+        GROUP BY DATE(created_at)
+    """, (user_id,))
+    revenue = Decimal(0)
+    for day, amount, count in cursor.fetchall():
+        bump_daily(cursor, day, revenue=-amount, payments=-count)
+        revenue += amount
+
+    bump_daily(cursor, user[1], signups=-1)
+    if user[0]:
+        bump_daily(cursor, None, active_users=-1)
+    bump_totals(cursor, total_users=-1, active_users=-1 if user[0] else 0,
+                total_revenue=-revenue)
+
+
+def record_contacts(cursor, days):
+    """``days``: {date: number of contact messages written for that day}"""
+    for day, count in days.items():
+        bump_daily(cursor, day, contacts=count)
+    bump_totals(cursor, unread_contacts=sum(days.values()))
+
+
+def record_contacts_read(cursor, count):
+    bump_totals(cursor, unread_contacts=-count)
+
+
+def record_contact_delete(cursor, contact_id):
+    cursor.execute("SELECT is_read, created_at FROM contacts WHERE id = %s", (contact_id,))
+    contact = cursor.fetchone()
+    if not contact:
+        return
+    bump_daily(cursor, contact[1], contacts=-1)
+    if not contact[0]:
+        bump_totals(cursor, unread_contacts=-1)
+
+
+# ---- reads ----
+
+def totals(cursor):
+    """Current gauges as a dict; counts are ints, revenue stays Decimal"""
+    cursor.execute("SELECT name, SUM(value) FROM stats_totals GROUP BY name")
+    values = {name: Decimal(0) for name in TOTALS}
+    values.update(dict(cursor.fetchall()))
+    for name in ('total_users', 'active_users', 'unread_contacts'):
+        values[name] = int(values[name])
+    return values
+
+
+def series(cursor, column, start, end, granularity='month'):
+    """[(bucket, total)] for ``column`` over [start, end), grouped by granularity"""
+    if column not in DAILY_COLUMNS:
+        raise ValueError(f"Unknown rollup column: {column}")
+    cursor.execute(f"""
+        SELECT DATE_FORMAT(day, %s) AS bucket, SUM({column}) AS total
+        FROM stats_daily
+        WHERE day >= %s AND day < %s
+        GROUP BY bucket
+        ORDER BY bucket ASC
+    """, (GRANULARITY_FORMATS[granularity], start, end))
+    return cursor.fetchall()
+
+
+def running_series(cursor, column, start, end, granularity='month'):
+    """[(bucket, level at the end of the bucket)] for a column of net changes
+    (``active_users``): the per-bucket sums on top of everything before ``start``"""
+    if column not in DAILY_COLUMNS:
+        raise ValueError(f"Unknown rollup column: {column}")
+    cursor.execute(f"SELECT COALESCE(SUM({column}), 0) FROM stats_daily WHERE day < %s", (start,))
+    level = cursor.fetchone()[0]
+    running = []
+    for bucket, change in series(cursor, column, start, end, granularity):
+        level += change
+        running.append((bucket, level))
+    return running
+
+
+# ---- backfill ----
+
+def rebuild(cursor):
+    """Recompute every rollup from the fact tables (caller commits)"""
+    cursor.execute("DELETE FROM stats_daily")
+    cursor.execute("""
+        INSERT INTO stats_daily (day, revenue, payments)
+        SELECT DATE(created_at), SUM(amount), COUNT(*)
+        FROM payments WHERE status = 'completed'
+        GROUP BY DATE(created_at)
+    """)
+    # Past blocks and unblocks aren't recorded anywhere, so every user who is
+    # active now counts as active from the day they signed up
+    cursor.execute("""
+        INSERT INTO stats_daily (day, signups, active_users)
+        SELECT DATE(created_at) AS d, COUNT(*), SUM(is_active = 1) FROM users GROUP BY d
+        ON DUPLICATE KEY UPDATE signups = VALUES(signups), active_users = VALUES(active_users)
+    """)
+    cursor.execute("""
+        INSERT INTO stats_daily (day, contacts)
+        SELECT DATE(created_at) AS d, COUNT(*) FROM contacts GROUP BY d
+        ON DUPLICATE KEY UPDATE contacts = VALUES(contacts)
+    """)
+
+    cursor.execute("DELETE FROM stats_totals")
+    cursor.execute("""
+        INSERT INTO stats_totals (name, slot, value)
+        SELECT 'total_users', 0, COUNT(*) FROM users
+        UNION ALL SELECT 'active_users', 0, COUNT(*) FROM users WHERE is_active = 1
+        UNION ALL SELECT 'total_revenue', 0, COALESCE(SUM(amount), 0) FROM payments WHERE status = 'completed'
+        UNION ALL SELECT 'unread_contacts', 0, COUNT(*) FROM contacts WHERE is_read = 0
+    """)
@@ -0,0 +1,117 @@
+"""Row types for the app's queries.
+
+Each view selects only the columns it uses: ``RowType.columns`` is the
+SELECT list, and ``fetchone``/``fetchall`` return rows as that namedtuple,
+so templates, exports and pagination keys read ``post.title`` instead of
+``post[1]``. Namedtuples have ``__slots__ = ()`` and are exactly as large
+as the plain tuples the driver returns. Listing types leave out the TEXT
+bodies that only detail pages need.
+"""
+from collections import namedtuple
+
+
+_types = {}
+
+
+def row_type(name, columns):
+    """namedtuple ``name`` with one field per SELECT expression.
+
+    Fields are named after the column, so ``'u.full_name'`` becomes
+    ``full_name`` and ``'SUM(amount) AS total'`` becomes ``total``. The
+    type is built once per name and column list; asking again returns it.
+    """
+    key = (name, tuple(columns))
+    cls = _types.get(key)
+    if cls is None:
+        fields = [column.rsplit(' AS ', 1)[-1].rsplit('.', 1)[-1] for column in columns]
+        cls = namedtuple(name, fields)
+        cls.columns = ', '.join(columns)
+        _types[key] = cls
+    return cls
+
+
+def fetchone(cursor, row_type):
+    row = cursor.fetchone()
+    return row_type._make(row) if row else None
+
+
+def fetchall(cursor, row_type):
+    return [row_type._make(row) for row in cursor.fetchall()]
+
+
+# ---- users ----
+
+UserProfile = row_type('UserProfile', [
+    'id', 'full_name', 'email', 'phone', 'company', 'plan_type',
+    'is_active', 'last_login', 'created_at',
+])
+
+LoginUser = row_type('LoginUser', ['id', 'full_name', 'email', 'password', 'plan_type', 'is_active'])
+
+AdminUserRow = row_type('AdminUserRow', [
+    'id', 'full_name', 'email', 'phone', 'company', 'plan_type', 'is_active', 'created_at',
+])
+
+# Rows of user_search.search(), ranked by score
+UserSearchHit = row_type('UserSearchHit', [
+    'u.id', 'u.full_name', 'u.email', 'u.phone', 'u.company', 'u.plan_type', 'u.is_active', 'm.score',
+])
+
+# ---- blog ----
+
+# Cards on the home page, the blog listing and related posts
+BlogCard = row_type('BlogCard', [
+    'id', 'title', 'slug', 'excerpt', 'image_url', 'author', 'category',
+    'views', 'updated_at', 'published_at',
+])
+
+BlogPost = row_type('BlogPost', [
+    'id', 'title', 'slug', 'content', 'image_url', 'author', 'category',
+    'tags', 'views', 'updated_at',
+])
+
+# Search needs the body for the result snippet
+BlogSearchHit = row_type('BlogSearchHit', [
+    'id', 'title', 'slug', 'content', 'author', 'category', 'published_at',
+])
+
+AdminBlogRow = row_type('AdminBlogRow', [
+    'id', 'title', 'slug', 'author', 'category', 'is_published', 'views', 'created_at',
+])
+
+AdminBlogPost = row_type('AdminBlogPost', [
+    'id', 'title', 'excerpt', 'content', 'author', 'category', 'tags', 'is_published',
+])
+
+# ---- testimonials ----
+
+Testimonial = row_type('Testimonial', ['id', 'name', 'position', 'company', 'content', 'rating'])
+
+AdminTestimonial = row_type('AdminTestimonial', [
+    'id', 'name', 'position', 'company', 'content', 'rating', 'is_active', 'display_order',
+])
+
+# ---- user dashboard and chat ----
+
+ConversationRow = row_type('ConversationRow', ['id', 'title', 'updated_at'])
+
+PaymentRow = row_type('PaymentRow', [
+    'id', 'amount', 'plan_type', 'payment_method', 'status', 'created_at',
+])
+
+MessageRow = row_type('MessageRow', ['m.id', 'm.role', 'm.content', 'm.created_at'])
+
+# ---- admin ----
+
+AdminPaymentRow = row_type('AdminPaymentRow', [
+    'p.id', 'p.user_id', 'p.amount', 'p.plan_type', 'p.payment_method', 'p.status', 'p.created_at',
+])
+
+PaymentExportRow = row_type('PaymentExportRow', [
+    'p.id', 'u.full_name', 'u.email', 'p.amount', 'p.plan_type',
+    'p.payment_method', 'p.status', 'p.created_at',
+])
+
+ContactRow = row_type('ContactRow', ['id', 'name', 'email', 'message', 'is_read', 'created_at'])
+
+SettingRow = row_type('SettingRow', ['key_name', 'value', 'description'])
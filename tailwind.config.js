@@ -0,0 +1,20 @@
+/** Tailwind build config, used by `flask build-assets` */
+module.exports = {
+    content: [
+        './templates/**/*.html',
+        './static/js/**/*.js',
+    ],
+    theme: {
+        extend: {
+            colors: {
+                primary: '#2563EB',
+                'primary-dark': '#1e40af',
+                'balans-black': '#0F172A',
+            },
+            fontFamily: {
+                sans: ['Inter', 'sans-serif'],
+            },
+        }
+    },
+    plugins: [],
+}
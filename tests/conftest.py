@@ -0,0 +1,12 @@
+import os
+import sys
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import MySQLdb  # noqa: F401
+except ImportError:
+    # No mysqlclient build here: use PyMySQL in its place, as the gevent mode does
+    import pymysql
+    pymysql.install_as_MySQLdb()
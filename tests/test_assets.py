@@ -0,0 +1,75 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask, render_template_string, url_for
+
+import assets
+
+
+def make_app(static_folder, manifest=None):
+    if manifest is not None:
+        dist = static_folder / assets.DIST_DIR
+        dist.mkdir(parents=True, exist_ok=True)
+        (dist / assets.MANIFEST).write_text(manifest if isinstance(manifest, str) else json.dumps(manifest))
+    app = Flask(__name__, static_folder=str(static_folder), static_url_path='/static')
+    assets.init_app(app)
+    return app
+
+
+@pytest.fixture
+def static(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'main.css').write_text('body { color: red }')
+    return tmp_path
+
+
+def test_write_asset_fingerprints_and_precompresses(tmp_path):
+    path = assets.write_asset(str(tmp_path), 'css/main.css', b'body{color:red}')
+    assert path.startswith('dist/css/main.') and path.endswith('.css')
+    built = tmp_path / path[len('dist/'):]
+    assert built.read_bytes() == b'body{color:red}'
+    assert gzip.decompress((tmp_path / (path[len('dist/'):] + '.gz')).read_bytes()) == b'body{color:red}'
+    # Same content, same name; different content, different name
+    assert assets.write_asset(str(tmp_path), 'css/main.css', b'body{color:red}') == path
+    assert assets.write_asset(str(tmp_path), 'css/main.css', b'body{color:blue}') != path
+
+
+def test_url_for_resolves_to_the_fingerprinted_file(static):
+    app = make_app(static, {'css/main.css': 'dist/css/main.abc123.css'})
+    with app.test_request_context():
+        assert url_for('static', filename='css/main.css') == '/static/dist/css/main.abc123.css'
+        # Files the build doesn't know keep their source URL
+        assert url_for('static', filename='img/logo.png') == '/static/img/logo.png'
+        assert render_template_string('{{ assets_built }}') == 'True'
+
+
+@pytest.mark.parametrize('manifest', [None, '{not json'])
+def test_missing_or_unreadable_manifest_falls_back_to_source_urls(static, manifest):
+    app = make_app(static, manifest)
+    assert app.extensions['assets'] == {}
+    with app.test_request_context():
+        assert url_for('static', filename='css/main.css') == '/static/css/main.css'
+        assert render_template_string('{{ assets_built }}') == 'False'
+
+    response = app.test_client().get('/static/css/main.css')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] != assets.IMMUTABLE
+
+
+def test_built_files_are_immutable_and_precompressed(static):
+    dist = static / assets.DIST_DIR
+    path = assets.write_asset(str(dist), 'css/main.css', b'body{color:red}')
+    app = make_app(static, {'css/main.css': path})
+    client = app.test_client()
+
+    plain = client.get(f'/static/{path}')
+    assert plain.data == b'body{color:red}'
+    assert plain.headers['Cache-Control'] == assets.IMMUTABLE
+    assert 'Content-Encoding' not in plain.headers
+
+    zipped = client.get(f'/static/{path}', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert zipped.mimetype == 'text/css'
+    assert gzip.decompress(zipped.data) == b'body{color:red}'
+    assert 'Accept-Encoding' in zipped.headers['Vary']
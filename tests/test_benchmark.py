@@ -0,0 +1,86 @@
+import pytest
+
+import benchmark
+from benchmark import Recorder, _percentile, compare
+
+
+def route(p95, rps=100.0, errors=0):
+    return {'p95_ms': p95, 'rps': rps, 'errors': errors}
+
+
+def run(**routes):
+    return {'routes': routes}
+
+
+def verdicts(report):
+    return {row[0]: row[5] for row in report}
+
+
+@pytest.mark.parametrize('p, expected', [(50, 50), (95, 95), (99, 99), (100, 100), (1, 1), (0, 1)])
+def test_percentile_is_nearest_rank(p, expected):
+    latencies = [n / 1000 for n in range(1, 101)]
+    assert _percentile(latencies, p) == expected
+
+
+def test_percentile_of_few_samples():
+    assert _percentile([0.010, 0.020], 50) == 10
+    assert _percentile([0.010, 0.020], 95) == 20
+    assert _percentile([0.004], 99) == 4
+    assert _percentile([], 50) is None
+
+
+def test_slower_p95_past_the_threshold_is_a_regression():
+    report = compare(run(index=route(10.0), blog=route(10.0)),
+                     run(index=route(11.5), blog=route(10.9)), threshold=10)
+    assert verdicts(report) == {'blog': '', 'index': 'REGRESSION'}
+    index = dict((row[0], row) for row in report)['index']
+    assert index[3] == pytest.approx(15.0)
+
+
+def test_small_absolute_changes_are_ignored():
+    # +50% but only 0.5ms: noise on a fast route
+    report = compare(run(index=route(1.0)), run(index=route(1.5)), threshold=10, min_ms=1.0)
+    assert verdicts(report) == {'index': ''}
+
+
+def test_lost_throughput_and_new_errors_are_regressions():
+    report = compare(run(a=route(10.0, rps=100), b=route(10.0), c=route(10.0, errors=2)),
+                     run(a=route(10.0, rps=85), b=route(10.0, errors=1), c=route(10.0, errors=3)))
+    assert verdicts(report) == {'a': 'REGRESSION', 'b': 'REGRESSION', 'c': ''}
+
+
+def test_faster_routes_are_marked():
+    report = compare(run(index=route(20.0)), run(index=route(10.0)))
+    assert verdicts(report) == {'index': 'faster'}
+
+
+def test_routes_in_only_one_run_are_listed_without_a_verdict():
+    report = compare(run(index=route(10.0), old=route(5.0)), run(index=route(10.0), fresh=route(5.0)))
+    assert verdicts(report) == {'fresh': 'new', 'index': '', 'old': 'gone'}
+    rows = {row[0]: row for row in report}
+    assert rows['fresh'][1] is None and rows['old'][2] is None
+
+
+def test_recorder_skips_warmup_and_counts_errors_apart(monkeypatch):
+    clock = iter([0.5, 1.5, 2.0, 3.0])
+
+    class FakeTime:
+        monotonic = staticmethod(lambda: next(clock))
+    monkeypatch.setattr(benchmark, 'time', FakeTime)
+    recorder = Recorder(record_from=1.0)
+    recorder.record('index', 0.010, True)   # during warm-up
+    recorder.record('index', 0.020, True)
+    recorder.record('index', 0.030, False)
+    recorder.record('blog', 0.040, True)
+
+    summary = recorder.summary()
+    assert summary['routes']['index']['requests'] == 1
+    assert summary['routes']['index']['errors'] == 1
+    assert summary['total']['requests'] == 2
+
+
+def test_plan_prices_match_the_app_defaults():
+    from app import DEFAULT_SETTINGS
+
+    assert benchmark.plan_prices() == {
+        plan: int(DEFAULT_SETTINGS[f'{plan}_plan_price']) for plan in benchmark.PLANS}
@@ -0,0 +1,87 @@
+import time
+
+from blog_search import SNIPPET_WORDS, document_terms, normalize, search, snippet, tokenize
+
+
+class FakeCursor:
+    """Answers the two queries ``search`` makes from an in-memory index"""
+
+    def __init__(self, docs):
+        self.docs = docs  # post_id -> (frequencies, length)
+        self.result = None
+
+    def execute(self, sql, params=None):
+        if sql.startswith('SELECT COUNT(*)'):
+            lengths = [length for _, length in self.docs.values()]
+            self.result = [(len(lengths), sum(lengths) / len(lengths) if lengths else None)]
+        else:
+            self.result = [(term, post_id, frequencies[term], length)
+                           for post_id, (frequencies, length) in self.docs.items()
+                           for term in params if term in frequencies]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_apostrophe_variants_and_suffixes_normalize_alike():
+    assert normalize("O'zbek") == normalize('oʻzbek') == normalize('ozbek')
+    assert normalize('hisobotlarni') == 'hisobot'
+    assert normalize('bank') == 'bank'  # too short to lose 'ka'
+
+
+def test_tokenize_drops_stopwords_and_single_letters():
+    assert tokenize('Bu soliq va moliya hisobotlari uchun, a') == ['soliq', 'moliya', 'hisobot']
+
+
+def test_document_terms_weights_fields():
+    frequencies, length = document_terms('Soliq', 'soliq', '<p>Soliq &amp; moliya</p>', 'moliya,bank')
+    assert frequencies == {'soliq': 3 + 1 + 1, 'moliya': 2 + 1, 'bank': 2}
+    assert length == 10
+
+
+def test_search_ranks_by_bm25_and_pages():
+    docs = {
+        1: document_terms('Soliq hisoboti', '', 'soliq soliq moliya', ''),
+        2: document_terms('Moliya', '', 'bank', ''),
+        3: document_terms('Bank', '', 'soliq', ''),
+    }
+    cursor = FakeCursor(docs)
+    total, ranked = search(cursor, 'soliqlar', limit=1)
+    assert total == 2
+    assert [post_id for post_id, _ in ranked] == [1]
+    assert [post_id for post_id, _ in search(cursor, 'soliq', limit=1, offset=1)[1]] == [3]
+    assert search(cursor, 'va bu') == (0, [])
+
+
+def test_marks_hits_and_escapes_text():
+    result = str(snippet('Moliya <b>va</b> soliq', 'moliya'))
+    assert result == '<mark>Moliya</mark> &lt;b&gt;va&lt;/b&gt; soliq'
+
+
+def test_window_centres_on_densest_cluster():
+    filler = ['bank'] * 100
+    words = ['soliq'] + filler + ['soliq', 'soliq', 'soliq'] + filler
+    result = str(snippet(' '.join(words), 'soliq'))
+    assert result.startswith('… ') and result.endswith(' …')
+    assert result.count('<mark>') == 3
+
+
+def test_no_hits_shows_the_beginning():
+    words = [f'w{i}' for i in range(100)]
+    result = str(snippet(' '.join(words), 'moliya'))
+    assert result.startswith('w0 ')
+    assert len(result.split()) == SNIPPET_WORDS + 1  # plus the trailing …
+
+
+def test_empty_text():
+    assert str(snippet('', 'moliya')) == ''
+
+
+def test_many_hits_stay_linear():
+    text = ' '.join(['moliya'] * 50000)
+    started = time.perf_counter()
+    snippet(text, 'moliya')
+    assert time.perf_counter() - started < 2
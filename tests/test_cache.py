@@ -0,0 +1,156 @@
+import gzip
+import os
+import time
+
+import pytest
+from flask import Flask
+
+import cache as cache_module
+from cache import Cache, CachedPage
+
+app = Flask(__name__)
+BODY = '<html>' + 'salom ' * 200 + '</html>'
+
+
+def respond(page, headers=None):
+    with app.test_request_context(headers=headers or {}) as ctx:
+        return page.make_response(ctx.request, 'public, no-cache')
+
+
+def test_identity_without_accept_encoding():
+    page = CachedPage(BODY)
+    response = respond(page)
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True) == BODY
+    assert response.headers['ETag'] == f'"{page.etag}"'
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_gzip_when_accepted():
+    response = respond(CachedPage(BODY), {'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()).decode() == BODY
+    assert response.headers['ETag'].endswith('-gzip"')
+
+
+@pytest.mark.skipif(cache_module.brotli is None, reason='brotli not installed')
+def test_brotli_preferred():
+    response = respond(CachedPage(BODY), {'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+
+
+def test_not_modified_for_any_encodings_etag():
+    page = CachedPage(BODY)
+    etag = respond(page, {'Accept-Encoding': 'gzip'}).headers['ETag']
+    response = respond(page, {'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+
+def test_changed_etag_gets_full_body():
+    response = respond(CachedPage(BODY), {'If-None-Match': '"something-else"'})
+    assert response.status_code == 200
+
+
+def test_default_served_while_first_load_fails(tmp_path):
+    cache = Cache(str(tmp_path), error_ttl=30)
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise OSError('database down')
+
+    assert cache.get_or_load('settings', broken, default={'a': 1}) == {'a': 1}
+    # Not retried until error_ttl has passed
+    assert cache.get_or_load('settings', broken, default={'a': 1}) == {'a': 1}
+    assert len(attempts) == 1
+    with pytest.raises(OSError):
+        cache.get_or_load('other', broken)
+
+
+def test_cache_loads_once_and_invalidates_by_tag(tmp_path):
+    cache = Cache(str(tmp_path), check_interval=0)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_load('k', load, tags=('blog',)) == 1
+    assert cache.get_or_load('k', load, tags=('blog',)) == 1
+    cache.invalidate('blog')
+    assert cache.get_or_load('k', load, tags=('blog',)) == 2
+
+
+def test_cache_serves_stale_copy_when_reload_fails(tmp_path):
+    cache = Cache(str(tmp_path), check_interval=0)
+    cache.get_or_load('k', lambda: 'old', tags=('blog',))
+    cache.invalidate('blog')
+
+    def broken():
+        raise OSError('database down')
+
+    assert cache.get_or_load('k', broken, tags=('blog',)) == 'old'
+    assert cache.stale_served == 1
+
+
+def test_tag_generations_are_bounded(tmp_path):
+    cache = Cache(str(tmp_path), max_entries=10, check_interval=60)
+    for user_id in range(100):
+        cache.invalidate(f'user-{user_id}')
+        cache.get_or_load(f'profile:{user_id}', lambda: 'profile', tags=(f'user-{user_id}',))
+    assert len(cache._generations) == 10
+    assert 'user-99' in cache._generations and 'user-0' not in cache._generations
+
+
+def test_forgotten_tag_still_invalidates(tmp_path):
+    cache = Cache(str(tmp_path), max_entries=2, check_interval=60)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_load('k', load, tags=('user-1',)) == 1
+    cache.invalidate('user-1')
+    cache.invalidate('user-2', 'user-3')  # pushes user-1 out
+    assert 'user-1' not in cache._generations
+    assert cache.get_or_load('k', load, tags=('user-1',)) == 2
+
+
+def test_prune_removes_only_old_tag_files_with_the_prefix(tmp_path):
+    cache = Cache(str(tmp_path), check_interval=0)
+    cache.invalidate('user-1', 'user-2', 'users')
+    old = time.time_ns() - 7200 * 10**9
+    for tag in ('user-1', 'users'):
+        os.utime(tmp_path / f'{tag}.gen', ns=(old, old))
+
+    assert cache.prune('user-', max_age=3600) == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['user-2.gen', 'users.gen']
+
+
+def test_pruned_tag_reloads_instead_of_serving_stale(tmp_path):
+    cache = Cache(str(tmp_path), check_interval=0)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return len(calls)
+
+    cache.invalidate('user-1')
+    assert cache.get_or_load('k', load, tags=('user-1',)) == 1
+    cache.prune('user-', max_age=0)
+    assert not (tmp_path / 'user-1.gen').exists()
+    assert cache.get_or_load('k', load, tags=('user-1',)) == 2
+
+
+def test_get_never_loads_and_serves_stale_only_when_asked(tmp_path):
+    cache = Cache(str(tmp_path), check_interval=0)
+    assert cache.get('k', tags=('blog',)) is None
+    cache.get_or_load('k', lambda: 'v1', tags=('blog',))
+    assert cache.get('k', tags=('blog',)) == 'v1'
+
+    cache.invalidate('blog')
+    assert cache.get('k', tags=('blog',)) is None
+    assert cache.get('k', tags=('blog',), stale=True) == 'v1'
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from chat import ChatBackend, StubBackend, load_backend, sse
+
+
+def parse_events(body):
+    events = []
+    for block in body.split('\n\n'):
+        if block:
+            event, data = block.split('\n')
+            assert event.startswith('event: ') and data.startswith('data: ')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def test_sse_frames_one_event_with_a_json_payload():
+    frame = sse('token', {'text': 'Salom "dunyo"\nyangi qator'})
+    assert frame.endswith('\n\n')
+    assert frame.count('\n') == 3
+    assert parse_events(frame) == [('token', {'text': 'Salom "dunyo"\nyangi qator'})]
+
+
+def test_sse_keeps_non_ascii_text_readable():
+    assert 'o\'sish' in sse('token', {'text': 'o\'sish'})
+
+
+def test_stub_backend_is_deterministic_per_prompt():
+    backend = StubBackend(tokens=8, first_token_delay=0, token_delay=0)
+    history = [{'role': 'user', 'content': 'Foyda qanday?'}]
+    first = list(backend.stream(history))
+    assert first == list(backend.stream(history))
+    assert len(first) == 8
+    assert first[0][0].isupper() and first[-1].endswith('.')
+    assert first != list(backend.stream([{'role': 'user', 'content': 'Boshqa savol'}]))
+
+
+def test_stub_reply_streams_as_token_events():
+    backend = StubBackend(tokens=5, first_token_delay=0, token_delay=0)
+    chunks = list(backend.stream([{'role': 'user', 'content': 'salom'}]))
+    body = ''.join(sse('token', {'text': chunk}) for chunk in chunks)
+    events = parse_events(body)
+    assert [name for name, _ in events] == ['token'] * 5
+    assert ''.join(data['text'] for _, data in events) == ''.join(chunks)
+
+
+def test_partial_backend_fails_when_built():
+    class NoStream(ChatBackend):
+        name = 'partial'
+
+    with pytest.raises(TypeError):
+        NoStream.from_env()
+
+
+def test_load_backend_by_name_and_import_path(monkeypatch):
+    monkeypatch.setenv('CHAT_STUB_TOKENS', '3')
+    assert load_backend('stub').tokens == 3
+    assert isinstance(load_backend('chat:StubBackend'), StubBackend)
+    with pytest.raises(ValueError):
+        load_backend('unknown')
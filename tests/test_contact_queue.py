@@ -0,0 +1,223 @@
+import json
+import os
+import subprocess
+from contextlib import contextmanager
+
+import MySQLdb
+import pytest
+
+from contact_queue import ContactQueue, contact_row, fingerprint, one_line
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.log = db.log
+
+    def execute(self, sql, params=None):
+        self.log.append(('execute', sql, params))
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        if self.db.reject and any(row[0] == self.db.reject for row in rows):
+            raise MySQLdb.DataError(1406, "Data too long for column 'name'")
+        self.log.append(('executemany', sql, rows))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.log = db.log
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.log.append(('commit',))
+
+
+class FakeDB:
+    """Stands in for MySQLPool: ``db.pool.connection()``"""
+
+    def __init__(self, fail=False, reject=None):
+        self.fail = fail
+        self.reject = reject  # name of a row MySQL refuses
+        self.log = []
+        self.pool = self
+
+    @contextmanager
+    def connection(self):
+        if self.fail:
+            raise MySQLdb.OperationalError(2003, "Can't connect to MySQL server")
+        yield FakeConnection(self)
+
+    def inserted(self):
+        return [row[0] for item in self.log if item[0] == 'executemany' for row in item[2]]
+
+
+class Transport:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    def send(self, message):
+        if self.fail:
+            raise OSError('smtp down')
+        self.sent.append(message)
+
+
+def listing(queue, name):
+    return sorted(os.listdir(os.path.join(queue.directory, name)))
+
+
+def dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(**kwargs):
+        kwargs.setdefault('db', FakeDB())
+        queue = ContactQueue(directory=str(tmp_path / 'queue'), notify_to='team@example.com', **kwargs)
+        queues.append(queue)
+        return queue
+
+    yield make
+    # atexit flushes every queue; leave nothing for it to write
+    for queue in queues:
+        queue.db = FakeDB()
+        queue.transport = None
+
+
+def entry(name='Ali', email='ali@example.com', message='Salom'):
+    return {'name': name, 'email': email, 'message': message, 'created_at': '2026-01-02T03:04:05'}
+
+
+def put(queue, directory, filename, data):
+    with open(os.path.join(queue.directory, directory, filename), 'w') as f:
+        json.dump(data, f)
+
+
+def test_contact_row_rejects_malformed_entries():
+    assert contact_row(entry())[3].year == 2026
+    for bad in ({'name': 'Ali'}, dict(entry(), created_at='kecha'), dict(entry(), name=None), ['Ali'], 'Ali'):
+        with pytest.raises(ValueError):
+            contact_row(bad)
+
+
+def test_one_line_and_fingerprint():
+    assert one_line(' Ali\r\nBcc: x@y \t ') == 'Ali Bcc: x@y'
+    assert fingerprint('A@x.uz ', 'Salom   dunyo') == fingerprint('a@x.uz', 'salom dunyo')
+
+
+def test_submit_queues_once_within_duplicate_window(make_queue, monkeypatch):
+    queue = make_queue()
+    monkeypatch.setattr(queue, '_ensure_thread', lambda: None)
+    assert queue.submit('Ali', 'ali@example.com', 'Salom')
+    assert not queue.submit('Ali', 'ALI@example.com', ' salom ')
+    assert queue.pending()['contacts'] == 1
+    [name] = listing(queue, 'incoming')
+    with open(os.path.join(queue.directory, 'incoming', name)) as f:
+        assert json.load(f)['message'] == 'Salom'
+
+
+def test_claim_renames_up_to_limit_with_pid_prefix(make_queue):
+    queue = make_queue()
+    for i in range(3):
+        put(queue, 'incoming', f'{i}.json', entry())
+    claimed = queue._claim('incoming', 'writing', 2)
+    assert [os.path.basename(path) for path in claimed] == [f'{os.getpid()}.0.json', f'{os.getpid()}.1.json']
+    assert listing(queue, 'incoming') == ['2.json']
+
+
+def test_recover_returns_files_of_dead_workers_only(make_queue):
+    queue = make_queue()
+    put(queue, 'writing', f'{dead_pid()}.a.json', entry())
+    put(queue, 'sending', f'{dead_pid()}.b.json', entry())
+    put(queue, 'writing', f'{os.getpid()}.c.json', entry())
+    queue._recover()
+    assert listing(queue, 'incoming') == ['a.json']
+    assert listing(queue, 'outbox') == ['b.json']
+    assert listing(queue, 'writing') == [f'{os.getpid()}.c.json']
+
+
+def test_write_batch_inserts_rows_and_moves_to_outbox(make_queue):
+    written = []
+    queue = make_queue(transport=Transport(), on_written=written.append)
+    put(queue, 'incoming', '1.json', entry('Ali'))
+    put(queue, 'incoming', '2.json', entry('Vali'))
+    queue._write_batch()
+    [insert] = [item for item in queue.db.log if item[0] == 'executemany']
+    assert [row[0] for row in insert[2]] == ['Ali', 'Vali']
+    assert queue.db.log[-1] == ('commit',)
+    assert listing(queue, 'outbox') == ['1.json', '2.json']
+    assert written == [2]
+
+
+def test_database_outage_requeues_batch(make_queue):
+    queue = make_queue(db=FakeDB(fail=True))
+    put(queue, 'incoming', '1.json', entry())
+    assert not queue._write_batch()
+    assert listing(queue, 'incoming') == ['1.json']
+    assert listing(queue, 'writing') == []
+
+
+def test_malformed_submission_is_set_aside(make_queue):
+    queue = make_queue()
+    put(queue, 'incoming', '1.json', {'name': 'Ali'})
+    put(queue, 'incoming', '2.json', entry('Vali'))
+    with open(os.path.join(queue.directory, 'incoming', '3.json'), 'w') as f:
+        f.write('{not json')
+    queue._write_batch()
+    assert listing(queue, 'failed') == ['1.json', '3.json']
+    assert queue.db.inserted() == ['Vali']
+
+
+def test_rejected_row_does_not_block_the_rest(make_queue):
+    written = []
+    queue = make_queue(db=FakeDB(reject='Poison'), on_written=written.append)
+    put(queue, 'incoming', '1.json', entry('Ali'))
+    put(queue, 'incoming', '2.json', entry('Poison'))
+    put(queue, 'incoming', '3.json', entry('Vali'))
+    queue.flush()
+    assert queue.db.inserted() == ['Ali', 'Vali']
+    assert listing(queue, 'failed') == ['2.json']
+    assert listing(queue, 'incoming') == listing(queue, 'writing') == []
+    assert written == [2]
+
+
+def test_transport_failure_hands_the_rest_back(make_queue):
+    queue = make_queue(transport=Transport(fail=True))
+    for i in range(3):
+        put(queue, 'outbox', f'{i}.json', entry())
+    queue._send_outbox()
+    assert listing(queue, 'outbox') == ['0.json', '1.json', '2.json']
+    assert listing(queue, 'sending') == []
+
+
+def test_unbuildable_notification_is_set_aside(make_queue):
+    transport = Transport()
+    queue = make_queue(transport=transport)
+    put(queue, 'outbox', '0.json', {'name': None})
+    put(queue, 'outbox', '1.json', entry(name='Ali\r\nBcc: x@example.com'))
+    queue._send_outbox()
+    assert listing(queue, 'failed') == ['0.json']
+    assert listing(queue, 'outbox') == []
+    [message] = transport.sent
+    assert message['Subject'] == 'Yangi murojaat: Ali Bcc: x@example.com'
+    assert message['Bcc'] is None
+    assert queue.pending() == {'contacts': 0, 'notifications': 0, 'failed': 1}
+
+
+def test_flush_without_notifications_deletes_written_files(make_queue):
+    queue = make_queue()
+    put(queue, 'incoming', '1.json', entry())
+    queue.flush()
+    assert queue.pending() == {'contacts': 0, 'notifications': 0, 'failed': 0}
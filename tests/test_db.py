@@ -0,0 +1,139 @@
+import threading
+
+import MySQLdb
+import pytest
+
+import db
+from db import ConnectionPool, PoolClosed, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+        self.rollbacks = 0
+        self.pings = 0
+        self.ping_error = None
+
+    def ping(self):
+        self.pings += 1
+        if self.ping_error:
+            raise self.ping_error
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(ConnectionPool):
+    """ConnectionPool that opens FakeConnections instead of MySQL sockets"""
+
+    def __init__(self, **kwargs):
+        super().__init__({}, **kwargs)
+        self.opened = []
+
+    def _connect(self):
+        conn = FakeConnection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(db.time, 'monotonic', fake.monotonic)
+    return fake
+
+
+def test_reuses_the_most_recently_released_connection():
+    pool = FakePool(size=3)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    assert pool.acquire() is second
+    assert len(pool.opened) == 2
+    assert first.rollbacks == second.rollbacks == 1
+
+
+def test_times_out_when_every_connection_is_in_use():
+    pool = FakePool(size=1)
+    pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire(timeout=0.01)
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_waiter_gets_the_released_connection():
+    pool = FakePool(size=1)
+    conn = pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire(timeout=5)))
+    waiter.start()
+    pool.release(conn)
+    waiter.join()
+    assert got == [conn]
+    assert pool.stats()['open'] == 1
+
+
+def test_old_connection_is_replaced(clock):
+    pool = FakePool(size=1, recycle=60)
+    conn = pool.acquire()
+    pool.release(conn)
+    clock.now += 61
+    fresh = pool.acquire()
+    assert fresh is not conn and conn.closed
+    assert pool.stats()['recycled'] == 1
+
+
+def test_idle_connection_is_pinged_and_replaced_if_dead(clock):
+    pool = FakePool(size=1, ping_interval=30)
+    conn = pool.acquire()
+    pool.release(conn)
+    clock.now += 10
+    assert pool.acquire() is conn and conn.pings == 0
+    pool.release(conn)
+    clock.now += 31
+    conn.ping_error = MySQLdb.OperationalError(2006, 'MySQL server has gone away')
+    fresh = pool.acquire()
+    assert conn.pings == 1 and conn.closed and fresh is not conn
+    assert pool.stats()['ping_failures'] == 1
+
+
+def test_failed_connect_frees_the_slot():
+    pool = FakePool(size=1)
+    pool._connect = lambda: (_ for _ in ()).throw(MySQLdb.OperationalError(2003, "Can't connect"))
+    with pytest.raises(MySQLdb.OperationalError):
+        pool.acquire()
+    assert pool.stats()['open'] == 0
+
+
+def test_operational_error_discards_the_connection():
+    pool = FakePool(size=1)
+    with pytest.raises(MySQLdb.OperationalError):
+        with pool.connection() as conn:
+            raise MySQLdb.OperationalError(2013, 'Lost connection')
+    assert conn.closed and conn.rollbacks == 0
+    assert pool.stats()['open'] == 0
+
+
+def test_close_all_closes_idle_now_and_in_use_on_release():
+    pool = FakePool(size=2)
+    idle, busy = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    pool.close_all()
+    assert idle.closed and not busy.closed
+    with pytest.raises(PoolClosed):
+        pool.acquire()
+    pool.release(busy)
+    assert busy.closed
+    assert pool.stats()['open'] == 0
@@ -0,0 +1,104 @@
+import gzip
+
+import pytest
+
+import exports
+from exports import parse_date_range, stream_csv
+
+
+class FakeStreamingCursor:
+    """SSCursor stand-in that hands out rows one fetchmany() at a time"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.executed = None
+        self.closed = False
+
+    def execute(self, query, params):
+        self.executed = (query, params)
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.cursor_obj = FakeStreamingCursor(rows)
+        self.cursor_class = None
+
+    def cursor(self, cursor_class=None):
+        self.cursor_class = cursor_class
+        return self.cursor_obj
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.conn = FakeConnection(rows)
+        self.released = []
+
+    def acquire(self):
+        return self.conn
+
+    def release(self, conn, discard=False):
+        self.released.append((conn, discard))
+
+
+def test_writes_the_header_then_escaped_rows():
+    pool = FakePool([(1, 'Ali, Vali', 'say "hi"'), (2, 'line\nbreak', None)])
+    body = b''.join(stream_csv(pool, 'SELECT', (), ['ID', 'Name', 'Note'], list))
+
+    assert body.decode('utf-8').splitlines(keepends=True) == [
+        'ID,Name,Note\r\n',
+        '1,"Ali, Vali","say ""hi"""\r\n',
+        '2,"line\n',
+        'break",\r\n',
+    ]
+    assert pool.conn.cursor_class is exports.SSCursor
+    assert pool.released == [(pool.conn, False)]
+
+
+def test_yields_one_chunk_per_batch():
+    pool = FakePool([(n,) for n in range(5)])
+    chunks = list(stream_csv(pool, 'SELECT', (), ['n'], list, batch_size=2))
+    assert chunks == [b'n\r\n', b'0\r\n1\r\n', b'2\r\n3\r\n', b'4\r\n']
+
+
+def test_gzip_output_decompresses_to_the_csv():
+    pool = FakePool([(1, 'a'), (2, 'b')])
+    body = b''.join(stream_csv(pool, 'SELECT', (), ['id', 'name'], list, compress=True))
+    assert gzip.decompress(body) == b'id,name\r\n1,a\r\n2,b\r\n'
+
+
+def test_early_close_discards_the_connection_without_draining():
+    pool = FakePool([(n,) for n in range(10)])
+    stream = stream_csv(pool, 'SELECT', (), ['n'], list, batch_size=2)
+    next(stream)  # header
+    next(stream)  # first batch
+    stream.close()
+
+    # The unread rows are left to die with the connection
+    assert pool.conn.cursor_obj.rows == [(n,) for n in range(2, 10)]
+    assert pool.released == [(pool.conn, True)]
+
+
+def test_query_error_discards_the_connection():
+    pool = FakePool([])
+
+    def fail(query, params):
+        raise RuntimeError('bad query')
+    pool.conn.cursor_obj.execute = fail
+    stream = stream_csv(pool, 'SELECT', (), ['n'], list)
+    next(stream)
+    with pytest.raises(RuntimeError):
+        next(stream)
+    assert pool.released == [(pool.conn, True)]
+
+
+def test_date_range_is_half_open():
+    start, end = parse_date_range('2024-01-01', '2024-01-31')
+    assert (start.day, end.month, end.day) == (1, 2, 1)
+    assert parse_date_range('', None) == (None, None)
@@ -0,0 +1,104 @@
+import contextvars
+import threading
+import time
+
+import pytest
+from flask import Flask, g
+
+from fanout import FanOut, FanOutTimeout
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+class FakeCursor:
+    def execute(self, sql, params):
+        self.rows = [(sql, params)]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def cursor(self):
+        return FakeCursor()
+
+
+class FakeDB:
+    """Stands in for MySQLPool: one connection per app context"""
+
+    def __init__(self):
+        self.released = 0
+        self.opened = 0
+
+    @property
+    def connection(self):
+        if 'conn' not in g:
+            self.opened += 1
+            g.conn = FakeConnection()
+        return g.conn
+
+    def release_connection(self):
+        self.released += 1
+
+
+@pytest.fixture
+def fanout():
+    return FanOut(Flask(__name__), FakeDB(), max_workers=4, timeout=2)
+
+
+def test_tasks_run_concurrently(fanout):
+    # Each task waits for the other two, so run one at a time they would time out
+    barrier = threading.Barrier(3, timeout=2)
+
+    def task():
+        barrier.wait()
+        return threading.current_thread().name
+
+    batch = fanout.run({'a': task, 'b': task, 'c': task})
+    assert len(set(batch.results.values())) == 3
+    assert set(batch.timings['a']) == {'queued', 'duration'}
+
+
+def test_sql_tasks_fetch_rows_on_their_own_connection(fanout):
+    batch = fanout.run({'posts': ('SELECT 1', ()), 'users': ('SELECT 2', (7,)), 'plain': lambda: 3})
+    assert batch.results == {'posts': [('SELECT 1', ())], 'users': [('SELECT 2', (7,))], 'plain': 3}
+    assert fanout.db.opened == 2
+
+
+def test_caller_connection_released_first(fanout):
+    fanout.run({'a': lambda: fanout.db.released})
+    assert fanout.db.released == 1
+
+
+def test_task_error_is_raised(fanout):
+    def broken():
+        raise ValueError('bad query')
+
+    with pytest.raises(ValueError):
+        fanout.run({'ok': lambda: 1, 'broken': broken})
+
+
+def test_timeout_names_the_late_tasks(fanout):
+    with pytest.raises(FanOutTimeout, match='slow') as error:
+        fanout.run({'fast': lambda: 1, 'slow': lambda: time.sleep(0.5)}, timeout=0.05)
+    assert error.value.results == {'fast': 1}
+    assert error.value.late == ['slow']
+
+
+def test_timeout_counts_a_failed_task_as_late(fanout):
+    def broken():
+        raise ValueError('bad query')
+
+    with pytest.raises(FanOutTimeout, match='broken failed') as error:
+        fanout.run({'fast': lambda: 1, 'broken': broken, 'slow': lambda: time.sleep(0.5)},
+                   timeout=0.05)
+    assert error.value.results == {'fast': 1}
+    assert error.value.late == ['broken', 'slow']
+
+
+def test_tasks_see_the_callers_context(fanout):
+    request_id.set('r-1')
+    assert fanout.run({'a': request_id.get}).results == {'a': 'r-1'}
@@ -0,0 +1,129 @@
+import json
+import os
+import subprocess
+import time
+
+import pytest
+from flask import Flask
+
+from metrics import Metrics
+
+
+def dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+def write_snapshot(metrics, pid, values):
+    with open(os.path.join(metrics.directory, f'metrics-{pid}.json'), 'w') as f:
+        json.dump(values, f)
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    metrics = Metrics(directory=str(tmp_path))
+    metrics.counter('jobs_total', 'Jobs')
+    metrics.gauge('queue_depth', 'Queue depth')
+    metrics.histogram('job_seconds', 'Job time', (0.1, 1.0))
+    return metrics
+
+
+@pytest.fixture
+def app(metrics):
+    app = Flask(__name__)
+    metrics.init_app(app)
+
+    @app.route('/ping', methods=['GET', 'POST'])
+    def ping():
+        return 'pong'
+
+    return app
+
+
+def requests_total(metrics):
+    return metrics._snapshot()['http_requests_total']
+
+
+def test_request_methods_map_to_a_fixed_set(app, metrics):
+    client = app.test_client()
+    client.get('/ping')
+    client.open('/ping', method='PROPFIND')
+    for i in range(20):
+        client.open(f'/scan-{i}', method=f'X{i}')
+    assert requests_total(metrics) == {
+        'endpoint="ping",method="GET",status="200"': 1,
+        'endpoint="<unmatched>",method="other",status="405"': 1,
+        'endpoint="<unmatched>",method="other",status="404"': 20,
+    }
+
+
+def test_histogram_buckets_and_sum(metrics):
+    for value in (0.05, 0.5, 3.0):
+        metrics.observe('job_seconds', {}, value)
+    assert metrics._snapshot()['job_seconds'] == {'': [1, 1, 1, 3.55]}
+
+
+def test_render_merges_workers(metrics):
+    metrics.inc('jobs_total', {'kind': 'a'}, 2)
+    metrics.inc('queue_depth', {}, 3)
+    metrics.observe('job_seconds', {}, 0.5)
+    # Another live worker (this test's parent process)
+    write_snapshot(metrics, os.getppid(), {
+        'jobs_total': {'kind="a"': 5, 'kind="b"': 1},
+        'queue_depth': {'': 4},
+        'job_seconds': {'': [1, 0, 0, 0.05]},
+    })
+    lines = metrics.render().splitlines()
+    assert '# TYPE jobs_total counter' in lines
+    assert 'jobs_total{kind="a"} 7' in lines
+    assert 'jobs_total{kind="b"} 1' in lines
+    assert 'queue_depth 7' in lines
+    assert 'job_seconds_bucket{le="0.1"} 1' in lines
+    assert 'job_seconds_bucket{le="1.0"} 2' in lines
+    assert 'job_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'job_seconds_sum 0.55' in lines
+    assert 'job_seconds_count 2' in lines
+
+
+def test_dead_workers_are_retired_once(metrics):
+    pid = dead_pid()
+    write_snapshot(metrics, pid, {'jobs_total': {'': 4}, 'queue_depth': {'': 9}})
+    merged = metrics.collect()
+    assert merged['jobs_total'] == {'': 4}
+    # Gauges of a gone worker are dropped; counters keep counting
+    assert 'queue_depth' not in merged
+    assert not os.path.exists(os.path.join(metrics.directory, f'metrics-{pid}.json'))
+    assert metrics.collect()['jobs_total'] == {'': 4}
+
+    write_snapshot(metrics, dead_pid(), {'jobs_total': {'': 1}})
+    assert metrics.collect()['jobs_total'] == {'': 5}
+
+
+def test_retire_of_unknown_worker_is_a_no_op(metrics):
+    metrics.retire(dead_pid())
+    assert metrics._read(metrics._path('retired')) is None
+
+
+def test_idle_worker_writes_its_last_requests(tmp_path):
+    metrics = Metrics(directory=str(tmp_path), flush_interval=0.02)
+    app = Flask(__name__)
+    metrics.init_app(app)
+    app.add_url_rule('/ping', 'ping', lambda: 'pong')
+
+    app.test_client().get('/ping')
+    path = tmp_path / f'metrics-{os.getpid()}.json'
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline:
+        values = json.loads(path.read_text()) if path.exists() else {}
+        if values.get('http_requests_total'):
+            break
+        time.sleep(0.01)
+    assert values['http_requests_total'] == {'endpoint="ping",method="GET",status="200"': 1}
+
+
+def test_flush_writes_the_snapshot_immediately(metrics):
+    metrics.inc('jobs_total', {})
+    metrics.flush()
+    with open(os.path.join(metrics.directory, f'metrics-{os.getpid()}.json')) as f:
+        assert json.load(f)['jobs_total'] == {'': 1}
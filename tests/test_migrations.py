@@ -0,0 +1,131 @@
+import os
+import re
+
+import pytest
+
+import migrations
+
+with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'init_db.sql')) as f:
+    SCHEMA = f.read()
+
+# Tables and secondary indexes created by the original init_db.sql
+BASELINE = {
+    'users': {'idx_email', 'idx_plan', 'idx_active'},
+    'payments': {'idx_user', 'idx_status', 'idx_date'},
+    'contacts': {'idx_read', 'idx_date'},
+    'settings': {'idx_key'},
+    'blog_posts': {'idx_slug', 'idx_published', 'idx_category', 'idx_date'},
+    'testimonials': {'idx_active', 'idx_order'},
+    'conversations': {'idx_user', 'idx_date'},
+    'messages': {'idx_conversation', 'idx_date'},
+    'password_resets': {'idx_token', 'idx_user'},
+}
+
+
+def indexes(statement):
+    return set(re.findall(r'INDEX (\w+)', statement))
+
+
+class SchemaCursor:
+    """Answers migrate's information_schema queries from an in-memory schema"""
+
+    def __init__(self, tables):
+        self.tables = {table: set(names) for table, names in tables.items()}
+        self.triggers = set()
+        self.ddl = []
+        self.result = []
+
+    def execute(self, sql, params=()):
+        if 'information_schema.tables' in sql:
+            self.result = [(1,)] if params[0] in self.tables else []
+        elif 'information_schema.statistics' in sql:
+            table, index = params
+            self.result = [(1,)] if index in self.tables.get(table, ()) else []
+        elif 'information_schema.triggers' in sql:
+            self.result = [(1,)] if params[0] in self.triggers else []
+        else:
+            self.ddl.append(sql)
+            if match := re.match(r'CREATE TABLE IF NOT EXISTS (\w+)', sql):
+                self.tables[match.group(1)] = indexes(sql)
+            elif match := re.match(r'CREATE TRIGGER (\w+) AFTER \w+ ON (\w+)', sql):
+                assert match.group(2) in self.tables
+                self.triggers.add(match.group(1))
+            elif match := re.match(r'ALTER TABLE (\w+) ADD INDEX (\w+)', sql):
+                self.tables[match.group(1)].add(match.group(2))
+            elif match := re.match(r'ALTER TABLE (\w+) DROP INDEX (\w+)', sql):
+                self.tables[match.group(1)].remove(match.group(2))
+            else:
+                raise AssertionError(f'Unexpected statement: {sql}')
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+
+@pytest.fixture
+def baseline():
+    return SchemaCursor(BASELINE)
+
+
+def migrate(cursor):
+    return migrations.migrate(cursor, SCHEMA, log=lambda message: None)
+
+
+def test_create_statements_cover_every_table():
+    statements = migrations.create_statements(SCHEMA)
+    assert set(BASELINE) <= set(statements)
+    assert len(statements) == SCHEMA.count('CREATE TABLE IF NOT EXISTS')
+    assert not any(statement.endswith(';') for statement in statements.values())
+
+
+def test_creates_missing_tables_and_is_idempotent(baseline):
+    migrate(baseline)
+    assert set(baseline.tables) == set(migrations.create_statements(SCHEMA))
+    baseline.ddl.clear()
+    assert migrate(baseline) == set()
+    assert baseline.ddl == []
+
+
+def test_leaves_an_up_to_date_database_alone():
+    current = SchemaCursor({table: indexes(statement)
+                            for table, statement in migrations.create_statements(SCHEMA).items()})
+    current.triggers = set(migrations.trigger_statements(SCHEMA))
+    assert migrate(current) == set()
+    assert current.ddl == []
+
+
+def test_adds_listing_indexes(baseline):
+    migrate(baseline)
+    assert 'idx_created' in baseline.tables['users']
+    assert 'idx_read_date' in baseline.tables['contacts']
+    assert 'idx_published_date' in baseline.tables['blog_posts']
+
+
+def test_new_user_search_index_is_rebuilt(baseline):
+    assert 'user-search' in migrate(baseline)
+
+
+def test_new_blog_search_index_is_rebuilt(baseline):
+    assert 'blog-search' in migrate(baseline)
+
+
+def test_chat_index_replaces_the_conversation_index(baseline):
+    migrate(baseline)
+    alters = [sql for sql in baseline.ddl if sql.startswith('ALTER TABLE messages')]
+    # The FK needs an index on conversation_id at every point
+    assert alters == ['ALTER TABLE messages ADD INDEX idx_conversation_date (conversation_id, created_at, id)',
+                      'ALTER TABLE messages DROP INDEX idx_conversation']
+
+
+def test_original_database_reaches_the_current_schema(baseline):
+    migrate(baseline)
+    assert baseline.tables == {table: indexes(statement)
+                               for table, statement in migrations.create_statements(SCHEMA).items()}
+
+
+def test_creates_payment_rollup_triggers_and_rebuilds_stats(baseline):
+    assert 'stats' in migrate(baseline)
+    assert baseline.triggers == {f'payments_{event}_{target}' for event in ('insert', 'update', 'delete')
+                                 for target in ('daily', 'totals')}
+    statement = migrations.trigger_statements(SCHEMA)['payments_update_daily']
+    assert statement.startswith('CREATE TRIGGER payments_update_daily AFTER UPDATE ON payments')
+    assert not statement.endswith(';') and ';' not in statement
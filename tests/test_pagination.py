@@ -0,0 +1,86 @@
+import base64
+import datetime
+import json
+from decimal import Decimal
+
+import pytest
+
+from pagination import Keyset, decode_cursor, encode_cursor, paginate
+
+KEYSET = Keyset([('created_at', 'DESC'), ('id', 'DESC')])
+
+
+def token(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+class FakeCursor:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_round_trip():
+    values = [datetime.datetime(2026, 1, 2, 3, 4, 5), Decimal('12.50'), 7, 'x', None]
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize('bad', [
+    'not base64 !!',
+    token({'a': 1}),
+    token([]),
+    token([1]),                                 # too short for the keyset
+    token([1, 2, 3]),                           # too long
+    token([{'dec': 'x'}, 1]),                   # decimal.InvalidOperation
+    token([{'dec': 'NaN'}, 1]),
+    token([{'dt': 5}, 1]),                      # TypeError in fromisoformat
+    token([{'dt': 'yesterday'}, 1]),
+    token([{'dt': '2026-01-01', 'x': 1}, 1]),
+    token([{'other': '1'}, 1]),
+    token([[1], 2]),
+    base64.urlsafe_b64encode(b'[NaN, 1]').decode(),
+])
+def test_malformed_cursor_raises_value_error(bad):
+    with pytest.raises(ValueError):
+        KEYSET.seek(decode_cursor(bad, len(KEYSET.columns)))
+
+
+def test_seek_expands_mixed_directions():
+    keyset = Keyset([('is_read', 'ASC'), ('id', 'DESC')])
+    condition, params = keyset.seek([0, 10])
+    assert condition == '((is_read > %s) OR (is_read = %s AND id < %s))'
+    assert params == [0, 0, 10]
+
+
+def test_seek_reverse_flips_comparisons():
+    condition, _ = KEYSET.seek([datetime.datetime(2026, 1, 1), 5], reverse=True)
+    assert condition == '((created_at > %s) OR (created_at = %s AND id > %s))'
+
+
+def test_paginate_falls_back_to_first_page_on_bad_cursor():
+    cursor = FakeCursor()
+    page = paginate(cursor, 'SELECT id FROM t WHERE 1=1', [], KEYSET, key=lambda row: row,
+                    per_page=10, after=token([{'dec': 'x'}, 1]))
+    sql, params = cursor.executed[0]
+    assert 'OFFSET' in sql
+    assert params == [11, 0]
+    assert page.page == 1
+
+
+def test_paginate_uses_cursor_and_reports_next_page():
+    rows = [(datetime.datetime(2026, 1, 1, 0, 0, i), i) for i in range(3, 0, -1)]
+    cursor = FakeCursor(rows)
+    after = encode_cursor([datetime.datetime(2026, 1, 2), 9])
+    page = paginate(cursor, 'SELECT created_at, id FROM t WHERE 1=1', [], KEYSET,
+                    key=lambda row: row, per_page=2, after=after)
+    sql, params = cursor.executed[0]
+    assert 'created_at < %s' in sql and 'OFFSET' not in sql
+    assert page.rows == rows[:2]
+    assert decode_cursor(page.next_cursor) == list(rows[1])
+    assert page.prev_cursor is not None
@@ -0,0 +1,58 @@
+import os
+from concurrent.futures import Future
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from passwords import DEFAULT_METHOD, HasherBusy, PasswordHasher, needs_rehash
+
+
+def test_same_method_needs_no_rehash():
+    assert not needs_rehash(generate_password_hash('parol', method=DEFAULT_METHOD), DEFAULT_METHOD)
+
+
+def test_lower_scrypt_cost_needs_rehash():
+    assert needs_rehash('scrypt:32768:8:1$salt$hash', 'scrypt:65536:8:1')
+    assert needs_rehash('scrypt:65536:4:1$salt$hash', 'scrypt:65536:8:1')
+
+
+def test_higher_cost_is_kept():
+    # Lowering the configured cost must not downgrade stronger hashes
+    assert not needs_rehash('scrypt:131072:8:1$salt$hash', 'scrypt:65536:8:1')
+    assert not needs_rehash('pbkdf2:sha256:900000$salt$hash', 'pbkdf2:sha256:600000')
+
+
+def test_other_algorithm_needs_rehash():
+    assert needs_rehash(generate_password_hash('parol', method='pbkdf2:sha256:1000'), DEFAULT_METHOD)
+    assert needs_rehash('scrypt:32768:8:1$salt$hash', 'pbkdf2:sha256:600000')
+    assert needs_rehash('pbkdf2:sha1:600000$salt$hash', 'pbkdf2:sha256:600000')
+
+
+def test_pbkdf2_iterations_compared():
+    assert needs_rehash('pbkdf2:sha256:260000$salt$hash', 'pbkdf2:sha256:600000')
+    assert not needs_rehash('pbkdf2:sha256:600000$salt$hash', 'pbkdf2:sha256')
+
+
+def test_timed_out_hash_keeps_its_slot_until_it_ends():
+    class StuckExecutor:
+        def __init__(self):
+            self.futures = []
+
+        def submit(self, fn, *args):
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self.futures.append(future)
+            return future
+
+    hasher = PasswordHasher(processes=1, queue_size=0, wait=0.01, timeout=0.01)
+    hasher._executor, hasher._pid = StuckExecutor(), os.getpid()
+
+    with pytest.raises(HasherBusy, match='timed out'):
+        hasher.hash('secret')
+    # The hash is still running in the pool, so the only slot stays taken
+    with pytest.raises(HasherBusy, match='queue full'):
+        hasher.hash('secret')
+
+    hasher._executor.futures[0].set_result('hash')
+    with pytest.raises(HasherBusy, match='timed out'):
+        hasher.hash('secret')
@@ -0,0 +1,91 @@
+from profiler import QueryProfiler, normalize, profiled_cursor_class
+
+
+def test_literals_become_placeholders():
+    assert normalize("SELECT * FROM users WHERE email = 'a@b.uz' AND id > 42") == \
+        "SELECT * FROM users WHERE email = ? AND id > ?"
+    assert normalize('SELECT "it\\"s" , 3.5') == 'SELECT ? , ?'
+
+
+def test_whitespace_is_collapsed():
+    assert normalize("SELECT id\n   FROM users\n\tWHERE id = %s ") == 'SELECT id FROM users WHERE id = %s'
+
+
+def test_in_lists_of_any_length_are_the_same_statement():
+    one = normalize('SELECT id FROM blog_posts WHERE id IN (%s)')
+    three = normalize('SELECT id FROM blog_posts WHERE id IN (%s, %s,%s)')
+    assert one == three == 'SELECT id FROM blog_posts WHERE id IN (...)'
+
+
+def test_multi_row_values_are_collapsed():
+    sql = 'INSERT INTO contacts (name, email) VALUES (%s, %s), (%s, %s), (%s, %s)'
+    assert normalize(sql) == 'INSERT INTO contacts (name, email) VALUES (...), ...'
+    assert normalize('INSERT INTO t (a) VALUES (%s)') == 'INSERT INTO t (a) VALUES (...)'
+
+
+def test_identifiers_with_digits_are_kept():
+    assert normalize('SELECT col1 FROM t2 LIMIT 10') == 'SELECT col1 FROM t2 LIMIT ?'
+
+
+class FakeSSCursor:
+    """Unbuffered cursor: rows are handed out by fetchmany()"""
+
+    rowcount = -1
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def execute(self, query, args=None):
+        return None
+
+    def fetchmany(self, size=None):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.rows = []
+
+
+def test_streamed_statements_are_profiled_under_their_own_label(tmp_path):
+    profiler = QueryProfiler(directory=str(tmp_path))
+    cursor_class = profiled_cursor_class(FakeSSCursor, streaming=True)
+
+    def export():
+        cursor = cursor_class([(n,) for n in range(5)])
+        cursor.execute('SELECT id FROM users WHERE id > 10')
+        while True:
+            rows = cursor.fetchmany(2)
+            if not rows:
+                break
+            yield len(rows)
+        cursor.close()
+
+    assert list(profiler.profile_stream(export(), 'admin_users_export')) == [2, 2, 1]
+
+    report = profiler.report()
+    assert [route['endpoint'] for route in report['routes']] == ['admin_users_export (stream)']
+    statement, = report['statements']
+    assert statement['sql'] == 'SELECT id FROM users WHERE id > ?'
+    assert statement['avg_rows'] == 5
+    assert statement['call_site'].startswith('test_profiler.py:')
+
+
+def test_stream_closed_early_still_records_its_statement(tmp_path):
+    profiler = QueryProfiler(directory=str(tmp_path))
+    cursor_class = profiled_cursor_class(FakeSSCursor, streaming=True)
+
+    def export():
+        cursor = cursor_class([(n,) for n in range(5)])
+        cursor.execute('SELECT id FROM users')
+        try:
+            while True:
+                yield cursor.fetchmany(2)
+        finally:
+            cursor.close()
+
+    stream = profiler.profile_stream(export(), 'admin_users_export')
+    next(stream)
+    stream.close()
+
+    statement, = profiler.report()['statements']
+    assert statement['calls'] == 1 and statement['avg_rows'] == 2
@@ -0,0 +1,129 @@
+import pytest
+
+import ratelimit
+from ratelimit import Limit, RateLimiter
+
+
+class FakeTime:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(ratelimit, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    return RateLimiter(str(tmp_path), slots=1024, secret='test')
+
+
+def used_slots(limiter):
+    return sum(limiter._map[i:i + 8] != bytes(8) for i in range(0, len(limiter._map), ratelimit._SLOT.size))
+
+
+def test_burst_then_wait(limiter, clock):
+    rule = [('ip:1', Limit(burst=3, per=10))]
+    assert [limiter.hit(rule) for _ in range(3)] == [0, 0, 0]
+    assert limiter.hit(rule) == pytest.approx(10)
+
+
+def test_refills_one_token_per_period(limiter, clock):
+    rule = [('ip:1', Limit(burst=2, per=10))]
+    limiter.hit(rule)
+    limiter.hit(rule)
+    clock.now += 5
+    assert limiter.hit(rule) == pytest.approx(5)
+    clock.now += 5
+    assert limiter.hit(rule) == 0
+    assert limiter.hit(rule) == pytest.approx(10)
+
+
+def test_refill_is_capped_at_burst(limiter, clock):
+    rule = [('ip:1', Limit(burst=2, per=1))]
+    limiter.hit(rule)
+    clock.now += 3600
+    assert [limiter.hit(rule) for _ in range(3)] == [0, 0, pytest.approx(1)]
+
+
+def test_all_or_nothing(limiter, clock):
+    ip = ('ip:1', Limit(burst=5, per=10))
+    account = ('account:a', Limit(burst=1, per=60))
+    assert limiter.hit([ip, account]) == 0
+    # The account bucket is empty, so the IP bucket must not be charged either
+    assert limiter.hit([ip, account]) == pytest.approx(60)
+    assert limiter.hit([ip, account]) == pytest.approx(60)
+    assert [limiter.hit([ip]) for _ in range(4)] == [0, 0, 0, 0]
+    assert limiter.hit([ip]) > 0
+
+
+def test_reset_forgets_bucket(limiter, clock):
+    rule = [('account:a', Limit(burst=1, per=60))]
+    limiter.hit(rule)
+    limiter.reset('account:a')
+    assert limiter.hit(rule) == 0
+
+
+def test_keys_are_independent_and_shared_between_instances(tmp_path, clock):
+    first = RateLimiter(str(tmp_path), slots=1024)
+    second = RateLimiter(str(tmp_path), slots=1024)
+    first.hit([('ip:1', Limit(burst=1, per=60))])
+    assert second.hit([('ip:1', Limit(burst=1, per=60))]) > 0
+    assert second.hit([('ip:2', Limit(burst=1, per=60))]) == 0
+
+
+def test_disabled_never_limits(tmp_path):
+    limiter = RateLimiter(str(tmp_path), enabled=False)
+    assert all(limiter.hit([('ip:1', Limit(burst=1, per=60))]) == 0 for _ in range(5))
+
+
+def test_rejected_hit_creates_no_bucket(limiter, clock):
+    ip = ('ip:1', Limit(burst=1, per=60))
+    assert limiter.hit([ip]) == 0
+    assert used_slots(limiter) == 1
+    # Throttled by the IP bucket: the new account keys must not take slots
+    for i in range(50):
+        assert limiter.hit([ip, (f'account:{i}', Limit(burst=5, per=10))]) > 0
+    assert used_slots(limiter) == 1
+
+
+def test_rejected_hit_leaves_bucket_unchanged(limiter, clock):
+    rule = [('ip:1', Limit(burst=1, per=60))]
+    limiter.hit(rule)
+    before = bytes(limiter._map)
+    clock.now += 30
+    assert limiter.hit(rule) == pytest.approx(30)
+    assert bytes(limiter._map) == before
+
+
+def test_hash_depends_on_the_secret(tmp_path):
+    first = RateLimiter(str(tmp_path / 'a'), secret='one')
+    second = RateLimiter(str(tmp_path / 'b'), secret='two')
+    keys = [f'account:user{i}@example.com' for i in range(20)]
+    assert [first._hash(key) for key in keys] != [second._hash(key) for key in keys]
+    assert first._hash(keys[0]) == RateLimiter(str(tmp_path / 'c'), secret='one')._hash(keys[0])
+
+
+def test_new_keys_in_one_hit_never_share_a_slot(tmp_path, clock):
+    # One run of PROBE slots covers the whole table, so every key competes
+    limiter = RateLimiter(str(tmp_path), slots=ratelimit.PROBE)
+    one = Limit(burst=1, per=60)
+    for i in range(ratelimit.PROBE):
+        clock.now += 1
+        assert limiter.hit([(f'ip:old{i}', one)]) == 0
+    assert used_slots(limiter) == ratelimit.PROBE
+
+    clock.now += 1
+    assert limiter.hit([('ip:new', one), ('account:new', one)]) == 0
+    # Both keys kept their own bucket: each is empty now
+    assert limiter.hit([('ip:new', one)]) > 0
+    assert limiter.hit([('account:new', one)]) > 0
+    # ...and they took the two stalest slots, not one shared one
+    assert limiter.hit([('ip:old0', one)]) == 0
+    assert limiter.hit([('ip:old1', one)]) == 0
@@ -0,0 +1,117 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+import rollups
+
+
+class RecordingCursor:
+    def __init__(self, results=()):
+        self.statements = []
+        self.results = list(results)
+        self.result = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((' '.join(sql.split()), params))
+        self.result = self.results.pop(0) if sql.lstrip().startswith('SELECT') else []
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+def test_bump_daily_only_touches_given_columns():
+    cursor = RecordingCursor()
+    rollups.bump_daily(cursor, datetime.datetime(2026, 3, 1, 12), revenue=Decimal('5'), payments=0, signups=2)
+    [(sql, params)] = cursor.statements
+    assert sql == ('INSERT INTO stats_daily (day, revenue, signups) VALUES (%s, %s, %s) '
+                   'ON DUPLICATE KEY UPDATE revenue = revenue + VALUES(revenue), signups = signups + VALUES(signups)')
+    assert params == [datetime.date(2026, 3, 1), Decimal('5'), 2]
+
+
+def test_bump_with_nothing_to_add_is_skipped():
+    cursor = RecordingCursor()
+    rollups.bump_daily(cursor, None, contacts=0)
+    rollups.bump_totals(cursor, unread_contacts=0)
+    assert cursor.statements == []
+
+
+def test_bump_totals_writes_every_gauge_to_one_slot_in_one_statement():
+    cursor = RecordingCursor()
+    rollups.bump_totals(cursor, total_users=1, active_users=1)
+    [(sql, params)] = cursor.statements
+    assert sql.count('(%s, %s, %s)') == 2
+    assert params[0::3] == ['total_users', 'active_users']
+    assert params[1] == params[4] and 0 <= params[1] < rollups.TOTALS_SLOTS
+    assert params[2::3] == [1, 1]
+
+
+def test_record_contacts_counts_per_day_and_in_total():
+    cursor = RecordingCursor()
+    rollups.record_contacts(cursor, {datetime.date(2026, 3, 1): 2, datetime.date(2026, 3, 2): 1})
+    daily = [params for sql, params in cursor.statements if 'stats_daily' in sql]
+    assert daily == [[datetime.date(2026, 3, 1), 2], [datetime.date(2026, 3, 2), 1]]
+    [(_, totals)] = [item for item in cursor.statements if 'stats_totals' in item[0]]
+    assert totals[0::3] == ['unread_contacts'] and totals[2] == 3
+
+
+def test_blocking_changes_active_users_only_on_a_real_change():
+    cursor = RecordingCursor()
+    rollups.record_user_status(cursor, 1, True)
+    assert cursor.statements == []
+    rollups.record_user_status(cursor, 1, False)
+    assert [params[-1] for _, params in cursor.statements] == [-1, -1]
+
+
+def test_user_delete_subtracts_cascaded_payments():
+    signup = datetime.datetime(2026, 1, 5, 9)
+    cursor = RecordingCursor(results=[
+        [(1, signup)],
+        [(datetime.date(2026, 2, 1), Decimal('99000'), 1), (datetime.date(2026, 3, 1), Decimal('198000'), 2)],
+    ])
+    rollups.record_user_delete(cursor, 7)
+    daily = [params for sql, params in cursor.statements if sql.startswith('INSERT INTO stats_daily')]
+    assert daily == [[datetime.date(2026, 2, 1), Decimal('-99000'), -1],
+                     [datetime.date(2026, 3, 1), Decimal('-198000'), -2],
+                     [datetime.date(2026, 1, 5), -1],
+                     [datetime.date.today(), -1]]
+    [(_, totals)] = [item for item in cursor.statements if item[0].startswith('INSERT INTO stats_totals')]
+    assert dict(zip(totals[0::3], totals[2::3])) == {
+        'total_users': -1, 'active_users': -1, 'total_revenue': Decimal('-297000')}
+
+
+def test_user_delete_of_missing_user_does_nothing():
+    cursor = RecordingCursor(results=[[]])
+    rollups.record_user_delete(cursor, 7)
+    assert len(cursor.statements) == 1
+
+
+def test_totals_fill_missing_gauges_and_convert_counts():
+    cursor = RecordingCursor(results=[[('total_users', Decimal('12')), ('total_revenue', Decimal('5.50'))]])
+    assert rollups.totals(cursor) == {'total_users': 12, 'active_users': 0,
+                                      'total_revenue': Decimal('5.50'), 'unread_contacts': 0}
+
+
+def test_running_series_starts_from_the_level_before_start():
+    cursor = RecordingCursor(results=[[(10,)], [('2026-01', 3), ('2026-02', -1)]])
+    assert rollups.running_series(cursor, 'active_users', '2026-01-01', '2026-03-01') == [
+        ('2026-01', 13), ('2026-02', 12)]
+
+
+def test_series_rejects_unknown_columns():
+    with pytest.raises(ValueError):
+        rollups.series(RecordingCursor(), 'amount; DROP TABLE users', '2026-01-01', '2026-02-01')
+
+
+def test_rebuild_recomputes_every_table_from_scratch():
+    cursor = RecordingCursor()
+    rollups.rebuild(cursor)
+    statements = [sql for sql, _ in cursor.statements]
+    assert statements.index('DELETE FROM stats_daily') < min(
+        i for i, sql in enumerate(statements) if sql.startswith('INSERT INTO stats_daily'))
+    assert statements.index('DELETE FROM stats_totals') < min(
+        i for i, sql in enumerate(statements) if sql.startswith('INSERT INTO stats_totals'))
+    assert sum(sql.startswith('INSERT INTO stats_daily') for sql in statements) == 3
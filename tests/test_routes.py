@@ -0,0 +1,422 @@
+import datetime
+import gzip
+import os
+import re
+import tempfile
+
+import pytest
+
+# Caches, rate-limit buckets and metrics go to a throwaway directory
+os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='balansai-test-'))
+os.environ.setdefault('RATE_LIMIT', '0')
+
+import app as app_module  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def execute(self, sql, params=None):
+        self.db.executed.append((sql, params))
+        self.rows = list(self.db.answer(sql, params))
+        self.rowcount = len(self.rows)
+
+    def executemany(self, sql, params):
+        for row in params:
+            self.execute(sql, row)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def ping(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    """Answers each statement with the rows of the first handler whose
+    pattern occurs in it; anything else gets no rows"""
+
+    def __init__(self):
+        self.handlers = []
+        self.executed = []
+
+    def on(self, pattern, answer):
+        self.handlers.append((pattern, answer))
+
+    def answer(self, sql, params):
+        for pattern, answer in self.handlers:
+            if re.search(pattern, sql):
+                return answer(params) if callable(answer) else answer
+        return []
+
+    def queries(self, pattern):
+        return [(sql, params) for sql, params in self.executed if re.search(pattern, sql)]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    # A fresh pool, and no cached values, per test
+    monkeypatch.setattr(app_module.mysql, '_pool', None)
+    monkeypatch.setattr(app_module.mysql.pool, '_connect', lambda: FakeConnection(fake))
+    for cache in (app_module.cache, app_module.pages, app_module.profiles):
+        cache.clear()
+    return fake
+
+
+@pytest.fixture
+def client(db):
+    app_module.app.config['TESTING'] = True
+    return app_module.app.test_client()
+
+
+# ---- sitemap ----
+
+def published_posts(ids):
+    return [(post_id, f'post-{post_id}', datetime.datetime(2026, 1, post_id % 28 + 1)) for post_id in ids]
+
+
+def serve_posts(db, posts):
+    """Answer the sitemap queries from ``posts`` the way MySQL would"""
+    def shards(params):
+        width, = params
+        by_shard = {}
+        for post_id, _, updated_at in posts:
+            count, latest = by_shard.get(post_id // width, (0, updated_at))
+            by_shard[post_id // width] = (count + 1, max(latest, updated_at))
+        return [(shard, count, latest) for shard, (count, latest) in sorted(by_shard.items())]
+
+    def shard_posts(params):
+        start, end = params
+        return [(slug, updated_at) for post_id, slug, updated_at in posts if start <= post_id < end]
+
+    db.on(r'id DIV %s', shards)
+    db.on(r'id >= %s AND id < %s', shard_posts)
+
+
+def locs(body):
+    return re.findall(r'<loc>(.*?)</loc>', body)
+
+
+def test_sitemap_lists_pages_and_posts_in_one_urlset_under_the_limit(client, db):
+    serve_posts(db, published_posts([1, 2, 3]))
+
+    response = client.get('/sitemap.xml')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert '<urlset' in body
+    urls = locs(body)
+    assert f'{app_module.SITE_URL}/pricing' in urls
+    assert [url for url in urls if '/blog/post-' in url] == [
+        f'{app_module.SITE_URL}/blog/post-{n}' for n in (1, 2, 3)]
+    assert not any('/admin' in url or '/sitemap' in url for url in urls)
+
+
+def test_sitemap_becomes_an_index_of_shards_over_the_limit(client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'SITEMAP_MAX_URLS', 5)
+    # Shards 0 and 2 have posts, shard 1 is empty
+    serve_posts(db, published_posts([1, 2, 3, 4, 11, 12]))
+
+    body = client.get('/sitemap.xml').get_data(as_text=True)
+    assert '<sitemapindex' in body
+    assert locs(body) == [f'{app_module.SITE_URL}/sitemap-pages.xml.gz',
+                          f'{app_module.SITE_URL}/sitemap-posts-0.xml.gz',
+                          f'{app_module.SITE_URL}/sitemap-posts-2.xml.gz']
+    assert db.queries(r'id DIV %s')[0][1] == (5,)
+
+
+def test_shard_sitemap_holds_the_posts_of_its_id_range(client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'SITEMAP_MAX_URLS', 5)
+    serve_posts(db, published_posts([1, 2, 3, 4, 11, 12]))
+
+    response = client.get('/sitemap-posts-2.xml.gz')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    assert locs(gzip.decompress(response.data).decode()) == [
+        f'{app_module.SITE_URL}/blog/post-11', f'{app_module.SITE_URL}/blog/post-12']
+    assert db.queries(r'id >= %s AND id < %s')[-1][1] == (10, 15)
+
+
+@pytest.mark.parametrize('shard', [1, 3, 999])
+def test_shard_past_the_end_or_without_posts_is_404(client, db, monkeypatch, shard):
+    monkeypatch.setattr(app_module, 'SITEMAP_MAX_URLS', 5)
+    serve_posts(db, published_posts([1, 2, 11]))
+
+    assert client.get(f'/sitemap-posts-{shard}.xml.gz').status_code == 404
+    assert not db.queries(r'id >= %s AND id < %s')
+
+
+def test_shard_sitemap_answers_a_conditional_get_with_304(client, db):
+    serve_posts(db, published_posts([1]))
+    first = client.get('/sitemap-posts-0.xml.gz')
+    again = client.get('/sitemap-posts-0.xml.gz', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+
+# ---- signed-in users ----
+
+def user_row(user_id, is_active=1, full_name='Ali Valiyev'):
+    return (user_id, full_name, f'user{user_id}@example.com', None, None, 'free', is_active, None,
+            datetime.datetime(2026, 1, 1))
+
+
+def sign_in(client, db, user_id=7, users=None):
+    """Log ``user_id`` in; ``users`` maps ids to their current rows"""
+    users = users if users is not None else {user_id: user_row(user_id)}
+    db.on(r'FROM users WHERE id = %s', lambda params: [users[params[0]]] if params[0] in users else [])
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['user_name'] = users[user_id][1]
+    return users
+
+
+# ---- chat ----
+
+def test_chat_send_is_refused_with_503_when_every_stream_slot_is_taken(client, db, monkeypatch):
+    sign_in(client, db)
+    streams = app_module.threading.BoundedSemaphore(1)
+    monkeypatch.setattr(app_module, 'chat_streams', streams)
+    streams.acquire()
+
+    response = client.post('/chat/send', json={'message': 'Salom'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert not db.queries(r'INSERT INTO')
+
+
+def test_chat_send_streams_the_reply_and_frees_its_slot(client, db, monkeypatch):
+    sign_in(client, db)
+    streams = app_module.threading.BoundedSemaphore(1)
+    monkeypatch.setattr(app_module, 'chat_streams', streams)
+    monkeypatch.setattr(app_module, 'chat_backend',
+                        app_module.chat.StubBackend(tokens=3, first_token_delay=0, token_delay=0))
+
+    response = client.post('/chat/send', json={'message': 'Salom'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = re.findall(r'^event: (\w+)$', response.get_data(as_text=True), re.MULTILINE)
+    response.close()
+    assert events == ['meta', 'token', 'token', 'token', 'done']
+    # The slot is free again once the response is closed
+    assert streams.acquire(blocking=False)
+
+
+# ---- chat history window ----
+
+class WindowCursor:
+    """Returns ``rows`` (newest first, as MySQL would) cut to the query's LIMIT"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+        self.result = self.rows[:params[-1]]
+
+    def fetchall(self):
+        return self.result
+
+
+def messages(count):
+    start = datetime.datetime(2026, 3, 1, 9, 0)
+    return [(n, 'user' if n % 2 else 'assistant', f'xabar {n}', start + datetime.timedelta(minutes=n))
+            for n in range(count, 0, -1)]
+
+
+def test_chat_window_returns_the_newest_messages_oldest_first():
+    cursor = WindowCursor(messages(50))
+    window, older = app_module.load_chat_window(cursor, 3, 7, limit=10)
+
+    assert [message.id for message in window] == list(range(41, 51))
+    assert older == app_module.encode_cursor([window[0].created_at, 41])
+    # One extra row is read to tell whether older messages exist
+    assert cursor.executed[0][1] == [3, 7, 11]
+
+
+def test_chat_window_has_no_older_cursor_when_everything_fits():
+    window, older = app_module.load_chat_window(WindowCursor(messages(4)), 3, 7, limit=10)
+    assert [message.id for message in window] == [1, 2, 3, 4]
+    assert older is None
+
+
+def test_chat_window_seeks_before_the_cursor():
+    cursor = WindowCursor(messages(5))
+    before = app_module.encode_cursor([datetime.datetime(2026, 3, 1, 9, 30), 30])
+    app_module.load_chat_window(cursor, 3, 7, before=before, limit=10)
+    sql, params = cursor.executed[0]
+    assert 'm.conversation_id = c.id AND (' in sql
+    assert params[-3:] == [3, 7, 11]
+
+
+def test_chat_window_of_an_empty_owned_conversation_is_empty():
+    # The LEFT JOIN yields one all-NULL message row for an owned conversation
+    assert app_module.load_chat_window(WindowCursor([(None, None, None, None)]), 3, 7) == ([], None)
+
+
+def test_chat_window_of_someone_elses_conversation_is_none():
+    assert app_module.load_chat_window(WindowCursor([]), 3, 7) is None
+
+
+# ---- profile cache ----
+
+def test_user_deactivated_by_an_admin_is_signed_out_on_the_next_request(client, db):
+    users = sign_in(client, db, user_id=7)
+
+    def update_user(params):
+        *fields, user_id = params
+        users[user_id] = user_row(user_id, is_active=fields[5], full_name=fields[0])
+        return []
+    db.on(r'UPDATE users\s+SET full_name', update_user)
+
+    assert client.get('/dashboard').status_code == 200
+    assert client.get('/dashboard').status_code == 200
+    # The second request was served from the profile cache
+    assert len(db.queries(r'FROM users WHERE id = %s')) == 1
+
+    admin = app_module.app.test_client()
+    with admin.session_transaction() as session:
+        session['admin_logged_in'] = True
+    response = admin.post('/admin/users/edit/7', data={
+        'full_name': 'Ali Valiyev', 'email': 'user7@example.com', 'plan_type': 'free'})
+    assert response.status_code == 302
+
+    response = client.get('/dashboard')
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/login')
+    with client.session_transaction() as session:
+        assert 'user_id' not in session
+
+
+def test_profile_tag_files_are_pruned_on_a_later_invalidation(db, monkeypatch):
+    monkeypatch.setattr(app_module, '_profile_tags_pruned_at',
+                        app_module.time.monotonic() - app_module.PROFILE_TAG_PRUNE_INTERVAL - 1)
+    profiles = app_module.profiles
+    stale = os.path.join(profiles.directory, 'user-999001.gen')
+    with open(stale, 'a'):
+        pass
+    old = (app_module.time.time() - 3 * app_module.PROFILE_CACHE_TTL) * 1e9
+    os.utime(stale, ns=(int(old), int(old)))
+
+    app_module.invalidate_user_profile(999002)
+    assert not os.path.exists(stale)
+    assert os.path.exists(os.path.join(profiles.directory, 'user-999002.gen'))
+
+
+# ---- fan-out ----
+
+def serve_blog(db):
+    db.on(r'SELECT DISTINCT category', [])
+    db.on(r'SELECT COUNT\(\*\) FROM blog_posts', [(3,)])
+
+
+def late(monkeypatch, *names, results=None):
+    """Make every fan-out batch time out with ``names`` unfinished"""
+    def run(tasks, timeout=None):
+        raise app_module.FanOutTimeout('too slow', results or {}, names)
+    monkeypatch.setattr(app_module.fanout, 'run', run)
+
+
+def test_warm_blog_listing_skips_the_fanout(client, db, monkeypatch):
+    serve_blog(db)
+    batches = []
+    run = app_module.fanout.run
+
+    def spy(tasks, timeout=None):
+        batches.append(set(tasks))
+        return run(tasks, timeout)
+    monkeypatch.setattr(app_module.fanout, 'run', spy)
+
+    assert client.get('/blog').status_code == 200
+    assert client.get('/blog').status_code == 200
+    assert batches == [{'total', 'page'}]
+
+
+def test_blog_listing_falls_back_to_the_stale_copy_on_timeout(client, db, monkeypatch):
+    serve_blog(db)
+    assert client.get('/blog').status_code == 200
+    app_module.cache.invalidate('blog')
+    late(monkeypatch, 'total', 'page')
+
+    assert client.get('/blog').status_code == 200
+
+
+def test_blog_listing_is_503_on_timeout_without_a_cached_copy(client, db, monkeypatch):
+    serve_blog(db)
+    late(monkeypatch, 'total', 'page')
+
+    response = client.get('/blog')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+
+def test_admin_dashboard_renders_without_the_late_widgets(client, db, monkeypatch):
+    late(monkeypatch, 'totals', 'revenue', results={'signups': [('2026-01', 4)], 'active': []})
+    with client.session_transaction() as session:
+        session['admin_logged_in'] = True
+
+    response = client.get('/admin')
+    assert response.status_code == 200
+    assert '—' in response.get_data(as_text=True)
+
+
+def test_user_dashboard_renders_without_the_late_widgets(client, db, monkeypatch):
+    sign_in(client, db)
+    late(monkeypatch, 'payments', results={'conversations': []})
+
+    assert client.get('/dashboard').status_code == 200
+
+
+# ---- benchmark ----
+
+def test_benchmark_steps_are_labelled_with_real_endpoints():
+    import benchmark
+    endpoints = {rule.endpoint for rule in app_module.app.url_map.iter_rules()}
+    labels = {step[1] for _, setup, steps in benchmark.PERSONAS.values() for step in setup + steps}
+    assert labels <= endpoints
+
+
+# ---- admin user search ----
+
+@pytest.mark.parametrize('limit, sent', [('0', 1), ('-5', 1), ('500', 50), ('abc', 10)])
+def test_admin_user_search_limit_is_kept_between_1_and_50(client, db, limit, sent):
+    with client.session_transaction() as session:
+        session['admin_logged_in'] = True
+
+    response = client.get(f'/admin/users/search?q=ali&limit={limit}')
+    assert response.status_code == 200
+    assert response.get_json() == []
+    sql, params = db.executed[-1]
+    assert 'LIMIT' in sql and params[-1] == sent
@@ -0,0 +1,47 @@
+import pytest
+
+import rows
+from rows import fetchall, fetchone, row_type
+
+
+class FakeCursor:
+    def __init__(self, result):
+        self.result = list(result)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+def test_fields_are_named_after_the_select_expressions():
+    Row = row_type('Row', ['u.id', 'u.full_name', 'SUM(p.amount) AS total', 'created_at'])
+    assert Row._fields == ('id', 'full_name', 'total', 'created_at')
+    assert Row.columns == 'u.id, u.full_name, SUM(p.amount) AS total, created_at'
+
+
+def test_rows_stay_as_small_as_tuples():
+    assert rows.BlogCard.__slots__ == ()
+    card = rows.BlogCard._make(range(10))
+    assert card.title == 1 and card == tuple(range(10))
+
+
+def test_same_column_list_returns_the_same_type():
+    first = row_type('Pair', ['a', 'b'])
+    assert row_type('Pair', ('a', 'b')) is first
+    assert row_type('Pair', ['a', 'c']) is not first
+    assert row_type('Other', ['a', 'b']) is not first
+
+
+def test_duplicate_field_names_are_rejected():
+    with pytest.raises(ValueError):
+        row_type('Clash', ['u.id', 'p.id'])
+
+
+def test_fetchone_and_fetchall_wrap_driver_rows():
+    Row = row_type('Row', ['id', 'name'])
+    assert fetchone(FakeCursor([(1, 'a')]), Row) == Row(1, 'a')
+    assert fetchone(FakeCursor([]), Row) is None
+    assert fetchall(FakeCursor([(1, 'a'), (2, 'b')]), Row) == [Row(1, 'a'), Row(2, 'b')]
+    assert fetchall(FakeCursor([]), Row) == []
@@ -0,0 +1,48 @@
+from user_search import EXACT_BONUS, WEIGHTS, match_clause, query_terms, terms_for_user
+
+
+def test_terms_are_word_prefixes_with_field_weights():
+    terms = terms_for_user('Ali Valiyev', 'ali.v@mail.uz', None, 'Balans')
+    assert {'al', 'ali', 'va', 'valiyev'} <= set(terms)
+    assert 'a' not in terms and 'v' not in terms
+    assert terms['ali'] == WEIGHTS['name'] + EXACT_BONUS
+    assert terms['val'] == WEIGHTS['name']
+    assert terms['mail'] == WEIGHTS['email'] - 1 + EXACT_BONUS
+    assert terms['balans'] == WEIGHTS['company'] + EXACT_BONUS
+
+
+def test_field_with_the_highest_weight_wins():
+    terms = terms_for_user('Sardor', 'sardor@x.uz', None, 'Sardor Group')
+    assert terms['sardor'] == WEIGHTS['name'] + EXACT_BONUS
+
+
+def test_phone_variants():
+    terms = terms_for_user('Ali', None, '+998 (90) 123-45-67', None)
+    for prefix in ('99890', '90123', '12345'):
+        assert prefix in terms
+    assert '901234567' in terms and '1234567' in terms
+
+
+def test_query_terms_join_phone_numbers_and_skip_short_words():
+    assert query_terms('+998 90 123-45-67') == ['998901234567']
+    assert query_terms('Ali a ALI valiyev') == ['ali', 'valiyev']
+    assert query_terms('') == []
+
+
+def test_match_clause_uses_the_index():
+    clause, params = match_clause('ali vali')
+    assert 'user_search_terms' in clause
+    assert params == ['ali', 'vali', 2]
+
+
+def test_short_query_falls_back_to_prefix_scan():
+    clause, params = match_clause('A')
+    assert 'LIKE' in clause and 'user_search_terms' not in clause
+    assert params == ['a%', '% a%', 'a%']
+    clause, params = match_clause('a b')
+    assert clause.count(' AND ') == 1
+    assert len(params) == 6
+
+
+def test_query_without_words_matches_nobody():
+    assert match_clause('@-!') == ('1=0', [])
@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+
+import MySQLdb
+import pytest
+
+from view_counter import ViewCounter
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, sql, params=None):
+        self.db.updates.append((sql, params))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        pass
+
+
+class FakeDB:
+    """Stands in for MySQLPool: ``db.pool.connection()``"""
+
+    def __init__(self):
+        self.fail = False
+        self.updates = []
+        self.pool = self
+
+    @contextmanager
+    def connection(self):
+        if self.fail:
+            raise MySQLdb.OperationalError(2003, "Can't connect to MySQL server")
+        yield FakeConnection(self)
+
+    def counts(self):
+        """``{post_id: views}`` of the last UPDATE"""
+        sql, params = self.updates[-1]
+        cases = sql.count('WHEN')
+        return dict(zip(params[0:2 * cases:2], params[1:2 * cases:2]))
+
+
+@pytest.fixture
+def counter(monkeypatch):
+    counter = ViewCounter(FakeDB(), max_pending=5, max_retry=10)
+    monkeypatch.setattr(counter, '_ensure_thread', lambda: None)
+    yield counter
+    # atexit flushes every counter; leave nothing for it to write
+    counter._pending.clear()
+
+
+def test_flush_writes_one_batched_update(counter):
+    for post_id in (1, 2, 1, 3, 1):
+        counter.increment(post_id)
+    counter.flush()
+    [(sql, params)] = counter.db.updates
+    assert sql.startswith('UPDATE blog_posts SET views = views + CASE id')
+    assert 'updated_at = updated_at' in sql
+    assert counter.db.counts() == {1: 3, 2: 1, 3: 1}
+    assert params[-3:] == [1, 2, 3]
+    counter.flush()
+    assert len(counter.db.updates) == 1
+
+
+def test_max_pending_wakes_the_flusher(counter):
+    for _ in range(4):
+        counter.increment(1)
+    assert not counter._wakeup.is_set()
+    counter.increment(2)
+    assert counter._wakeup.is_set()
+
+
+def test_failed_flush_requeues_counts(counter):
+    counter.increment(1, 2)
+    counter.db.fail = True
+    counter.flush()
+    counter.increment(1)
+    counter.db.fail = False
+    counter.flush()
+    assert counter.db.counts() == {1: 3}
+
+
+def test_requeued_counts_do_not_trigger_flushes(counter):
+    counter.increment(1, 4)
+    counter.db.fail = True
+    counter.flush()
+    counter.increment(2)
+    assert not counter._wakeup.is_set()
+
+
+def test_requeue_is_capped(counter, caplog):
+    counter.increment(1, 8)
+    counter.increment(2, 3)
+    counter.increment(3, 1)
+    counter.db.fail = True
+    counter.flush()
+    assert counter._pending == {1: 8, 2: 2}
+    assert 'dropped 2 views' in caplog.text
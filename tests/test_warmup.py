@@ -0,0 +1,66 @@
+from flask import Flask, render_template_string
+
+import warmup
+from warmup import compile_templates, format_timings, warm_up
+
+
+def make_app(calls):
+    app = Flask(__name__)
+
+    @app.route('/')
+    def index():
+        calls.append('/')
+        return render_template_string('salom')
+
+    @app.route('/broken')
+    def broken():
+        calls.append('/broken')
+        raise RuntimeError('database is down')
+
+    @app.route('/pricing')
+    def pricing():
+        calls.append('/pricing')
+        return 'tariflar'
+
+    return app
+
+
+def test_renders_each_page_once_and_keeps_going_past_a_failure():
+    calls = []
+    beats = []
+    timings = warm_up(make_app(calls), ['/', '/broken', '/pricing'], notify=lambda: beats.append(1))
+
+    assert calls == ['/', '/broken', '/pricing']
+    assert {path: status for path, (status, _) in timings.items()} == {
+        '/': 200, '/broken': 500, '/pricing': 200}
+    assert len(beats) == 3
+
+
+def test_request_that_raises_counts_as_500():
+    calls = []
+    app = make_app(calls)
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    timings = warm_up(app, ['/broken', '/'])
+    assert timings['/broken'][0] == 500
+    assert calls == ['/broken', '/']
+
+
+def test_stops_when_the_budget_is_spent(monkeypatch):
+    clock = iter([0.0, 0.0, 5.0, 11.0])
+
+    class FakeTime:
+        monotonic = staticmethod(lambda: next(clock))
+        perf_counter = staticmethod(lambda: 0.0)
+    monkeypatch.setattr(warmup, 'time', FakeTime)
+    calls = []
+    timings = warm_up(make_app(calls), ['/', '/pricing', '/broken'], budget=10)
+    assert list(timings) == ['/', '/pricing']
+
+
+def test_compile_templates_loads_every_template(tmp_path):
+    (tmp_path / 'a.html').write_text('{{ x }}')
+    (tmp_path / 'b.html').write_text('{% extends "a.html" %}')
+    app = Flask(__name__, template_folder=str(tmp_path))
+    count, _ = compile_templates(app.jinja_env)
+    assert count == 2
+    assert format_timings({'/': (200, 0.012)}) == '/ 200 12ms'
@@ -0,0 +1,160 @@
+"""Prefix index for admin user search.
+
+Every user is broken into search terms: the prefixes of each word of the
+name, company and email (local part and domain), and of the phone number's
+digits (with and without the 998 country code, and the last seven digits).
+Terms live in ``user_search_terms`` with primary key ``(term, user_id)``, so
+a query is a handful of index range scans instead of ``LIKE '%x%'`` over
+the whole table.
+"""
+import re
+
+MIN_TERM = 2
+MAX_TERM = 32
+
+# Field weights; a term that is a whole word scores EXACT_BONUS extra
+WEIGHTS = {'name': 4, 'email': 3, 'phone': 3, 'company': 1}
+EXACT_BONUS = 2
+
+_word_re = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def _words(text):
+    return _word_re.findall((text or '').lower())
+
+
+def _add_prefixes(terms, word, weight):
+    word = word[:MAX_TERM]
+    for length in range(MIN_TERM, len(word) + 1):
+        term = word[:length]
+        score = weight + (EXACT_BONUS if length == len(word) else 0)
+        if score > terms.get(term, 0):
+            terms[term] = score
+
+
+def terms_for_user(full_name, email, phone, company):
+    """Map each search term of a user to its weight"""
+    terms = {}
+    for word in _words(full_name):
+        _add_prefixes(terms, word, WEIGHTS['name'])
+
+    local, _, domain = (email or '').partition('@')
+    for word in _words(local):
+        _add_prefixes(terms, word, WEIGHTS['email'])
+    for word in _words(domain):
+        _add_prefixes(terms, word, WEIGHTS['email'] - 1)
+
+    digits = re.sub(r'\D', '', phone or '')
+    if digits:
+        variants = {digits, digits[-7:]}
+        if digits.startswith('998'):
+            variants.add(digits[3:])
+        for variant in variants:
+            _add_prefixes(terms, variant, WEIGHTS['phone'])
+
+    for word in _words(company):
+        _add_prefixes(terms, word, WEIGHTS['company'])
+    return terms
+
+
+def query_terms(q):
+    """Search terms for a query string; words shorter than MIN_TERM are ignored"""
+    # "+998 90 123-45-67" is one phone number, not four words
+    q = re.sub(r'(?<=\d)[\s\-()]+(?=\d)', '', q or '')
+    terms = []
+    for word in _words(q):
+        term = word[:MAX_TERM]
+        if len(term) >= MIN_TERM and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def index_user(cursor, user_id, full_name, email, phone, company):
+    """(Re)write the index rows of one user; call in the same transaction as the write"""
+    cursor.execute("DELETE FROM user_search_terms WHERE user_id = %s", (user_id,))
+    terms = terms_for_user(full_name, email, phone, company)
+    if terms:
+        cursor.executemany(
+            "INSERT INTO user_search_terms (term, user_id, weight) VALUES (%s, %s, %s)",
+            [(term, user_id, weight) for term, weight in terms.items()]
+        )
+
+
+def reindex_user(cursor, user_id):
+    """Reindex a user from its current row"""
+    cursor.execute("SELECT full_name, email, phone, company FROM users WHERE id = %s", (user_id,))
+    user = cursor.fetchone()
+    if user:
+        index_user(cursor, user_id, *user)
+
+
+def match_clause(q):
+    """SQL condition restricting ``users`` rows to matches of ``q``, with its params.
+
+    A query made only of words shorter than MIN_TERM has no index terms; it
+    falls back to a ``LIKE 'x%'`` scan of names and emails instead of
+    matching everyone. A query with no words at all matches nobody.
+    """
+    terms = query_terms(q)
+    if not terms:
+        words = _words(q)
+        if not words:
+            return "1=0", []
+        # Words are letters and digits only, so nothing needs LIKE escaping
+        clauses = ["(full_name LIKE %s OR full_name LIKE %s OR email LIKE %s)"] * len(words)
+        params = []
+        for word in words:
+            params.extend([f'{word}%', f'% {word}%', f'{word}%'])
+        return " AND ".join(clauses), params
+    return (
+        "id IN (SELECT user_id FROM user_search_terms WHERE term IN ({}) "
+        "GROUP BY user_id HAVING COUNT(*) = %s)".format(', '.join(['%s'] * len(terms))),
+        terms + [len(terms)]
+    )
+
+
+def search(cursor, q, limit=10):
+    """Ranked matches for a typeahead query: users must match every word"""
+    terms = query_terms(q)
+    if not terms:
+        return []
+
+    cursor.execute("""
+        SELECT u.id, u.full_name, u.email, u.phone, u.company, u.plan_type, u.is_active, m.score
+        FROM (
+            SELECT user_id, SUM(weight) AS score
+            FROM user_search_terms
+            WHERE term IN ({})
+            GROUP BY user_id
+            HAVING COUNT(*) = %s
+            ORDER BY score DESC, user_id DESC
+            LIMIT %s
+        ) m
+        JOIN users u ON u.id = m.user_id
+        ORDER BY m.score DESC, u.id DESC
+    """.format(', '.join(['%s'] * len(terms))), terms + [len(terms), limit])
+    return cursor.fetchall()
+
+
+def rebuild(cursor, batch_size=1000):
+    """Reindex every user (caller commits)"""
+    cursor.execute("DELETE FROM user_search_terms")
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, full_name, email, phone, company FROM users
+            WHERE id > %s ORDER BY id LIMIT %s
+        """, (last_id, batch_size))
+        users = cursor.fetchall()
+        if not users:
+            break
+        rows = []
+        for user in users:
+            rows.extend((term, user[0], weight)
+                        for term, weight in terms_for_user(*user[1:]).items())
+        if rows:
+            cursor.executemany(
+                "INSERT INTO user_search_terms (term, user_id, weight) VALUES (%s, %s, %s)",
+                rows
+            )
+        last_id = users[-1][0]
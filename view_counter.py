@@ -0,0 +1,117 @@
+"""Write-behind blog view counter.
+
+Page views are counted in memory per worker and written to
+``blog_posts.views`` in one batched UPDATE every ``flush_interval`` seconds
+(or sooner once ``max_pending`` views have piled up). At most one interval
+of views is lost if a worker is killed without running its exit hooks.
+
+A failed flush keeps its counts for the next one, up to ``max_retry`` views;
+past that (a long database outage) the smallest counts are dropped and the
+loss is logged.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """Buffers ``views = views + 1`` increments and flushes them in batches"""
+
+    def __init__(self, db, flush_interval=5.0, max_pending=1000, max_retry=10000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retry = max_retry
+
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._total = 0
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        atexit.register(self.flush)
+
+    def increment(self, post_id, amount=1):
+        """Record a view; never touches the database"""
+        self._ensure_thread()
+        with self._lock:
+            self._pending[post_id] += amount
+            self._total += amount
+            full = self._total >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        # After a fork only the calling thread survives, so each worker
+        # starts its own flusher (and drops counts inherited from the master)
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                self._pending.clear()
+                self._total = 0
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write buffered increments in a single UPDATE statement"""
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, Counter()
+            self._total = 0
+
+        ids = list(batch)
+        cases = ' '.join(['WHEN %s THEN %s'] * len(ids))
+        placeholders = ', '.join(['%s'] * len(ids))
+        params = []
+        for post_id in ids:
+            params.extend([post_id, batch[post_id]])
+        params.extend(ids)
+
+        try:
+            with self.db.pool.connection() as conn:
+                cursor = conn.cursor()
+                # Keep updated_at: a view is not an edit (sitemap lastmod relies on it)
+                cursor.execute(
+                    f"UPDATE blog_posts SET views = views + CASE id {cases} ELSE 0 END, "
+                    f"updated_at = updated_at WHERE id IN ({placeholders})",
+                    params
+                )
+                conn.commit()
+                cursor.close()
+        except Exception:
+            logger.exception("Failed to flush %d blog view counts, retrying later", sum(batch.values()))
+            self._requeue(batch)
+
+    def _requeue(self, batch):
+        """Keep a failed batch for the next flush, at most ``max_retry`` views of it"""
+        kept = Counter()
+        room = self.max_retry
+        for post_id, count in batch.most_common():
+            if room <= 0:
+                break
+            kept[post_id] = min(count, room)
+            room -= kept[post_id]
+        dropped = sum(batch.values()) - sum(kept.values())
+        if dropped:
+            logger.error("Blog view counts over the retry limit of %d, dropped %d views", self.max_retry, dropped)
+        # Not added to _total: only new views should bring the next flush
+        # forward, or an outage would turn every view into a flush attempt
+        with self._lock:
+            self._pending.update(kept)
@@ -0,0 +1,66 @@
+"""Template precompilation and worker warm-up.
+
+Templates are compiled once through a ``FileSystemBytecodeCache`` shared by
+every worker on the host, so a restart loads bytecode instead of parsing
+Jinja source again. ``compile_templates`` fills that cache (run by
+``flask compile-templates`` at build time) and, run in the gunicorn master
+before the fork, leaves every template compiled in memory for the workers.
+
+``warm_up`` then requests the hot pages once inside each new worker, before
+it accepts traffic, so the first visitors after a deploy or worker recycle
+don't pay for lazy setup (page and settings caches, pooled connections). The
+timings it returns are what gunicorn logs as the worker's cold start.
+"""
+import logging
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+logger = logging.getLogger(__name__)
+
+
+def bytecode_cache(directory):
+    os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory)
+
+
+def compile_templates(env):
+    """Load every template into ``env``; returns ``(count, seconds)``"""
+    start = time.perf_counter()
+    names = env.list_templates(filter_func=lambda name: not name.startswith('.'))
+    for name in names:
+        env.get_template(name)
+    return len(names), time.perf_counter() - start
+
+
+def warm_up(app, paths, budget=10.0, notify=None):
+    """Request each of ``paths`` once and return ``{path: (status, seconds)}``.
+
+    A failing page is logged and skipped (a request that raises counts as
+    500). Stops once ``budget`` seconds are spent, so a worker never misses
+    its boot timeout because MySQL is unreachable. ``notify`` is called
+    between requests (gunicorn's heartbeat).
+    """
+    client = app.test_client()
+    deadline = time.monotonic() + budget
+    timings = {}
+    for path in paths:
+        if time.monotonic() > deadline:
+            logger.warning("Warm-up budget of %gs spent, skipping the remaining pages", budget)
+            break
+        start = time.perf_counter()
+        try:
+            status = client.get(path).status_code
+        except Exception:
+            logger.exception("Warm-up request to %s failed", path)
+            status = 500
+        timings[path] = (status, time.perf_counter() - start)
+        if notify:
+            notify()
+    return timings
+
+
+def format_timings(timings):
+    return ', '.join(f'{path} {status} {seconds * 1000:.0f}ms'
+                     for path, (status, seconds) in timings.items())